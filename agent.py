@@ -1,22 +1,114 @@
+import asyncio
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from dataclasses import dataclass, asdict, field
+
 from langchain_openai.llms import OpenAI
+from agent_tools.chunking import sentence_spans
+from agent_tools.fused_analyzer import FusedAnalyzer, render_sections
 from agent_tools.grammar_checker import GrammarChecker
+from agent_tools.metrics import tool_call
+from agent_tools.schemas import FusedAnalysis
+from agent_tools.singleflight import SingleFlight, AsyncSingleFlight
 from agent_tools.tone_analyzer import ToneAnalyzer
 from agent_tools.tone_writer import ToneRewriter
 from smolagents import CodeAgent, HfApiModel
 
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class AnalysisResult:
+    """Output of the three tools, kept in separate sections."""
+
+    grammar_analysis: str
+    tone_analysis: str
+    tone_alternatives: str
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    def __str__(self):
+        # Same layout as the plain string returned by AlbanianTextAgent.forward
+        return self.grammar_analysis + "\n" + self.tone_analysis + "\n" + self.tone_alternatives + "\n"
+
+
+@dataclass
+class IncrementalState:
+    """What `forward_incremental` remembers about the previous submission of a session."""
+
+    text: str = ""
+    target_tone: str = ""
+    grammar_outputs: dict = field(default_factory=dict)
+    tone_results: str = None
+    tone_alternatives: str = None
+
+
+class LazyModel:
+    """Stand-in for a smolagents model that builds the real one on first use."""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._model = None
+
+    @property
+    def model(self):
+        if self._model is None:
+            self._model = self._factory()
+        return self._model
+
+    # Read by smolagents' Monitor when the agent is constructed; must not build the model
+    @property
+    def last_input_token_count(self):
+        return self._model.last_input_token_count if self._model is not None else None
+
+    @property
+    def last_output_token_count(self):
+        return self._model.last_output_token_count if self._model is not None else None
+
+    def __call__(self, *args, **kwargs):
+        return self.model(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+
 class AlbanianTextAgent(CodeAgent):
-    """Agent that analyzes and improves Albanian text."""
+    """
+    Agent that analyzes and improves Albanian text.
+
+    Args:
+        concurrent: Run the three tools side by side instead of one after another
+        tool_timeout: Seconds a tool call may take before its section becomes an error. It also
+            bounds each of the tools' LLM requests, since a thread running a tool cannot be
+            stopped: a tool that times out keeps its pool worker until its current request
+            returns or hits this same limit, so abandoned calls free their workers within about
+            `tool_timeout` (a tool making several requests, e.g. for a chunked text, can hold
+            a worker longer).
+        max_workers: Size of the thread pool shared by every analysis of this agent
+    """
 
-    def __init__(self):
-        # Initialize tools
-        grammar_checker = GrammarChecker()
-        tone_analyzer = ToneAnalyzer()
-        tone_rewriter = ToneRewriter()
+    def __init__(self, concurrent: bool = True, tool_timeout: float = 60, max_workers: int = 16, cache=None,
+                 tone_change_threshold: float = 0.25, max_sessions: int = 256, fused: bool = False,
+                 precheck: bool = False, tone_classifier=None, near_duplicate_cache=None):
+        # Initialize tools, sharing one response cache between them. With `precheck`, mechanical
+        # grammar errors are fixed locally and only the remaining sentences go to the LLM; with a
+        # `tone_classifier`, so are the tone analyses it is confident about. A `near_duplicate_cache`
+        # lets the tone tools reuse results of near-identical texts.
+        grammar_checker = GrammarChecker(cache=cache, precheck=precheck, llm_timeout=tool_timeout)
+        tone_analyzer = ToneAnalyzer(cache=cache, classifier=tone_classifier, near_duplicate_cache=near_duplicate_cache,
+                                     llm_timeout=tool_timeout)
+        tone_rewriter = ToneRewriter(cache=cache, near_duplicate_cache=near_duplicate_cache, llm_timeout=tool_timeout)
 
-        llm = HfApiModel(
+        # forward() never calls the code-agent model, so only build it if the agent is actually run
+        llm = LazyModel(lambda: HfApiModel(
             model_name="ai-journey/hermes-2-pro-mistral-7b",
             temperature=0.2
-        )
+        ))
 
         super().__init__(
             tools=[grammar_checker, tone_analyzer, tone_rewriter],
@@ -30,18 +122,380 @@ class AlbanianTextAgent(CodeAgent):
         self.tone_analyzer = tone_analyzer
         self.tone_rewriter = tone_rewriter
 
-    def forward(self, text: str, target_tone: str = "") -> dict:
-        results = ""
+        # Single-completion alternative to the three tools. It is not offered to the code agent,
+        # which should keep choosing between the individual tools.
+        self.fused = fused
+        self.fused_analyzer = FusedAnalyzer(cache=cache, llm_timeout=tool_timeout)
+
+        # The three tools are independent, so they can run side by side. The pool is shared by
+        # every request served by this agent, so size it for several analyses in flight at once.
+        self.concurrent = concurrent
+        self.tool_timeout = tool_timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="albanian-tool")
+
+        # Previous submissions for incremental re-analysis, most recently used last
+        self.tone_change_threshold = tone_change_threshold
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._sessions_lock = threading.Lock()
+
+        # Identical analyses submitted at the same time share one computation
+        self._in_flight = SingleFlight()
+        self._async_in_flight = AsyncSingleFlight()
+
+    def forward(self, text: str, target_tone: str = "", structured: bool = False):
+        """
+        Run grammar check, tone analysis and tone rewriting on `text`.
+
+        Returns the three tool outputs joined into one string, or an `AnalysisResult`
+        with a separate field per tool when `structured` is True. In fused mode all three
+        sections come from one completion, falling back to the separate tools if that
+        completion does not validate. Concurrent calls for the same text and target tone
+        share one analysis.
+        """
+        result = self._in_flight.do((text, target_tone or ""), lambda: self._analyze(text, target_tone))
+        return result if structured else str(result)
+
+    async def aforward(self, text: str, target_tone: str = "", structured: bool = False):
+        """Async counterpart of `forward`, running the three tools on the caller's event loop."""
+        result = await self._async_in_flight.do((text, target_tone or ""), lambda: self._aanalyze(text, target_tone))
+        return result if structured else str(result)
+
+    def coalescing_stats(self) -> dict:
+        """How many `forward`/`aforward` calls ran, and how many shared an identical call in flight."""
+        sync_stats, async_stats = self._in_flight.stats(), self._async_in_flight.stats()
+        return {name: sync_stats[name] + async_stats[name] for name in sync_stats}
+
+    def _analyze(self, text: str, target_tone: str) -> AnalysisResult:
+        if self.fused:
+            try:
+                analysis = self.forward_json(text, target_tone)
+                return AnalysisResult(*render_sections(analysis, target_tone or ""))
+            except Exception as e:
+                logger.warning("Fused analysis failed, falling back to separate tool calls: %s", e)
+
+        if self.concurrent:
+            grammar_results, tone_results, tone_alternatives = self._run_tools_concurrently(text, target_tone)
+        else:
+            grammar_results, tone_results, tone_alternatives = self._run_tools_sequentially(text, target_tone)
+
+        return AnalysisResult(str(grammar_results), str(tone_results), str(tone_alternatives))
+
+    async def _aanalyze(self, text: str, target_tone: str) -> AnalysisResult:
+        if self.fused:
+            try:
+                analysis = await self.aforward_json(text, target_tone)
+                return AnalysisResult(*render_sections(analysis, target_tone or ""))
+            except Exception as e:
+                logger.warning("Fused analysis failed, falling back to separate tool calls: %s", e)
+
+        grammar_results, tone_results, tone_alternatives = await asyncio.gather(
+            self._await_tool(self.grammar_checker.name, self.grammar_checker.aforward(text=text)),
+            self._await_tool(self.tone_analyzer.name, self.tone_analyzer.aforward(text=text)),
+            self._await_tool(self.tone_rewriter.name,
+                             self.tone_rewriter.aforward(text=text, target_tone=target_tone)),
+        )
+
+        return AnalysisResult(str(grammar_results), str(tone_results), str(tone_alternatives))
+
+    def forward_json(self, text: str, target_tone: str = "") -> FusedAnalysis:
+        """
+        Analyze `text` in JSON mode and return the validated fields.
+
+        Unlike `forward`, there is no text fallback: the call raises if the completion fails,
+        times out or does not match the schema, so callers can pick their own fallback.
+        """
+        return self._submit_tool(self.fused_analyzer.name, self.fused_analyzer.analyze, text, target_tone or "").result(
+            timeout=self.tool_timeout)
+
+    async def aforward_json(self, text: str, target_tone: str = "") -> FusedAnalysis:
+        """Async counterpart of `forward_json`."""
+        with tool_call(self.fused_analyzer.name):
+            return await asyncio.wait_for(self.fused_analyzer.aanalyze(text, target_tone or ""),
+                                          timeout=self.tool_timeout)
+
+    def forward_stream(self, text: str, target_tone: str = ""):
+        """
+        Yield `(section, chunk)` pairs as the three tools stream their completions.
 
-        # Step 1: Grammar check
-        grammar_results = self.grammar_checker.forward(text=text)
-        print(grammar_results)
-        results += grammar_results + "\n"
+        `section` is the `AnalysisResult` field the chunk belongs to. Chunks of different
+        sections are interleaved in arrival order; each section ends with a `None` chunk.
+        """
+        chunks = queue.Queue()
+        streams = {
+            "grammar_analysis": lambda: self.grammar_checker.forward_stream(text=text),
+            "tone_analysis": lambda: self.tone_analyzer.forward_stream(text=text),
+            "tone_alternatives": lambda: self.tone_rewriter.forward_stream(text=text, target_tone=target_tone),
+        }
+        tool_names = self._section_tool_names()
+        submitted = time.perf_counter()
 
-        # Step 2: Tone analysis
-        tone_results = self.tone_analyzer.forward(text=text)
-        results += tone_results + "\n"
-        # Step 3: Rewriting based on tone
-        tone_alternatives = self.tone_rewriter.forward(text=text, target_tone=target_tone)
-        results += tone_alternatives + "\n"
+        def pump(section, stream):
+            with tool_call(tool_names[section], queue_wait=time.perf_counter() - submitted) as call:
+                try:
+                    for chunk in stream():
+                        chunks.put((section, chunk))
+                        # The tools report failures as their only chunk
+                        if is_error_result(chunk):
+                            call.error = chunk
+                except Exception as e:
+                    call.error = str(e)
+                    chunks.put((section, str({"error": str(e)})))
+                finally:
+                    chunks.put((section, None))
+
+        for section, stream in streams.items():
+            self._executor.submit(pump, section, stream)
+
+        unfinished = set(streams)
+        while unfinished:
+            try:
+                section, chunk = chunks.get(timeout=self.tool_timeout)
+            except queue.Empty:
+                # No tool produced anything for a whole timeout: close the remaining sections
+                for section in sorted(unfinished):
+                    yield section, str({"error": f"{section} timed out after {self.tool_timeout} seconds"})
+                    yield section, None
+                return
+
+            if chunk is None:
+                unfinished.discard(section)
+            yield section, chunk
+
+    async def aforward_stream(self, text: str, target_tone: str = ""):
+        """Async counterpart of `forward_stream`, built on the tools' `astream`."""
+        chunks = asyncio.Queue()
+        streams = {
+            "grammar_analysis": self.grammar_checker.aforward_stream(text=text),
+            "tone_analysis": self.tone_analyzer.aforward_stream(text=text),
+            "tone_alternatives": self.tone_rewriter.aforward_stream(text=text, target_tone=target_tone),
+        }
+
+        tool_names = self._section_tool_names()
+
+        async def pump(section, stream):
+            with tool_call(tool_names[section]) as call:
+                try:
+                    async for chunk in stream:
+                        await chunks.put((section, chunk))
+                        if is_error_result(chunk):
+                            call.error = chunk
+                except Exception as e:
+                    call.error = str(e)
+                    await chunks.put((section, str({"error": str(e)})))
+                finally:
+                    await chunks.put((section, None))
+
+        tasks = [asyncio.create_task(pump(section, stream)) for section, stream in streams.items()]
+        unfinished = set(streams)
+        try:
+            while unfinished:
+                try:
+                    section, chunk = await asyncio.wait_for(chunks.get(), timeout=self.tool_timeout)
+                except asyncio.TimeoutError:
+                    for section in sorted(unfinished):
+                        yield section, str({"error": f"{section} timed out after {self.tool_timeout} seconds"})
+                        yield section, None
+                    return
+
+                if chunk is None:
+                    unfinished.discard(section)
+                yield section, chunk
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def forward_incremental(self, text: str, target_tone: str = "", session_id: str = "default",
+                            structured: bool = False):
+        """
+        Re-analyze `text` reusing what is still valid from the session's previous submission.
+
+        Grammar results are remembered per checked chunk of sentences, and only sentences that
+        are not covered by one of them are sent to the LLM, packed into chunks again. Tone analysis is only recomputed when more than
+        `tone_change_threshold` of the text changed. The rewrite covers the whole text, so it
+        is recomputed whenever the text or the target tone changed.
+        """
+        target_tone = target_tone or ""
+        with self._sessions_lock:
+            previous = self._sessions.get(session_id) or IncrementalState()
+
+        futures = [(self.grammar_checker.name,
+                    self._submit_tool(self.grammar_checker.name, self.grammar_checker.check_sentences, text,
+                                      previous.grammar_outputs))]
+        if previous.tone_results is None or changed_fraction(previous.text, text) > self.tone_change_threshold:
+            futures.append((self.tone_analyzer.name,
+                            self._submit_tool(self.tone_analyzer.name, self.tone_analyzer.forward, text=text)))
+        if previous.tone_alternatives is None or text != previous.text or target_tone != previous.target_tone:
+            futures.append((self.tone_rewriter.name,
+                            self._submit_tool(self.tone_rewriter.name, self.tone_rewriter.forward, text=text,
+                                              target_tone=target_tone)))
+
+        results = dict(zip([tool_name for tool_name, _ in futures], self._collect_results(futures)))
+        grammar = results[self.grammar_checker.name]
+        grammar_results, grammar_outputs = grammar if isinstance(grammar, tuple) else (grammar, {})
+        tone_results = results.get(self.tone_analyzer.name, previous.tone_results)
+        tone_alternatives = results.get(self.tone_rewriter.name, previous.tone_alternatives)
+
+        # Failed tool calls are reported but not remembered, so the next submission retries them
+        with self._sessions_lock:
+            self._sessions[session_id] = IncrementalState(
+                text, target_tone, grammar_outputs or previous.grammar_outputs,
+                None if is_error_result(tone_results) else tone_results,
+                None if is_error_result(tone_alternatives) else tone_alternatives
+            )
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+        result = AnalysisResult(str(grammar_results), str(tone_results), str(tone_alternatives))
+        return result if structured else str(result)
+
+    def forward_batch(self, texts: list, target_tones: list = None, max_concurrency: int = 4,
+                      structured: bool = False) -> list:
+        """
+        Analyze many texts, returning one result per text in input order.
+
+        Each tool processes the whole batch through LangChain's `batch` with at most
+        `max_concurrency` calls in flight; the three tool batches run side by side.
+        A failing item only affects its own result.
+
+        Raises:
+            ValueError: If `target_tones` is given and does not have one tone per text
+        """
+        check_target_tones(texts, target_tones)
+        target_tones = target_tones or [""] * len(texts)
+        grammar_future = self._submit_tool(self.grammar_checker.name, self.grammar_checker.forward_batch, texts,
+                                           max_concurrency)
+        tone_future = self._submit_tool(self.tone_analyzer.name, self.tone_analyzer.forward_batch, texts,
+                                        max_concurrency)
+        rewrite_future = self._submit_tool(self.tone_rewriter.name, self.tone_rewriter.forward_batch, texts,
+                                           target_tones, max_concurrency)
+
+        return self._combine_batch(grammar_future.result(), tone_future.result(), rewrite_future.result(),
+                                   structured)
+
+    async def aforward_batch(self, texts: list, target_tones: list = None, max_concurrency: int = 4,
+                             structured: bool = False) -> list:
+        """Async counterpart of `forward_batch`, built on LangChain's `abatch`."""
+        check_target_tones(texts, target_tones)
+        target_tones = target_tones or [""] * len(texts)
+        grammar_results, tone_results, tone_alternatives = await asyncio.gather(
+            self._acall_tool(self.grammar_checker.name, self.grammar_checker.aforward_batch(texts, max_concurrency)),
+            self._acall_tool(self.tone_analyzer.name, self.tone_analyzer.aforward_batch(texts, max_concurrency)),
+            self._acall_tool(self.tone_rewriter.name,
+                             self.tone_rewriter.aforward_batch(texts, target_tones, max_concurrency)),
+        )
+
+        return self._combine_batch(grammar_results, tone_results, tone_alternatives, structured)
+
+    @staticmethod
+    def _combine_batch(grammar_results: list, tone_results: list, tone_alternatives: list,
+                       structured: bool) -> list:
+        results = [
+            AnalysisResult(str(grammar), str(tone), str(alternatives))
+            for grammar, tone, alternatives in zip(grammar_results, tone_results, tone_alternatives)
+        ]
+        return results if structured else [str(result) for result in results]
+
+    async def _await_tool(self, tool_name: str, coroutine):
+        try:
+            return await self._acall_tool(tool_name, asyncio.wait_for(coroutine, timeout=self.tool_timeout))
+        except asyncio.TimeoutError:
+            return str({"error": f"{tool_name} timed out after {self.tool_timeout} seconds"})
+        except Exception as e:
+            return str({"error": str(e)})
+
+    def _submit_tool(self, tool_name: str, fn, *args, **kwargs):
+        """Run `fn` on the pool as one instrumented call of `tool_name`; returns its future."""
+        submitted = time.perf_counter()
+        return self._executor.submit(lambda: self._call_tool(tool_name, time.perf_counter() - submitted, fn,
+                                                             *args, **kwargs))
+
+    @staticmethod
+    def _call_tool(tool_name: str, queue_wait: float, fn, *args, **kwargs):
+        with tool_call(tool_name, queue_wait=queue_wait) as call:
+            result = fn(*args, **kwargs)
+            call.error = tool_error(result)
+            return result
+
+    @staticmethod
+    async def _acall_tool(tool_name: str, coroutine):
+        with tool_call(tool_name) as call:
+            result = await coroutine
+            call.error = tool_error(result)
+            return result
+
+    def _section_tool_names(self) -> dict:
+        return {"grammar_analysis": self.grammar_checker.name, "tone_analysis": self.tone_analyzer.name,
+                "tone_alternatives": self.tone_rewriter.name}
+
+    def _run_tools_concurrently(self, text: str, target_tone: str):
+        """Fan out the three tool calls and collect them in grammar, tone, rewrite order."""
+        futures = [
+            (self.grammar_checker.name, self._submit_tool(self.grammar_checker.name, self.grammar_checker.forward,
+                                                          text=text)),
+            (self.tone_analyzer.name, self._submit_tool(self.tone_analyzer.name, self.tone_analyzer.forward,
+                                                        text=text)),
+            (self.tone_rewriter.name, self._submit_tool(self.tone_rewriter.name, self.tone_rewriter.forward,
+                                                        text=text, target_tone=target_tone)),
+        ]
+        return self._collect_results(futures)
+
+    def _run_tools_sequentially(self, text: str, target_tone: str):
+        """Run grammar check, tone analysis and rewriting one after another, each within `tool_timeout`."""
+        calls = [
+            (self.grammar_checker.name, self.grammar_checker.forward, {"text": text}),
+            (self.tone_analyzer.name, self.tone_analyzer.forward, {"text": text}),
+            (self.tone_rewriter.name, self.tone_rewriter.forward, {"text": text, "target_tone": target_tone}),
+        ]
+        return [self._collect_results([(tool_name, self._submit_tool(tool_name, fn, **kwargs))])[0]
+                for tool_name, fn, kwargs in calls]
+
+    def _collect_results(self, futures: list) -> list:
+        """
+        Wait for `(tool_name, future)` pairs, turning failures and timeouts into error entries.
+
+        A timed-out call that has not started is cancelled. One that is already running cannot
+        be: it keeps its worker until its LLM request ends, which `tool_timeout` also bounds.
+        """
+        # Every tool gets the full timeout measured from submission, not from when we start waiting on it
+        deadline = time.monotonic() + self.tool_timeout
+        results = []
+        for tool_name, future in futures:
+            try:
+                results.append(future.result(timeout=max(0, deadline - time.monotonic())))
+            except TimeoutError:
+                future.cancel()
+                results.append(str({"error": f"{tool_name} timed out after {self.tool_timeout} seconds"}))
+            except Exception as e:
+                results.append(str({"error": str(e)}))
         return results
+
+
+def changed_fraction(previous_text: str, text: str) -> float:
+    """Share of `text` (by characters) made of sentences that did not occur in `previous_text`."""
+    previous_sentences = {previous_text[start:end] for start, end in sentence_spans(previous_text)}
+    sentences = [text[start:end] for start, end in sentence_spans(text)]
+    total = sum(len(sentence) for sentence in sentences)
+    if not total:
+        return 0.0
+    return sum(len(sentence) for sentence in sentences if sentence not in previous_sentences) / total
+
+
+def check_target_tones(texts: list, target_tones: list):
+    """Raise ValueError unless `target_tones` is None or has one tone per text."""
+    if target_tones is not None and len(target_tones) != len(texts):
+        raise ValueError(f"Got {len(target_tones)} target tones for {len(texts)} texts")
+
+
+def is_error_result(result) -> bool:
+    """True for the `str({"error": ...})` results every tool returns (or streams) on failure."""
+    return isinstance(result, str) and result.startswith("{'error'")
+
+
+def tool_error(result) -> str:
+    """Error message of a tool result for the metrics, or None if it succeeded."""
+    if isinstance(result, list):
+        failed = sum(is_error_result(item) for item in result)
+        return f"{failed} of {len(result)} items failed" if failed else None
+    return str(result) if is_error_result(result) else None
@@ -0,0 +1,122 @@
+"""
+Batched chain execution for the tools.
+
+Inputs are run through LangChain's `batch`/`abatch` with bounded concurrency. Failures are
+isolated per item: an item that fails is returned as its exception, and items rejected by
+the provider's rate limit are retried with exponential backoff before giving up.
+
+Chains ending in a `RateLimitedLLM` are not retried here: the rate limiter already retries
+each call with its own backoff and lowers its concurrency limit on a 429, and a second retry
+loop on top would multiply the attempts and blunt that signal.
+"""
+import asyncio
+import random
+import time
+
+import openai
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """True for errors that mean "slow down" rather than "this request is broken"."""
+    return isinstance(error, openai.RateLimitError) or getattr(error, "status_code", None) == 429
+
+
+def backoff_delay(attempt: int, base_delay: float, max_delay: float = 30.0) -> float:
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+# Batch-level retries for chains whose LLM does not retry rate-limited calls itself
+DEFAULT_MAX_RETRIES = 3
+
+
+def batch_invoke(chain, inputs: list, max_concurrency: int = 4, max_retries: int = None,
+                 base_delay: float = 1.0, cache=None, keys: list = None) -> list:
+    """
+    Invoke `chain` once per item of `inputs`, returning results in input order.
+
+    Args:
+        chain: The runnable to invoke
+        inputs: List of input dicts for the chain
+        max_concurrency: Maximum number of calls in flight at once
+        max_retries: How many times rate-limited items are retried; by default none if the
+            chain's LLM retries them itself (a RateLimitedLLM), else DEFAULT_MAX_RETRIES
+        base_delay: Initial backoff delay in seconds
+        cache: Optional response cache, consulted and filled per item
+        keys: Cache keys, one per input (required when a cache is given)
+
+    Returns:
+        List with the completion, or the exception raised, for every input
+    """
+    results = [None] * len(inputs)
+    pending = _serve_from_cache(results, cache, keys)
+    if max_retries is None:
+        max_retries = default_max_retries(chain)
+
+    for attempt in range(max_retries + 1):
+        if not pending:
+            break
+        if attempt:
+            time.sleep(backoff_delay(attempt - 1, base_delay))
+
+        outputs = chain.batch([inputs[i] for i in pending], config={"max_concurrency": max_concurrency},
+                              return_exceptions=True)
+        pending = _collect(results, pending, outputs, cache, keys, retry=attempt < max_retries)
+
+    return results
+
+
+async def abatch_invoke(chain, inputs: list, max_concurrency: int = 4, max_retries: int = None,
+                        base_delay: float = 1.0, cache=None, keys: list = None) -> list:
+    """Async counterpart of `batch_invoke`."""
+    results = [None] * len(inputs)
+    pending = _serve_from_cache(results, cache, keys)
+    if max_retries is None:
+        max_retries = default_max_retries(chain)
+
+    for attempt in range(max_retries + 1):
+        if not pending:
+            break
+        if attempt:
+            await asyncio.sleep(backoff_delay(attempt - 1, base_delay))
+
+        outputs = await chain.abatch([inputs[i] for i in pending], config={"max_concurrency": max_concurrency},
+                                     return_exceptions=True)
+        pending = _collect(results, pending, outputs, cache, keys, retry=attempt < max_retries)
+
+    return results
+
+
+def default_max_retries(chain) -> int:
+    """No batch-level retries when the chain's LLM is rate limited, as it retries on its own."""
+    # `prompt | llm` exposes the LLM as `last`; wrappers such as NearDuplicateChain pass it through
+    llm = getattr(chain, "last", chain)
+    return 0 if getattr(llm, "retries_rate_limits", False) else DEFAULT_MAX_RETRIES
+
+
+def _serve_from_cache(results: list, cache, keys: list) -> list:
+    """Fill cached results in place and return the indices that still need a call."""
+    if cache is None:
+        return list(range(len(results)))
+
+    pending = []
+    for i, key in enumerate(keys):
+        cached = cache.get(key)
+        if cached is None:
+            pending.append(i)
+        else:
+            results[i] = cached
+    return pending
+
+
+def _collect(results: list, pending: list, outputs: list, cache, keys: list, retry: bool) -> list:
+    """Store the outputs of one batch round and return the indices to retry."""
+    retry_indices = []
+    for i, output in zip(pending, outputs):
+        results[i] = output
+        if isinstance(output, Exception):
+            if retry and is_rate_limit_error(output):
+                retry_indices.append(i)
+        elif cache is not None:
+            cache.set(keys[i], output)
+    return retry_indices
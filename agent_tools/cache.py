@@ -0,0 +1,221 @@
+"""
+Response cache for the tools' LLM calls.
+
+Entries are keyed on a hash of everything that determines a completion: the tool, the
+version of its prompt template, the model parameters and the (normalized) input. A hit is
+returned without touching the network.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from agent_tools.metrics import add_to_current_call
+
+
+def normalize_text(text: str) -> str:
+    """Normalize unicode and whitespace so trivially different inputs share a cache entry."""
+    return " ".join(unicodedata.normalize("NFC", text or "").split())
+
+
+def make_cache_key(tool_name: str, prompt_version: str, model_params: dict, text: str,
+                   target_tone: str = "") -> str:
+    """Content-addressed key for one tool call."""
+    payload = json.dumps({
+        "tool": tool_name,
+        "prompt_version": prompt_version,
+        "model": model_params,
+        "text": normalize_text(text),
+        "target_tone": (target_tone or "").strip().lower(),
+    }, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def tool_cache_key(tool, text: str, target_tone: str = "") -> str:
+    """Cache key for a call to one of the agent tools, using the tool's own LLM settings."""
+    if tool.cache is None:
+        # Nothing to look up, so skip hashing (and creating the tool's LLM just to read its settings)
+        return None
+
+    model_params = {
+        "model_name": getattr(tool.llm, "model_name", None),
+        "temperature": getattr(tool.llm, "temperature", None),
+        "max_tokens": getattr(tool.llm, "max_tokens", None),
+        "top_p": getattr(tool.llm, "top_p", None),
+    }
+    return make_cache_key(tool.name, tool.prompt_version, model_params, text, target_tone)
+
+
+def cached_invoke(cache, key: str, chain, inputs: dict):
+    """Invoke `chain`, serving and storing the result through `cache` when one is configured."""
+    if cache is None:
+        return chain.invoke(inputs)
+
+    result = cache.get(key)
+    if result is None:
+        result = chain.invoke(inputs)
+        cache.set(key, result)
+    return result
+
+
+async def acached_invoke(cache, key: str, chain, inputs: dict):
+    """Async counterpart of `cached_invoke`."""
+    if cache is None:
+        return await chain.ainvoke(inputs)
+
+    result = cache.get(key)
+    if result is None:
+        result = await chain.ainvoke(inputs)
+        cache.set(key, result)
+    return result
+
+
+def cached_stream(cache, key: str, chain, inputs: dict):
+    """Stream `chain` chunk by chunk; a cache hit is yielded as a single chunk."""
+    cached = cache.get(key) if cache is not None else None
+    if cached is not None:
+        yield cached
+        return
+
+    chunks = []
+    for chunk in chain.stream(inputs):
+        chunks.append(chunk)
+        yield chunk
+
+    if cache is not None:
+        cache.set(key, "".join(chunks))
+
+
+async def acached_stream(cache, key: str, chain, inputs: dict):
+    """Async counterpart of `cached_stream`."""
+    cached = cache.get(key) if cache is not None else None
+    if cached is not None:
+        yield cached
+        return
+
+    chunks = []
+    async for chunk in chain.astream(inputs):
+        chunks.append(chunk)
+        yield chunk
+
+    if cache is not None:
+        cache.set(key, "".join(chunks))
+
+
+class BaseCache:
+    """Common hit/miss accounting for the cache backends."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        raise NotImplementedError
+
+    def set(self, key: str, value: str):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+    def _record(self, hit: bool):
+        if hit:
+            self.hits += 1
+            add_to_current_call(cache_hits=1)
+        else:
+            self.misses += 1
+
+
+class InMemoryCache(BaseCache):
+    """LRU cache with an optional time-to-live, shared safely between threads."""
+
+    def __init__(self, max_size: int = 1024, ttl: float = 3600):
+        super().__init__()
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl and time.monotonic() - entry[1] > self.ttl:
+                del self._entries[key]
+                entry = None
+
+            self._record(entry is not None)
+            if entry is None:
+                return None
+
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key: str, value: str):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCache(BaseCache):
+    """Persistent cache stored in a SQLite file, so cached completions survive restarts."""
+
+    def __init__(self, path: str = "analysis_cache.sqlite3", ttl: float = None):
+        super().__init__()
+        self.path = path
+        self.ttl = ttl
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._connection.commit()
+
+    def get(self, key: str):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and self.ttl and time.time() - row[1] > self.ttl:
+                self._connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._connection.commit()
+                row = None
+
+            self._record(row is not None)
+            return row[0] if row is not None else None
+
+    def set(self, key: str, value: str):
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created_at) VALUES (?, ?, ?)",
+                (key, value, time.time())
+            )
+            self._connection.commit()
+
+    def clear(self):
+        with self._lock:
+            self._connection.execute("DELETE FROM responses")
+            self._connection.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
@@ -0,0 +1,256 @@
+"""
+Record/replay of the tools' LLM traffic.
+
+In record mode every completion is appended to a cassette file together with its prompt and how
+long the call took. In replay mode completions are served from the file without network access,
+e.g. to load-test with real production traffic, or to check that a prompt change does not change
+outputs (a changed prompt is a miss).
+
+File format: an 8-byte magic header, then one record per completion:
+
+    32 bytes   SHA-256 of the prompt
+    8 bytes    call latency in seconds (little-endian double)
+    4 bytes    payload length (little-endian unsigned int)
+    payload    zlib-compressed JSON {"prompt", "response", "model"}
+
+The file is only ever appended to, so recording from several processes or sessions just adds
+records, and a crash can at worst leave a truncated last record, which is ignored. For replay
+the file is memory-mapped and indexed once by scanning the fixed-size record headers. A
+payload is only read and decompressed when its prompt is asked for. A prompt recorded several
+times is replayed in recorded order, cycling through its recordings.
+
+Configured through `LLMRegistry` or the LLM_CASSETTE_PATH, LLM_CASSETTE_MODE ("record" or
+"replay") and LLM_CASSETTE_LATENCY_SCALE (0 replays instantly, 1 in real time) environment variables.
+"""
+import asyncio
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+from langchain_core.runnables import Runnable
+
+from agent_tools.rate_limit import prompt_text
+
+RECORD = "record"
+REPLAY = "replay"
+
+MAGIC = b"LLMCAS1\n"
+HEADER = struct.Struct("<32sdI")
+
+
+class CassetteMiss(LookupError):
+    """Raised in replay mode for a prompt that was never recorded."""
+
+
+def prompt_digest(prompt: str) -> bytes:
+    return hashlib.sha256(prompt.encode("utf-8")).digest()
+
+
+class Cassette:
+    """
+    An append-only file of recorded completions.
+
+    Args:
+        path: The cassette file; created on first record
+        mode: RECORD to append calls, REPLAY to serve them from the file
+        latency_scale: In replay mode, wait this multiple of each recorded latency before answering
+    """
+
+    def __init__(self, path: str, mode: str = REPLAY, latency_scale: float = 0.0):
+        if mode not in (RECORD, REPLAY):
+            raise ValueError(f"Cassette mode must be {RECORD!r} or {REPLAY!r}, not {mode!r}")
+        self.path = path
+        self.mode = mode
+        self.latency_scale = latency_scale
+
+        self.recorded = 0
+        self.replayed = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._file = None
+        self._mmap = None
+        self._index = {}
+        self._plays = {}
+
+        if mode == REPLAY:
+            self._open_for_replay()
+
+    def record(self, prompt: str, response: str, latency: float, model: str = None):
+        """Append one completion to the file."""
+        payload = zlib.compress(json.dumps({"prompt": prompt, "response": response, "model": model},
+                                           ensure_ascii=False).encode("utf-8"))
+        with self._lock:
+            if self._file is None:
+                new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+                self._file = open(self.path, "ab")
+                if new_file:
+                    self._file.write(MAGIC)
+            self._file.write(HEADER.pack(prompt_digest(prompt), latency, len(payload)) + payload)
+            # One flush per record, so a crash loses at most the record being written
+            self._file.flush()
+            self.recorded += 1
+
+    def play(self, prompt: str):
+        """
+        The recorded completion for `prompt`.
+
+        Returns:
+            Tuple of the response and the recorded latency in seconds
+
+        Raises:
+            CassetteMiss: If the prompt was never recorded
+        """
+        digest = prompt_digest(prompt)
+        with self._lock:
+            offsets = self._index.get(digest)
+            if not offsets:
+                self.misses += 1
+                raise CassetteMiss(f"No recording for prompt {digest.hex()[:12]} in {self.path}")
+            play = self._plays.get(digest, 0)
+            self._plays[digest] = play + 1
+            self.replayed += 1
+
+        offset = offsets[play % len(offsets)]
+        _, latency, length = HEADER.unpack_from(self._mmap, offset)
+        start = offset + HEADER.size
+        record = json.loads(zlib.decompress(self._mmap[start:start + length]))
+        return record["response"], latency
+
+    def records(self):
+        """Every (prompt, response) pair in the file, in recorded order, in either mode."""
+        if self.mode == RECORD:
+            # Read what was recorded so far through a replay view of the same file
+            with self._lock:
+                if self._file is not None:
+                    self._file.flush()
+            if not os.path.exists(self.path):
+                return
+            reader = Cassette(self.path, REPLAY)
+            try:
+                yield from reader.records()
+            finally:
+                reader.close()
+            return
+
+        offsets = sorted(offset for offsets in self._index.values() for offset in offsets)
+        for offset in offsets:
+            _, _, length = HEADER.unpack_from(self._mmap, offset)
+            start = offset + HEADER.size
+            record = json.loads(zlib.decompress(self._mmap[start:start + length]))
+            yield record["prompt"], record["response"]
+
+    def replay_delay(self, latency: float) -> float:
+        return latency * self.latency_scale
+
+    def __len__(self):
+        return sum(len(offsets) for offsets in self._index.values()) if self.mode == REPLAY else self.recorded
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"mode": self.mode, "recorded": self.recorded, "replayed": self.replayed, "misses": self.misses,
+                    "prompts": len(self._index)}
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if self._mmap is not None:
+                self._mmap.close()
+                self._mmap = None
+
+    def _open_for_replay(self):
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(f"No cassette to replay at {self.path}; record one first with mode={RECORD!r}")
+        with open(self.path, "rb") as file:
+            size = os.fstat(file.fileno()).st_size
+            if size <= len(MAGIC):
+                return
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            self._mmap.close()
+            raise ValueError(f"{self.path} is not an LLM cassette")
+
+        offset = len(MAGIC)
+        while offset + HEADER.size <= size:
+            digest, _, length = HEADER.unpack_from(self._mmap, offset)
+            if offset + HEADER.size + length > size:
+                # Truncated last record from an interrupted recording
+                break
+            self._index.setdefault(digest, []).append(offset)
+            offset += HEADER.size + length
+
+
+class CassetteLLM(Runnable):
+    """
+    Wraps an LLM to record its completions to, or replay them from, a `Cassette`.
+
+    Drop-in for the wrapped LLM in `prompt | llm` chains; other attributes are read from the
+    wrapped LLM. Replayed streams arrive as a single chunk.
+    """
+
+    def __init__(self, llm, cassette: Cassette):
+        self.llm = llm
+        self.cassette = cassette
+
+    def __getattr__(self, name):
+        if name in ("llm", "cassette"):
+            raise AttributeError(name)
+        return getattr(self.llm, name)
+
+    def invoke(self, input, config=None, **kwargs):
+        prompt = prompt_text(input)
+        if self.cassette.mode == REPLAY:
+            response, latency = self.cassette.play(prompt)
+            time.sleep(self.cassette.replay_delay(latency))
+            return response
+
+        started = time.perf_counter()
+        response = self.llm.invoke(input, config, **kwargs)
+        self._record(prompt, response, time.perf_counter() - started)
+        return response
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        prompt = prompt_text(input)
+        if self.cassette.mode == REPLAY:
+            response, latency = self.cassette.play(prompt)
+            await asyncio.sleep(self.cassette.replay_delay(latency))
+            return response
+
+        started = time.perf_counter()
+        response = await self.llm.ainvoke(input, config, **kwargs)
+        self._record(prompt, response, time.perf_counter() - started)
+        return response
+
+    def stream(self, input, config=None, **kwargs):
+        if self.cassette.mode == REPLAY:
+            yield self.invoke(input, config, **kwargs)
+            return
+
+        started = time.perf_counter()
+        chunks = []
+        for chunk in self.llm.stream(input, config, **kwargs):
+            chunks.append(chunk)
+            yield chunk
+        self._record(prompt_text(input), "".join(map(str, chunks)), time.perf_counter() - started)
+
+    async def astream(self, input, config=None, **kwargs):
+        if self.cassette.mode == REPLAY:
+            yield await self.ainvoke(input, config, **kwargs)
+            return
+
+        started = time.perf_counter()
+        chunks = []
+        async for chunk in self.llm.astream(input, config, **kwargs):
+            chunks.append(chunk)
+            yield chunk
+        self._record(prompt_text(input), "".join(map(str, chunks)), time.perf_counter() - started)
+
+    def _record(self, prompt: str, response, latency: float):
+        self.cassette.record(prompt, str(response), latency, model=getattr(self.llm, "model_name", None))
@@ -0,0 +1,84 @@
+"""
+Sentence-level chunking of Albanian text.
+
+Long documents are split into windows of whole sentences that stay under a token budget,
+so each window can be checked on its own. Every chunk remembers its character offsets in
+the original text, which lets results computed per chunk be mapped back.
+"""
+import re
+from dataclasses import dataclass
+
+# End of a sentence (terminal punctuation, optionally followed by closing quotes/brackets and
+# then whitespace) or a paragraph break
+SENTENCE_BOUNDARY = re.compile(r'[.!?…]+["\'»”)\]]*(?=\s)|\n\s*\n')
+
+
+@dataclass
+class Chunk:
+    """A window of the original text, `text == original[start:end]`."""
+
+    start: int
+    end: int
+    text: str
+
+
+def sentence_spans(text: str) -> list:
+    """
+    Split text into sentences.
+
+    Args:
+        text: The text to split
+
+    Returns:
+        List of (start, end) character offsets, one per sentence, without surrounding whitespace
+    """
+    spans = []
+    position = 0
+    for match in SENTENCE_BOUNDARY.finditer(text):
+        _add_span(spans, text, position, match.end())
+        position = match.end()
+    _add_span(spans, text, position, len(text))
+    return spans
+
+
+def _add_span(spans: list, text: str, start: int, end: int):
+    segment = text[start:end]
+    stripped = segment.strip()
+    if stripped:
+        start += len(segment) - len(segment.lstrip())
+        spans.append((start, start + len(stripped)))
+
+
+def chunk_text(text: str, max_tokens: int, count_tokens=None) -> list:
+    """
+    Pack consecutive sentences into chunks of at most `max_tokens` tokens.
+
+    A single sentence longer than the budget becomes a chunk of its own rather than being cut.
+
+    Args:
+        text: The text to chunk
+        max_tokens: Token budget per chunk
+        count_tokens: Function returning the token count of a string (defaults to whitespace words)
+
+    Returns:
+        List of Chunk objects in text order
+    """
+    count_tokens = count_tokens or (lambda segment: len(segment.split()))
+
+    chunks = []
+    chunk_start = chunk_end = None
+    chunk_tokens = 0
+    for start, end in sentence_spans(text):
+        tokens = count_tokens(text[start:end])
+        if chunk_start is not None and chunk_tokens + tokens > max_tokens:
+            chunks.append(Chunk(chunk_start, chunk_end, text[chunk_start:chunk_end]))
+            chunk_start = None
+
+        if chunk_start is None:
+            chunk_start, chunk_tokens = start, 0
+        chunk_end = end
+        chunk_tokens += tokens
+
+    if chunk_start is not None:
+        chunks.append(Chunk(chunk_start, chunk_end, text[chunk_start:chunk_end]))
+    return chunks
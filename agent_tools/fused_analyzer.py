@@ -0,0 +1,200 @@
+from smolagents import Tool
+from langchain.prompts import PromptTemplate
+
+from agent_tools.cache import tool_cache_key
+from agent_tools.llm import get_llm
+from agent_tools.schemas import FusedAnalysis
+
+
+class FusedAnalyzer(Tool):
+    name = "FusedAnalyzer"
+    description = ("Checks grammar, analyzes tone and rewrites Albanian text in a single call, "
+                   "returning all three sections as JSON.")
+    inputs = {
+        "text": {
+            "type": "string",
+            "description": "Albanian text",
+        },
+        "target_tone": {
+            "type": "string",
+            "description": "Target tone for the rewrite; empty for formal, friendly and persuasive variations",
+        },
+    }
+
+    output_type = "string"
+
+    prompt_version = "1"
+
+    def __init__(self, cache=None, llm=None, llm_timeout: float = None):
+        self.cache = cache
+        # Seconds one LLM request may take (None: the registry's OPENAI_TIMEOUT)
+        self.llm_timeout = llm_timeout
+        self._llm = llm
+        self._fused_chain = None
+
+        fused_template = """
+        You are an expert in Albanian language grammar, tone and style.
+        Analyze the following Albanian text and answer with a single JSON object, without any other text.
+
+        Text to analyze: {text}
+
+        {rewrite_instruction}
+
+        The JSON object must have exactly these keys:
+        {{
+          "original_text": "<the original text>",
+          "grammatical_errors": [
+            {{"error": "<erroneous fragment>", "correction": "<correction>", "explanation": "<brief explanation>"}}
+          ],
+          "corrected_text": "<the fully corrected text>",
+          "tone": "<primary tone (formal, informal, friendly, aggressive, neutral, etc.)>",
+          "formality_level": <integer from 1 (very informal) to 5 (very formal)>,
+          "sentiment": "<positive, negative or neutral>",
+          "tone_analysis": "<brief explanation of tone characteristics>",
+          "original_tone": "<identification of the original tone>",
+          "rewrites": {{"<tone>": "<text rewritten in that tone>"}}
+        }}
+
+        Use an empty list for "grammatical_errors" if there are no errors. Rewrites must be in Albanian.
+        """
+
+        self.fused_prompt = PromptTemplate(
+            input_variables=["text", "rewrite_instruction"],
+            template=fused_template
+        )
+
+    @property
+    def llm(self):
+        if self._llm is None:
+            self._llm = get_llm(temperature=0, timeout=self.llm_timeout)
+        return self._llm
+
+    @llm.setter
+    def llm(self, llm):
+        self._llm = llm
+        self._fused_chain = None
+
+    @property
+    def fused_chain(self):
+        if self._fused_chain is None:
+            self._fused_chain = self.fused_prompt | self.llm
+        return self._fused_chain
+
+    @fused_chain.setter
+    def fused_chain(self, chain):
+        self._fused_chain = chain
+
+    def forward(self, text: str, target_tone: str):
+        try:
+            return self.analyze(text, target_tone).model_dump_json()
+        except Exception as e:
+            return str({"error": str(e)})
+
+    async def aforward(self, text: str, target_tone: str):
+        try:
+            analysis = await self.aanalyze(text, target_tone)
+            return analysis.model_dump_json()
+        except Exception as e:
+            return str({"error": str(e)})
+
+    def analyze(self, text: str, target_tone: str = "") -> FusedAnalysis:
+        """Run the fused prompt and validate its output; raises if the call or the validation fails."""
+        key = tool_cache_key(self, text, target_tone)
+        output = self.cache.get(key) if self.cache is not None else None
+        if output is None:
+            output = self.fused_chain.invoke(self._inputs(text, target_tone))
+        analysis = parse_fused_output(output, target_tone)
+
+        # Only completions that passed validation are cached
+        if self.cache is not None:
+            self.cache.set(key, output)
+        return analysis
+
+    async def aanalyze(self, text: str, target_tone: str = "") -> FusedAnalysis:
+        """Async counterpart of `analyze`."""
+        key = tool_cache_key(self, text, target_tone)
+        output = self.cache.get(key) if self.cache is not None else None
+        if output is None:
+            output = await self.fused_chain.ainvoke(self._inputs(text, target_tone))
+        analysis = parse_fused_output(output, target_tone)
+
+        if self.cache is not None:
+            self.cache.set(key, output)
+        return analysis
+
+    @staticmethod
+    def _inputs(text: str, target_tone: str) -> dict:
+        if target_tone:
+            rewrite_instruction = (f"For \"rewrites\", rewrite the text to have a {target_tone} tone, "
+                                   f"using \"{target_tone}\" as the only key.")
+        else:
+            rewrite_instruction = ("For \"rewrites\", provide three variations of the text using the keys "
+                                   "\"formal\", \"friendly\" and \"persuasive\".")
+        return {"text": text, "rewrite_instruction": rewrite_instruction}
+
+
+def parse_fused_output(output: str, target_tone: str = "") -> FusedAnalysis:
+    """
+    Validate a fused completion against the FusedAnalysis schema.
+
+    Args:
+        output: Raw completion, possibly wrapped in a markdown code fence or surrounded by text
+        target_tone: Requested target tone; the rewrites must cover it (or the three variations)
+
+    Returns:
+        The validated FusedAnalysis
+
+    Raises:
+        ValueError (or pydantic's ValidationError, a subclass) if the output does not match the schema
+    """
+    analysis = FusedAnalysis.model_validate_json(extract_json_object(output))
+
+    expected_tones = {target_tone.lower()} if target_tone else {"formal", "friendly", "persuasive"}
+    missing = expected_tones - {tone.lower() for tone in analysis.rewrites}
+    if missing:
+        raise ValueError(f"Fused completion is missing rewrites for: {', '.join(sorted(missing))}")
+    return analysis
+
+
+def extract_json_object(output: str) -> str:
+    """Return the outermost `{...}` of a completion, dropping any code fence or text around it."""
+    output = (output or "").strip()
+    if output.startswith("{") and output.endswith("}"):
+        return output
+
+    start, end = output.find("{"), output.rfind("}")
+    if start == -1 or end < start:
+        raise ValueError("Fused completion does not contain a JSON object")
+    return output[start:end + 1]
+
+
+def render_sections(analysis: FusedAnalysis, target_tone: str = "") -> tuple:
+    """Render a FusedAnalysis in the text formats of GrammarChecker, ToneAnalyzer and ToneRewriter."""
+    grammar_lines = ["ORIGINAL TEXT:", analysis.original_text, "", "GRAMMATICAL ERRORS:"]
+    for number, error in enumerate(analysis.grammatical_errors, start=1):
+        grammar_lines.append(f"{number}. Error: {error.error}")
+        grammar_lines.append(f"   Correction: {error.correction}")
+        if error.explanation:
+            grammar_lines.append(f"   Explanation: {error.explanation}")
+    if not analysis.grammatical_errors:
+        grammar_lines.append("No grammatical errors found")
+    grammar_lines.extend(["", "CORRECTED TEXT:", analysis.corrected_text])
+
+    tone_lines = [
+        "TONE:", analysis.tone, "",
+        "FORMALITY LEVEL:", str(analysis.formality_level), "",
+        "SENTIMENT:", analysis.sentiment, "",
+        "TONE ANALYSIS:", analysis.tone_analysis,
+    ]
+
+    rewrite_lines = ["ORIGINAL TONE:", analysis.original_tone, ""]
+    if target_tone:
+        rewrites = {tone.lower(): text for tone, text in analysis.rewrites.items()}
+        rewritten = rewrites.get(target_tone.lower(), "")
+        rewrite_lines.extend(["TARGET TONE:", target_tone, "", "REWRITTEN TEXT:", rewritten])
+    else:
+        rewrites = {tone.lower(): text for tone, text in analysis.rewrites.items()}
+        for tone in ["formal", "friendly", "persuasive"]:
+            rewrite_lines.extend([f"{tone.upper()} TONE VERSION:", rewrites.get(tone, ""), ""])
+
+    return "\n".join(grammar_lines), "\n".join(tone_lines), "\n".join(rewrite_lines).rstrip()
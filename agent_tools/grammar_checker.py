@@ -1,10 +1,22 @@
+import re
+
 from smolagents import Tool
-from langchain_openai.llms import OpenAI
 
 from langchain.chains import LLMChain
 from langchain.prompts import PromptTemplate
+from langchain_core.runnables import RunnableLambda
+
+from agent_tools.batching import batch_invoke, abatch_invoke
+from agent_tools.cache import tool_cache_key, cached_invoke, acached_invoke, cached_stream, acached_stream
+from agent_tools.chunking import Chunk, chunk_text, sentence_spans
+from agent_tools.llm import get_llm
+from agent_tools.precheck import precheck as run_precheck
+from agent_tools.sections import parse_sections, section_text
 
-import nltk
+# How GrammarChecker.forward checks a text (see GrammarChecker._route)
+WHOLE = "whole"
+PRECHECKED = "prechecked"
+CHUNKED = "chunked"
 
 
 class GrammarChecker(Tool):
@@ -19,15 +31,27 @@ class GrammarChecker(Tool):
 
     output_type = "string"
 
-    def __init__(self):
+    # Bump whenever the prompt changes so cached completions of the old prompt are not reused
+    prompt_version = "1"
 
-        try:
-            nltk.download('punkt')
-            self.tokenizer = nltk.tokenize.word_tokenize
-        except:
-            print("Could not initialize NLTK resources")
+    def __init__(self, cache=None, llm=None, nltk_data_path=None, max_chunk_tokens: int = 300,
+                 max_chunk_concurrency: int = 4, precheck: bool = False, llm_timeout: float = None):
+        self.cache = cache
+        # Seconds one LLM request may take (None: the registry's OPENAI_TIMEOUT)
+        self.llm_timeout = llm_timeout
+        self.nltk_data_path = nltk_data_path
+
+        # Fix mechanical errors locally first and only send the LLM what is left (see precheck.py)
+        self.precheck = precheck
+
+        # Texts longer than this many tokens are checked sentence window by sentence window
+        self.max_chunk_tokens = max_chunk_tokens
+        self.max_chunk_concurrency = max_chunk_concurrency
 
-        self.llm = OpenAI(temperature=0)
+        # The LLM, chain and tokenizer are created on first use so constructing the tool stays cheap
+        self._llm = llm
+        self._grammar_chain = None
+        self._tokenizer = None
 
         grammar_template = """
         You are an expert in Albanian language grammar. 
@@ -52,16 +76,435 @@ class GrammarChecker(Tool):
         
         If no errors are found, simply state "No grammatical errors found" under GRAMMATICAL ERRORS. """
 
-        grammar_prompt = PromptTemplate(
+        self.grammar_prompt = PromptTemplate(
             input_variables=["text"],
             template=grammar_template
         )
 
-        self.grammar_chain = grammar_prompt | self.llm
+    @property
+    def llm(self):
+        # Shared, pooled client unless a specific LLM is injected
+        if self._llm is None:
+            self._llm = get_llm(temperature=0, timeout=self.llm_timeout)
+        return self._llm
+
+    @llm.setter
+    def llm(self, llm):
+        self._llm = llm
+        self._grammar_chain = None
+
+    @property
+    def grammar_chain(self):
+        if self._grammar_chain is None:
+            self._grammar_chain = self.grammar_prompt | self.llm
+        return self._grammar_chain
+
+    @grammar_chain.setter
+    def grammar_chain(self, chain):
+        self._grammar_chain = chain
+
+    @property
+    def tokenizer(self):
+        """Word tokenizer, loaded on first use from local NLTK data only (never downloaded)."""
+        if self._tokenizer is None:
+            self._tokenizer = load_word_tokenizer(self.nltk_data_path)
+        return self._tokenizer
 
     def forward(self, text: str):
         try:
-            result = self.grammar_chain.invoke({"text": text})
+            route, local = self._route(text)
+            if route == PRECHECKED:
+                return self.forward_prechecked(local)
+            if route == CHUNKED:
+                return self.forward_chunked(text)
+
+            result = cached_invoke(self.cache, tool_cache_key(self, text), self.grammar_chain, {"text": text})
+            return result
+        except Exception as e:
+            return str({"error": str(e)})
+
+    async def aforward(self, text: str):
+        try:
+            route, local = self._route(text)
+            if route == PRECHECKED:
+                return await self.aforward_prechecked(local)
+            if route == CHUNKED:
+                return await self.aforward_chunked(text)
+
+            result = await acached_invoke(self.cache, tool_cache_key(self, text), self.grammar_chain,
+                                          {"text": text})
             return result
         except Exception as e:
             return str({"error": str(e)})
+
+    def forward_stream(self, text: str):
+        try:
+            route, local = self._route(text)
+            if route == PRECHECKED:
+                yield self.forward_prechecked(local)
+                return
+            if route == CHUNKED:
+                yield self.forward_chunked(text)
+                return
+
+            yield from cached_stream(self.cache, tool_cache_key(self, text), self.grammar_chain, {"text": text})
+        except Exception as e:
+            yield str({"error": str(e)})
+
+    async def aforward_stream(self, text: str):
+        try:
+            route, local = self._route(text)
+            if route == PRECHECKED:
+                yield await self.aforward_prechecked(local)
+                return
+            if route == CHUNKED:
+                yield await self.aforward_chunked(text)
+                return
+
+            async for chunk in acached_stream(self.cache, tool_cache_key(self, text), self.grammar_chain,
+                                              {"text": text}):
+                yield chunk
+        except Exception as e:
+            yield str({"error": str(e)})
+
+    def forward_batch(self, texts: list, max_concurrency: int = 4) -> list:
+        """
+        Check many texts, returning one report per text in input order.
+
+        Each text takes the same path as in `forward`: texts sent whole are checked in one
+        LangChain batch, pre-checked and chunked ones through `forward` itself.
+        """
+        results, whole = [None] * len(texts), []
+        for index, text in enumerate(texts):
+            try:
+                if self._route(text)[0] == WHOLE:
+                    whole.append(index)
+            except Exception as e:
+                results[index] = str({"error": str(e)})
+
+        outputs = batch_invoke(self.grammar_chain, [{"text": texts[i]} for i in whole],
+                               max_concurrency=max_concurrency, cache=self.cache,
+                               keys=[tool_cache_key(self, texts[i]) for i in whole])
+        for index, output in zip(whole, outputs):
+            results[index] = str({"error": str(output)}) if isinstance(output, Exception) else output
+
+        routed = [index for index, result in enumerate(results) if result is None]
+        outputs = RunnableLambda(self.forward).batch([texts[i] for i in routed],
+                                                     config={"max_concurrency": max_concurrency})
+        for index, output in zip(routed, outputs):
+            results[index] = output
+        return results
+
+    async def aforward_batch(self, texts: list, max_concurrency: int = 4) -> list:
+        """Async counterpart of `forward_batch`."""
+        results, whole = [None] * len(texts), []
+        for index, text in enumerate(texts):
+            try:
+                if self._route(text)[0] == WHOLE:
+                    whole.append(index)
+            except Exception as e:
+                results[index] = str({"error": str(e)})
+
+        outputs = await abatch_invoke(self.grammar_chain, [{"text": texts[i]} for i in whole],
+                                      max_concurrency=max_concurrency, cache=self.cache,
+                                      keys=[tool_cache_key(self, texts[i]) for i in whole])
+        for index, output in zip(whole, outputs):
+            results[index] = str({"error": str(output)}) if isinstance(output, Exception) else output
+
+        routed = [index for index, result in enumerate(results) if result is None]
+        outputs = await RunnableLambda(self.forward, afunc=self.aforward).abatch(
+            [texts[i] for i in routed], config={"max_concurrency": max_concurrency})
+        for index, output in zip(routed, outputs):
+            results[index] = output
+        return results
+
+    def forward_chunked(self, text: str) -> str:
+        """Check `text` in sentence windows in parallel and merge the findings into one report."""
+        chunks = self._chunks(text)
+        try:
+            outputs = batch_invoke(self.grammar_chain, [{"text": chunk.text} for chunk in chunks],
+                                   max_concurrency=self.max_chunk_concurrency, cache=self.cache,
+                                   keys=[tool_cache_key(self, chunk.text) for chunk in chunks])
+            return merge_chunk_results(text, chunks, outputs)
+        except Exception as e:
+            return str({"error": str(e)})
+
+    async def aforward_chunked(self, text: str) -> str:
+        """Async counterpart of `forward_chunked`."""
+        chunks = self._chunks(text)
+        try:
+            outputs = await abatch_invoke(self.grammar_chain, [{"text": chunk.text} for chunk in chunks],
+                                          max_concurrency=self.max_chunk_concurrency, cache=self.cache,
+                                          keys=[tool_cache_key(self, chunk.text) for chunk in chunks])
+            return merge_chunk_results(text, chunks, outputs)
+        except Exception as e:
+            return str({"error": str(e)})
+
+    def forward_prechecked(self, local) -> str:
+        """
+        Report for a text the pre-checker has gone through: its local corrections, plus the LLM's
+        findings for the residual sentences, which are the only ones sent.
+
+        Args:
+            local: PrecheckResult for the text
+        """
+        chunks, outputs, pending = self._prechecked_chunks(local)
+        if pending:
+            try:
+                llm_outputs = batch_invoke(self.grammar_chain, [{"text": chunk.text} for chunk in pending],
+                                           max_concurrency=self.max_chunk_concurrency, cache=self.cache,
+                                           keys=[tool_cache_key(self, chunk.text) for chunk in pending])
+            except Exception as e:
+                llm_outputs = [e] * len(pending)
+            outputs.update(zip(map(id, pending), llm_outputs))
+        return merge_chunk_results(local.text, chunks, [outputs[id(chunk)] for chunk in chunks])
+
+    async def aforward_prechecked(self, local) -> str:
+        """Async counterpart of `forward_prechecked`."""
+        chunks, outputs, pending = self._prechecked_chunks(local)
+        if pending:
+            try:
+                llm_outputs = await abatch_invoke(self.grammar_chain, [{"text": chunk.text} for chunk in pending],
+                                                  max_concurrency=self.max_chunk_concurrency, cache=self.cache,
+                                                  keys=[tool_cache_key(self, chunk.text) for chunk in pending])
+            except Exception as e:
+                llm_outputs = [e] * len(pending)
+            outputs.update(zip(map(id, pending), llm_outputs))
+        return merge_chunk_results(local.text, chunks, [outputs[id(chunk)] for chunk in chunks])
+
+    def check_sentences(self, text: str, known_outputs: dict = None):
+        """
+        Check `text`, only sending sentences without a known result to the LLM.
+
+        A run of sentences checked together before (a key of `known_outputs`) reuses that
+        completion. The other sentences are packed into chunks of up to `max_chunk_tokens`
+        tokens, or one chunk per run of consecutive sentences when chunking is off, so a first
+        submission costs no more calls than `forward`.
+
+        Args:
+            text: The text to check
+            known_outputs: Completions from earlier checks, keyed by the text of the chunk they cover
+
+        Returns:
+            Tuple of the merged report and the completions used for `text`, keyed by chunk text
+        """
+        known_outputs = known_outputs or {}
+        spans = sentence_spans(text)
+        longest_known = max(map(len, known_outputs), default=0)
+        chunks, pending = [], []
+        # First sentence of the current run of sentences without a known result
+        run_start = None
+        index = 0
+        while index < len(spans):
+            last = self._known_run(text, spans, index, known_outputs, longest_known)
+            if last is None:
+                run_start = index if run_start is None else run_start
+                index += 1
+                continue
+
+            if run_start is not None:
+                new_chunks = self._new_chunks(text, spans[run_start][0], spans[index - 1][1])
+                chunks.extend(new_chunks)
+                pending.extend(new_chunks)
+                run_start = None
+            start, end = spans[index][0], spans[last][1]
+            chunks.append(Chunk(start, end, text[start:end]))
+            index = last + 1
+
+        if run_start is not None:
+            new_chunks = self._new_chunks(text, spans[run_start][0], spans[-1][1])
+            chunks.extend(new_chunks)
+            pending.extend(new_chunks)
+
+        try:
+            new_outputs = batch_invoke(self.grammar_chain, [{"text": chunk.text} for chunk in pending],
+                                       max_concurrency=self.max_chunk_concurrency, cache=self.cache,
+                                       keys=[tool_cache_key(self, chunk.text) for chunk in pending])
+        except Exception as e:
+            new_outputs = [e] * len(pending)
+
+        new_by_chunk = {id(chunk): output for chunk, output in zip(pending, new_outputs)}
+        outputs = [new_by_chunk[id(chunk)] if id(chunk) in new_by_chunk else known_outputs[chunk.text]
+                   for chunk in chunks]
+        # Failed chunks are not remembered, so the next submission retries them
+        outputs_by_chunk = {chunk.text: output for chunk, output in zip(chunks, outputs)
+                            if not isinstance(output, Exception)}
+        return merge_chunk_results(text, chunks, outputs), outputs_by_chunk
+
+    @staticmethod
+    def _known_run(text: str, spans: list, index: int, known_outputs: dict, longest_known: int):
+        """Index of the last sentence of the longest known run starting at sentence `index`, or None."""
+        last = None
+        for candidate in range(index, len(spans)):
+            if spans[candidate][1] - spans[index][0] > longest_known:
+                break
+            if text[spans[index][0]:spans[candidate][1]] in known_outputs:
+                last = candidate
+        return last
+
+    def _new_chunks(self, text: str, start: int, end: int) -> list:
+        """Chunks for the LLM covering text[start:end], a run of sentences without known results."""
+        if not self._needs_chunking(text[start:end]):
+            return [Chunk(start, end, text[start:end])]
+        return [Chunk(start + chunk.start, start + chunk.end, chunk.text) for chunk in self._chunks(text[start:end])]
+
+    def _prechecked_chunks(self, local):
+        """
+        Chunks covering the text, local reports keyed by chunk id, and the chunks for the LLM.
+
+        Residual runs longer than `max_chunk_tokens` are split further, like in `forward_chunked`.
+        """
+        chunks, outputs, pending = [], {}, []
+        for chunk, needs_llm in local.chunks():
+            if not needs_llm:
+                chunks.append(chunk)
+                outputs[id(chunk)] = local.report(chunk)
+                continue
+            parts = ([Chunk(chunk.start + part.start, chunk.start + part.end, part.text)
+                      for part in self._chunks(chunk.text)] if self._needs_chunking(chunk.text) else [chunk])
+            chunks.extend(parts)
+            pending.extend(parts)
+        return chunks, outputs, pending
+
+    @staticmethod
+    def _covers_text(local) -> bool:
+        """True if the LLM has to check every sentence anyway, so the usual path is just as good."""
+        return len(local.residual) == len(sentence_spans(local.text))
+
+    def _route(self, text: str) -> tuple:
+        """
+        How `text` is checked: `(PRECHECKED, PrecheckResult)` if the pre-checker leaves only some
+        sentences to the LLM, `(CHUNKED, None)` if it is too long for one call, else `(WHOLE, None)`.
+        """
+        if self.precheck:
+            local = run_precheck(text)
+            if not self._covers_text(local):
+                return PRECHECKED, local
+        if self._needs_chunking(text):
+            return CHUNKED, None
+        return WHOLE, None
+
+    def _needs_chunking(self, text: str) -> bool:
+        # Every token has at least one character, so texts this short are never tokenized (and
+        # the tokenizer is never loaded while only short texts come in)
+        if not self.max_chunk_tokens or len(text) <= self.max_chunk_tokens:
+            return False
+        return len(self.tokenizer(text)) > self.max_chunk_tokens
+
+    def _chunks(self, text: str) -> list:
+        return chunk_text(text, self.max_chunk_tokens, lambda segment: len(self.tokenizer(segment)))
+
+
+def parse_grammar_output(output: str) -> dict:
+    """
+    Parse one GrammarChecker completion.
+
+    Args:
+        output: Text in the ORIGINAL TEXT / GRAMMATICAL ERRORS / CORRECTED TEXT format
+
+    Returns:
+        Dict with the list of `errors` (error_text, correction, explanation) and the `corrected_text`
+    """
+    sections = parse_sections(output)
+    return {"errors": parse_grammar_errors(section_text(sections, "GRAMMATICAL ERRORS")),
+            "corrected_text": section_text(sections, "CORRECTED TEXT")}
+
+
+def parse_grammar_errors(errors_text: str) -> list:
+    """
+    Parse the body of a GRAMMATICAL ERRORS section.
+
+    Returns:
+        List of dicts with `error_text`, `correction` and, when given, `explanation`
+    """
+    errors = []
+    if "No grammatical errors found" not in errors_text:
+        current_error = {}
+        for line in errors_text.split('\n'):
+            line = line.strip()
+            if "Error:" in line:
+                if "error_text" in current_error:
+                    errors.append(current_error)
+                current_error = {"error_text": line.split("Error:", 1)[1].strip()}
+            elif "Correction:" in line and current_error:
+                current_error["correction"] = line.split("Correction:", 1)[1].strip()
+            elif "Explanation:" in line and current_error:
+                current_error["explanation"] = line.split("Explanation:", 1)[1].strip()
+        if "error_text" in current_error:
+            errors.append(current_error)
+    return errors
+
+
+def merge_chunk_results(text: str, chunks: list, outputs: list) -> str:
+    """
+    Merge per-chunk completions into a single report in the GrammarChecker output format.
+
+    Error positions are mapped back to character offsets in `text`. A chunk whose check failed
+    keeps its original wording in the corrected text and is listed as unchecked.
+    """
+    errors = []
+    unchecked = []
+    corrected_parts = []
+    position = 0
+    for chunk, output in zip(chunks, outputs):
+        corrected_parts.append(text[position:chunk.start])
+        position = chunk.end
+
+        if isinstance(output, Exception):
+            unchecked.append(f"Characters {chunk.start}-{chunk.end} could not be checked: {output}")
+            corrected_parts.append(chunk.text)
+            continue
+
+        parsed = parse_grammar_output(output)
+        corrected_parts.append(parsed["corrected_text"] or chunk.text)
+        for error in parsed["errors"]:
+            # The model often quotes the erroneous fragment
+            fragment = error["error_text"].strip('"\'“”«»')
+            offset = chunk.text.find(fragment) if fragment else -1
+            if offset != -1:
+                error["start"] = chunk.start + offset
+                error["end"] = error["start"] + len(fragment)
+            errors.append(error)
+    corrected_parts.append(text[position:])
+
+    lines = ["ORIGINAL TEXT:", text, "", "GRAMMATICAL ERRORS:"]
+    for number, error in enumerate(errors, start=1):
+        lines.append(f"{number}. Error: {error['error_text']}")
+        lines.append(f"   Correction: {error.get('correction', '')}")
+        if "explanation" in error:
+            lines.append(f"   Explanation: {error['explanation']}")
+        if "start" in error:
+            lines.append(f"   Position: {error['start']}-{error['end']}")
+    if not errors and not unchecked:
+        lines.append("No grammatical errors found")
+    lines.extend(unchecked)
+    lines.extend(["", "CORRECTED TEXT:", "".join(corrected_parts)])
+    return "\n".join(lines)
+
+
+def load_word_tokenizer(nltk_data_path=None):
+    """
+    Return NLTK's word tokenizer if the data it needs is installed locally, else a regex tokenizer.
+
+    Args:
+        nltk_data_path: Extra directory to search for NLTK data (NLTK_DATA is honoured as well)
+
+    Returns:
+        A function mapping a string to a list of tokens
+    """
+    try:
+        import nltk
+
+        if nltk_data_path and nltk_data_path not in nltk.data.path:
+            nltk.data.path.append(nltk_data_path)
+        # Depending on the NLTK version word_tokenize needs punkt or punkt_tab, so probe the
+        # tokenizer itself rather than one resource
+        nltk.tokenize.word_tokenize("Përshëndetje, botë.")
+        return nltk.tokenize.word_tokenize
+    except (ImportError, LookupError):
+        return regex_word_tokenize
+
+
+def regex_word_tokenize(text: str) -> list:
+    """Fallback word tokenizer: runs of word characters and single punctuation marks."""
+    return re.findall(r"\w+|[^\w\s]", text)
@@ -0,0 +1,158 @@
+"""
+Shared LLM clients for the agent tools.
+
+All tools get their `OpenAI` instances from one registry, which hands them the same
+keep-alive HTTP connection pools and the same client-side rate limiter. Pool size,
+timeouts, retries and rate limits are configured here once (or through the
+OPENAI_MAX_CONNECTIONS, OPENAI_MAX_KEEPALIVE_CONNECTIONS, OPENAI_TIMEOUT, OPENAI_MAX_RETRIES,
+OPENAI_RPM, OPENAI_TPM and OPENAI_LATENCY_TARGET environment variables); per-tool settings
+such as the temperature are passed to `get_llm`. With a cassette (LLM_CASSETTE_PATH and
+LLM_CASSETTE_MODE) the completions are recorded to, or replayed from, a file.
+"""
+import asyncio
+import os
+import threading
+
+import httpx
+from langchain_openai.llms import OpenAI
+
+from agent_tools.cassette import Cassette, CassetteLLM, REPLAY
+from agent_tools.rate_limit import AdaptiveConcurrency, RateLimiter, RateLimitedLLM
+
+
+class LLMRegistry:
+    """Creates LLMs that share pooled HTTP clients, reusing one instance per set of settings."""
+
+    def __init__(self, max_connections: int = 20, max_keepalive_connections: int = 10,
+                 keepalive_expiry: float = 30, timeout: float = 60, max_retries: int = 2,
+                 requests_per_minute: float = None, tokens_per_minute: float = None,
+                 latency_target: float = None, cassette: Cassette = None):
+        self.timeout = timeout
+        # Sits between the OpenAI client and the rate limiter: recordings hold the provider's own
+        # latency, and replayed traffic still goes through the concurrency limit
+        self.cassette = cassette
+
+        # Retries happen in the rate limiter, with jittered backoff, so that it sees every 429 and
+        # can lower the concurrency limit; the OpenAI client itself does not retry
+        self.rate_limiter = RateLimiter(
+            requests_per_minute=requests_per_minute,
+            tokens_per_minute=tokens_per_minute,
+            concurrency=AdaptiveConcurrency(initial=max_connections, max_limit=max_connections,
+                                            latency_target=latency_target),
+            max_retries=max_retries,
+        )
+
+        limits = httpx.Limits(max_connections=max_connections,
+                              max_keepalive_connections=max_keepalive_connections,
+                              keepalive_expiry=keepalive_expiry)
+        self.http_client = httpx.Client(limits=limits, timeout=timeout)
+        self.http_async_client = httpx.AsyncClient(limits=limits, timeout=timeout)
+
+        self._llms = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_connections=int(os.getenv("OPENAI_MAX_CONNECTIONS", 20)),
+            max_keepalive_connections=int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", 10)),
+            timeout=float(os.getenv("OPENAI_TIMEOUT", 60)),
+            max_retries=int(os.getenv("OPENAI_MAX_RETRIES", 2)),
+            requests_per_minute=_optional_float(os.getenv("OPENAI_RPM")),
+            tokens_per_minute=_optional_float(os.getenv("OPENAI_TPM")),
+            latency_target=_optional_float(os.getenv("OPENAI_LATENCY_TARGET")),
+            cassette=_cassette_from_env(),
+        )
+
+    def get_llm(self, temperature: float = 0, timeout: float = None, **settings) -> RateLimitedLLM:
+        """
+        Return the shared, rate-limited LLM for these settings, creating it on first use.
+
+        `timeout` bounds each request in seconds; None uses the registry's timeout.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        key = (temperature, timeout, tuple(sorted(settings.items())))
+        with self._lock:
+            if key not in self._llms:
+                llm = OpenAI(
+                    temperature=temperature,
+                    http_client=self.http_client,
+                    http_async_client=self.http_async_client,
+                    timeout=timeout,
+                    max_retries=0,
+                    **settings
+                )
+                if self.cassette is not None:
+                    llm = CassetteLLM(llm, self.cassette)
+                self._llms[key] = RateLimitedLLM(llm, self.rate_limiter)
+            return self._llms[key]
+
+    def close(self):
+        """
+        Close both connection pools and the cassette.
+
+        Inside a running event loop the async pool is closed by a task on that loop; `await
+        aclose()` there instead to wait for it.
+        """
+        self.http_client.close()
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            asyncio.run(self.http_async_client.aclose())
+        else:
+            self._async_close = loop.create_task(self.http_async_client.aclose())
+        if self.cassette is not None:
+            self.cassette.close()
+
+    async def aclose(self):
+        """Async counterpart of `close`."""
+        self.http_client.close()
+        await self.http_async_client.aclose()
+        if self.cassette is not None:
+            self.cassette.close()
+
+
+def _optional_float(value):
+    return float(value) if value else None
+
+
+def _cassette_from_env():
+    path = os.getenv("LLM_CASSETTE_PATH")
+    if not path:
+        return None
+    return Cassette(path, mode=os.getenv("LLM_CASSETTE_MODE", REPLAY),
+                    latency_scale=float(os.getenv("LLM_CASSETTE_LATENCY_SCALE", 0)))
+
+
+_default_registry = None
+_default_registry_lock = threading.Lock()
+
+
+def get_registry() -> LLMRegistry:
+    """The process-wide registry, created from the environment on first use."""
+    global _default_registry
+    with _default_registry_lock:
+        if _default_registry is None:
+            _default_registry = LLMRegistry.from_env()
+        return _default_registry
+
+
+def configure_llm_clients(**pool_settings) -> LLMRegistry:
+    """
+    Replace the process-wide registry, e.g. `configure_llm_clients(max_connections=50)`.
+
+    The old registry is closed, so LLMs it handed out stop working: configure the clients
+    before the tools make their first call.
+    """
+    global _default_registry
+    with _default_registry_lock:
+        previous, _default_registry = _default_registry, LLMRegistry(**pool_settings)
+        registry = _default_registry
+    if previous is not None:
+        previous.close()
+    return registry
+
+
+def get_llm(temperature: float = 0, timeout: float = None, **settings) -> RateLimitedLLM:
+    """Shortcut for `get_registry().get_llm(...)`."""
+    return get_registry().get_llm(temperature=temperature, timeout=timeout, **settings)
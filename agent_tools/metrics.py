@@ -0,0 +1,280 @@
+"""
+Per-tool-call instrumentation for the agent pipeline.
+
+Every tool call made by the agent runs inside `tool_call(tool_name)`, which records one
+`ToolCall`: wall time, time spent queued (waiting for a worker thread, a concurrency slot or
+rate-limit budget), prompt and completion tokens, LLM calls, cache hits, retries and the error,
+if any. The layers underneath add to the current record without it being passed around: the
+response cache and the rate limiter through `add_to_current_call`, and LangChain through a
+callback handler registered for every run, which reads the token usage the API reports (or
+estimates it at about four characters per token when the API reports none, e.g. when streaming).
+
+Finished records are
+  * logged as one JSON object per call on the `agent_tools.metrics` logger,
+  * aggregated into counters and latency histograms per tool, served in the Prometheus text
+    format by `ToolMetrics.render_prometheus`, and
+  * exported as OpenTelemetry spans when the `opentelemetry` package is installed.
+"""
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.tracers.context import register_configure_hook
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+@dataclass
+class ToolCall:
+    """Measurements of one tool call. Use `add` to update the counters from several threads."""
+
+    tool: str
+    queue_wait: float = 0.0
+    wall_time: float = 0.0
+    llm_calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    # True when a token count had to be estimated because the API did not report usage
+    tokens_estimated: bool = False
+    cache_hits: int = 0
+    retries: int = 0
+    error: str = None
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def add(self, **amounts):
+        with self.lock:
+            for name, amount in amounts.items():
+                setattr(self, name, getattr(self, name) + amount)
+
+    def to_dict(self) -> dict:
+        return {
+            "tool": self.tool,
+            "wall_time": round(self.wall_time, 4),
+            "queue_wait": round(self.queue_wait, 4),
+            "llm_calls": self.llm_calls,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "tokens_estimated": self.tokens_estimated,
+            "cache_hits": self.cache_hits,
+            "retries": self.retries,
+            "error": self.error,
+        }
+
+
+class _Histogram:
+    def __init__(self):
+        self.counts = [0] * len(LATENCY_BUCKETS)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                self.counts[index] += 1
+        self.total += value
+        self.count += 1
+
+
+class ToolMetrics:
+    """Aggregates finished `ToolCall` records per tool."""
+
+    COUNTERS = {
+        "calls": "Tool calls",
+        "errors": "Tool calls that returned or raised an error",
+        "llm_calls": "LLM completions requested by tool calls",
+        "prompt_tokens": "Prompt tokens sent by tool calls",
+        "completion_tokens": "Completion tokens received by tool calls",
+        "cache_hits": "Completions served from the response cache",
+        "retries": "LLM calls retried after a rate limit or transient failure",
+    }
+    HISTOGRAMS = {
+        "wall_seconds": "Wall time of tool calls",
+        "queue_wait_seconds": "Time tool calls spent waiting for a worker, a concurrency slot or rate-limit budget",
+    }
+
+    def __init__(self):
+        self._tools = {}
+        self._lock = threading.Lock()
+
+    def record(self, call: ToolCall):
+        with self._lock:
+            tool = self._tools.get(call.tool)
+            if tool is None:
+                tool = self._tools[call.tool] = {
+                    **{name: 0 for name in self.COUNTERS},
+                    **{name: _Histogram() for name in self.HISTOGRAMS},
+                }
+            tool["calls"] += 1
+            tool["errors"] += call.error is not None
+            for name in ("llm_calls", "prompt_tokens", "completion_tokens", "cache_hits", "retries"):
+                tool[name] += getattr(call, name)
+            tool["wall_seconds"].observe(call.wall_time)
+            tool["queue_wait_seconds"].observe(call.queue_wait)
+
+    def snapshot(self) -> dict:
+        """Counters and mean latencies per tool."""
+        with self._lock:
+            return {
+                name: {
+                    **{counter: tool[counter] for counter in self.COUNTERS},
+                    **{f"mean_{histogram}": (tool[histogram].total / tool[histogram].count
+                                             if tool[histogram].count else 0.0)
+                       for histogram in self.HISTOGRAMS},
+                }
+                for name, tool in self._tools.items()
+            }
+
+    def render_prometheus(self, gauges: dict = None) -> str:
+        """
+        The metrics in the Prometheus text exposition format.
+
+        Args:
+            gauges: Extra point-in-time values to include, mapping a metric name to a
+                `(help text, value)` pair, e.g. queue lengths owned by the caller
+        """
+        lines = []
+        with self._lock:
+            for counter, help_text in self.COUNTERS.items():
+                metric = f"agent_tool_{counter}_total"
+                lines += [f"# HELP {metric} {help_text}.", f"# TYPE {metric} counter"]
+                for name, tool in sorted(self._tools.items()):
+                    lines.append(f'{metric}{{tool="{name}"}} {tool[counter]}')
+
+            for histogram, help_text in self.HISTOGRAMS.items():
+                metric = f"agent_tool_{histogram}"
+                lines += [f"# HELP {metric} {help_text}.", f"# TYPE {metric} histogram"]
+                for name, tool in sorted(self._tools.items()):
+                    observed = tool[histogram]
+                    for bound, count in zip(LATENCY_BUCKETS, observed.counts):
+                        lines.append(f'{metric}_bucket{{tool="{name}",le="{bound}"}} {count}')
+                    lines.append(f'{metric}_bucket{{tool="{name}",le="+Inf"}} {observed.count}')
+                    lines.append(f'{metric}_sum{{tool="{name}"}} {observed.total:.6f}')
+                    lines.append(f'{metric}_count{{tool="{name}"}} {observed.count}')
+
+        for metric, (help_text, value) in (gauges or {}).items():
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} gauge", f"{metric} {value}"]
+        return "\n".join(lines) + "\n"
+
+
+_metrics = ToolMetrics()
+_current_call = ContextVar("current_tool_call", default=None)
+
+
+def get_metrics() -> ToolMetrics:
+    """The process-wide metrics that `tool_call` records into."""
+    return _metrics
+
+
+def current_call() -> ToolCall:
+    """The record of the tool call running in this context, or None outside of one."""
+    return _current_call.get()
+
+
+def add_to_current_call(**amounts):
+    """Add to the counters of the current tool call, if there is one (e.g. `cache_hits=1`)."""
+    call = _current_call.get()
+    if call is not None:
+        call.add(**amounts)
+
+
+@contextmanager
+def tool_call(tool: str, queue_wait: float = 0.0):
+    """
+    Record one tool call around the body of the `with` block.
+
+    Args:
+        tool: Name of the tool
+        queue_wait: Seconds the call already waited before the block started, e.g. for a worker thread
+
+    Yields:
+        The ToolCall record, so the caller can set `error` for failures returned as values
+    """
+    call = ToolCall(tool, queue_wait=queue_wait)
+    token = _current_call.set(call)
+    span = _start_span(tool)
+    started = time.perf_counter()
+    try:
+        yield call
+    except Exception as e:
+        call.error = str(e)
+        raise
+    finally:
+        call.wall_time = time.perf_counter() - started
+        _current_call.reset(token)
+        _metrics.record(call)
+        logger.info(json.dumps({"event": "tool_call", **call.to_dict()}, ensure_ascii=False))
+        if span is not None:
+            _end_span(span, call)
+
+
+class _UsageCallbackHandler(BaseCallbackHandler):
+    """Adds the LLM calls and token usage of every LangChain LLM run to the current tool call."""
+
+    # Run in the caller's context (also for async runs), where the current tool call is visible
+    run_inline = True
+
+    def __init__(self):
+        self._prompt_tokens = {}
+        self._lock = threading.Lock()
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        with self._lock:
+            self._prompt_tokens[run_id] = sum(_estimate_tokens(prompt) for prompt in prompts)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        with self._lock:
+            estimated_prompt = self._prompt_tokens.pop(run_id, 0)
+        call = _current_call.get()
+        if call is None:
+            return
+
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        if usage.get("prompt_tokens") is not None:
+            call.add(llm_calls=1, prompt_tokens=usage["prompt_tokens"],
+                     completion_tokens=usage.get("completion_tokens", 0))
+            return
+
+        completion = sum(_estimate_tokens(generation.text) for generations in response.generations
+                         for generation in generations)
+        call.add(llm_calls=1, prompt_tokens=estimated_prompt, completion_tokens=completion)
+        call.tokens_estimated = True
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        with self._lock:
+            self._prompt_tokens.pop(run_id, None)
+
+
+def _estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1 if text else 0
+
+
+# A default value makes LangChain add the handler to every run's callbacks
+_usage_handler = ContextVar("tool_usage_callback_handler", default=_UsageCallbackHandler())
+register_configure_hook(_usage_handler, inheritable=True)
+
+
+def _start_span(tool: str):
+    try:
+        from opentelemetry import trace
+    except ImportError:
+        return None
+    return trace.get_tracer(__name__).start_span(f"tool_call {tool}", attributes={"tool.name": tool})
+
+
+def _end_span(span, call: ToolCall):
+    for name, value in call.to_dict().items():
+        if name != "tool" and value is not None:
+            span.set_attribute(f"tool.{name}", value)
+    if call.error is not None:
+        from opentelemetry.trace import Status, StatusCode
+
+        span.set_status(Status(StatusCode.ERROR, call.error))
+    span.end()
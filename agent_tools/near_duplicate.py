@@ -0,0 +1,262 @@
+"""
+Near-duplicate cache for the ToneAnalyzer and ToneRewriter.
+
+The response cache only matches texts that are identical after whitespace normalization. The
+same message often comes back with other punctuation, a different greeting name or a fixed
+typo, and its tone is the same. This cache finds such texts and reuses their results.
+
+Texts are compared by the Jaccard similarity of their character 5-gram sets. The comparison is
+made after lowercasing, dropping punctuation and, for the ToneAnalyzer, replacing names
+(capitalized words inside a sentence) with a placeholder. Each text is summarized by a MinHash
+signature: the minimum of NUM_PERMUTATIONS random hash functions over its shingles. Two texts
+agree on a signature position with probability equal to their similarity. Signatures are
+computed for all shingles and hash functions at once with NumPy.
+
+Candidates are found with locality-sensitive hashing. The signature is cut into bands, and
+texts sharing any whole band land in the same bucket. With 32 bands of 4 rows, pairs above
+~0.4 similarity are almost always candidates and dissimilar ones rarely are. Candidates are
+then checked against the threshold with the estimated similarity, and the most similar one wins.
+
+Entries are evicted least recently used first (and after `ttl` seconds), so memory stays
+bounded by `max_entries` signatures and results.
+
+A rewrite quotes the text it was made from, so the ToneRewriter keeps names in its signatures
+and only reuses results above REWRITE_THRESHOLD, i.e. of texts that differ in little more than
+punctuation and case.
+"""
+import re
+import threading
+import time
+import unicodedata
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+from langchain_core.runnables import Runnable
+
+from agent_tools.metrics import add_to_current_call
+
+NUM_PERMUTATIONS = 128
+BANDS = 32
+SHINGLE_SIZE = 5
+REWRITE_THRESHOLD = 0.98
+
+# Mersenne prime modulus of the MinHash functions; shingle hashes are 32-bit, so a * x + b fits
+MERSENNE_PRIME = (1 << 31) - 1
+
+NAME_PLACEHOLDER = "§"
+# A capitalized word that does not start a sentence (run on whitespace-normalized text)
+NAME_PATTERN = re.compile(r"(?<![.!?] )(?<!^)\b[A-ZËÇ][^\W\d_]+")
+PUNCTUATION_PATTERN = re.compile(r"[^\w\s]+")
+
+
+def normalize_for_similarity(text: str, mask_names: bool = True) -> str:
+    """The text as it is compared: names masked, lowercase, no punctuation, single spaces."""
+    text = " ".join(unicodedata.normalize("NFC", text or "").split())
+    if mask_names:
+        text = NAME_PATTERN.sub(NAME_PLACEHOLDER, text)
+    return " ".join(PUNCTUATION_PATTERN.sub(" ", text.lower()).split())
+
+
+class NearDuplicateCache:
+    """
+    Bounded MinHash/LSH index from text signatures to tool results.
+
+    Args:
+        threshold: Lowest estimated similarity, from 0 to 1, for a result to be reused
+        max_entries: Entries kept before the least recently used are evicted
+        ttl: Seconds an entry stays usable (None keeps entries until evicted)
+        seed: Seed of the MinHash functions
+    """
+
+    def __init__(self, threshold: float = 0.9, max_entries: int = 4096, ttl: float = 3600, seed: int = 0):
+        if not 0 < threshold <= 1:
+            raise ValueError(f"threshold must be in (0, 1], not {threshold}")
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, MERSENNE_PRIME, NUM_PERMUTATIONS, dtype=np.uint64)
+        self._b = rng.integers(0, MERSENNE_PRIME, NUM_PERMUTATIONS, dtype=np.uint64)
+
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # Entry id -> (namespace, signature, value, created_at), least recently used first
+        self._entries = OrderedDict()
+        # (namespace, band number, band bytes) -> ids of the entries in that bucket
+        self._buckets = {}
+        self._next_id = 0
+
+    def signature(self, text: str, mask_names: bool = True) -> np.ndarray:
+        """MinHash signature of `text`, NUM_PERMUTATIONS 32-bit values."""
+        normalized = normalize_for_similarity(text, mask_names)
+        shingles = {normalized[start:start + SHINGLE_SIZE]
+                    for start in range(max(1, len(normalized) - SHINGLE_SIZE + 1))}
+        hashes = np.fromiter((zlib.crc32(shingle.encode("utf-8")) for shingle in shingles), dtype=np.uint64,
+                             count=len(shingles))
+        permuted = (hashes[:, None] * self._a + self._b) % MERSENNE_PRIME
+        return permuted.min(axis=0).astype(np.uint32)
+
+    def get(self, namespace: str, signature: np.ndarray, threshold: float = None):
+        """
+        The result stored for the most similar text in `namespace`.
+
+        Args:
+            namespace: Separates tools, prompts and settings whose results must not be mixed
+            signature: Signature of the text to look up
+            threshold: Overrides the cache's threshold for this lookup
+
+        Returns:
+            The stored result, or None if no text is similar enough
+        """
+        threshold = self.threshold if threshold is None else threshold
+        with self._lock:
+            best, best_similarity = None, threshold
+            for entry_id in self._candidates(namespace, signature):
+                entry = self._entries[entry_id]
+                if self.ttl and time.monotonic() - entry[3] > self.ttl:
+                    self._evict(entry_id)
+                    continue
+                similarity = float(np.mean(entry[1] == signature))
+                if similarity >= best_similarity:
+                    best, best_similarity = entry_id, similarity
+
+            if best is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            add_to_current_call(cache_hits=1)
+            self._entries.move_to_end(best)
+            return self._entries[best][2]
+
+    def set(self, namespace: str, signature: np.ndarray, value: str):
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (namespace, signature, value, time.monotonic())
+            for band in self._bands(namespace, signature):
+                self._buckets.setdefault(band, set()).add(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._evict(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self._entries),
+            }
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _candidates(self, namespace: str, signature: np.ndarray) -> set:
+        candidates = set()
+        for band in self._bands(namespace, signature):
+            candidates.update(self._buckets.get(band, ()))
+        return candidates
+
+    @staticmethod
+    def _bands(namespace: str, signature: np.ndarray):
+        rows = NUM_PERMUTATIONS // BANDS
+        return [(namespace, number, signature[number * rows:(number + 1) * rows].tobytes())
+                for number in range(BANDS)]
+
+    def _evict(self, entry_id: int):
+        namespace, signature, _, _ = self._entries.pop(entry_id)
+        for band in self._bands(namespace, signature):
+            bucket = self._buckets.get(band)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._buckets[band]
+
+
+class NearDuplicateChain(Runnable):
+    """
+    Wraps a tool's `prompt | llm` chain to reuse results of near-duplicate texts.
+
+    The chain's input must have a "text" key. Misses call the wrapped chain and store its
+    result; other attributes are read from the wrapped chain.
+
+    Args:
+        chain: The chain to wrap
+        cache: The NearDuplicateCache to consult
+        namespace: Namespace of this chain's results in the cache
+        mask_names: Whether names are ignored when comparing texts
+        threshold: Overrides the cache's threshold for this chain
+    """
+
+    def __init__(self, chain, cache: NearDuplicateCache, namespace: str, mask_names: bool = True,
+                 threshold: float = None):
+        self.chain = chain
+        self.cache = cache
+        self.namespace = namespace
+        self.mask_names = mask_names
+        self.threshold = threshold
+
+    def __getattr__(self, name):
+        if name in ("chain", "cache"):
+            raise AttributeError(name)
+        return getattr(self.chain, name)
+
+    def invoke(self, input, config=None, **kwargs):
+        signature = self.cache.signature(input["text"], self.mask_names)
+        result = self.cache.get(self.namespace, signature, self.threshold)
+        if result is None:
+            result = self.chain.invoke(input, config, **kwargs)
+            self.cache.set(self.namespace, signature, result)
+        return result
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        signature = self.cache.signature(input["text"], self.mask_names)
+        result = self.cache.get(self.namespace, signature, self.threshold)
+        if result is None:
+            result = await self.chain.ainvoke(input, config, **kwargs)
+            self.cache.set(self.namespace, signature, result)
+        return result
+
+    def stream(self, input, config=None, **kwargs):
+        signature = self.cache.signature(input["text"], self.mask_names)
+        cached = self.cache.get(self.namespace, signature, self.threshold)
+        if cached is not None:
+            yield cached
+            return
+
+        chunks = []
+        for chunk in self.chain.stream(input, config, **kwargs):
+            chunks.append(chunk)
+            yield chunk
+        self.cache.set(self.namespace, signature, "".join(map(str, chunks)))
+
+    async def astream(self, input, config=None, **kwargs):
+        signature = self.cache.signature(input["text"], self.mask_names)
+        cached = self.cache.get(self.namespace, signature, self.threshold)
+        if cached is not None:
+            yield cached
+            return
+
+        chunks = []
+        async for chunk in self.chain.astream(input, config, **kwargs):
+            chunks.append(chunk)
+            yield chunk
+        self.cache.set(self.namespace, signature, "".join(map(str, chunks)))
+
+
+def near_duplicate_chain(chain, cache: NearDuplicateCache, tool, target_tone: str = "", mask_names: bool = True,
+                         threshold: float = None):
+    """`chain` behind the near-duplicate cache, or unchanged if there is no cache."""
+    if cache is None:
+        return chain
+    namespace = "/".join([tool.name, tool.prompt_version, str(getattr(tool.llm, "model_name", None)),
+                          (target_tone or "").strip().lower()])
+    return NearDuplicateChain(chain, cache, namespace, mask_names=mask_names, threshold=threshold)
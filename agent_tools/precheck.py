@@ -0,0 +1,288 @@
+"""
+Local, rule-based pre-pass for the GrammarChecker.
+
+Many inputs only have mechanical problems: missing ë/ç ("Une jam shume i geezuar"), doubled
+letters and spacing around punctuation. The pre-checker fixes those without an LLM call.
+
+Words are looked up in a lexicon of correctly spelled Albanian forms
+(`data/albanian_lexicon.txt`), compiled once into a trie. An unknown word is matched against
+the trie while allowing the edits behind typical typing mistakes: e→ë, c→ç and dropping a
+doubled letter. The match with the fewest edits becomes the correction. Punctuation spacing
+is fixed with a few regular expressions.
+
+A sentence can only be settled locally if every word in it is known or was corrected
+unambiguously. Unknown words, words with several equally close corrections, and undiacritized
+spellings that are themselves words but are often typos (te/të, se/së, me/më, ...) leave the
+sentence to the LLM. GrammarChecker sends the LLM only those residual sentences. It skips the
+call entirely when nothing is left.
+"""
+import os
+import re
+from dataclasses import dataclass, field
+from functools import lru_cache
+
+from agent_tools.chunking import Chunk, sentence_spans
+
+LEXICON_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "albanian_lexicon.txt")
+
+# Letters users type instead of the diacritic ones
+DIACRITICS = {"e": "ë", "c": "ç"}
+# More edits than this and a match is more likely a different word than a typo
+MAX_EDITS = 3
+
+WORD_PATTERN = re.compile(r"[^\W\d_]+")
+SPACE_BEFORE_PUNCTUATION = re.compile(r"(?<=[^\W\d_]) +(?=[,;:!?.](?:\s|$))")
+MISSING_SPACE_AFTER_PUNCTUATION = re.compile(r"(?<=[^\W\d_])([,;:!?])(?=[^\W\d_])|(?<=[^\W\d_]{2})(\.)(?=[A-ZËÇ])")
+REPEATED_SPACES = re.compile(r"(?<=\S) {2,}(?=\S)")
+
+_END = object()
+
+
+def fold(word: str) -> str:
+    """The word without diacritics, as it is often typed."""
+    return word.replace("ë", "e").replace("ç", "c")
+
+
+class Lexicon:
+    """Trie of known word forms with lookups that tolerate missing diacritics and doubled letters."""
+
+    def __init__(self, words):
+        self._root = {}
+        self._folded = {}
+        self.size = 0
+        for word in words:
+            self.add(word)
+
+    def add(self, word: str):
+        node = self._root
+        for char in word:
+            node = node.setdefault(char, {})
+        if _END not in node:
+            node[_END] = True
+            self.size += 1
+            self._folded.setdefault(fold(word), set()).add(word)
+
+    def __contains__(self, word: str) -> bool:
+        node = self._root
+        for char in word:
+            node = node.get(char)
+            if node is None:
+                return False
+        return _END in node
+
+    def is_ambiguous(self, word: str) -> bool:
+        """True for a known form without diacritics that is also another word with them (te/të)."""
+        return fold(word) == word and len(self._folded.get(word, ())) > 1
+
+    def corrections(self, word: str) -> list:
+        """Known words reachable from `word` with the fewest edits (e→ë, c→ç, dropping a doubled letter)."""
+        found = {}
+        self._search(self._root, word, 0, "", 0, found)
+        if not found:
+            return []
+        fewest = min(found.values())
+        return sorted(candidate for candidate, edits in found.items() if edits == fewest)
+
+    def _search(self, node: dict, word: str, index: int, prefix: str, edits: int, found: dict):
+        if edits > MAX_EDITS:
+            return
+        if index == len(word):
+            if _END in node and edits < found.get(prefix, MAX_EDITS + 1):
+                found[prefix] = edits
+            return
+
+        char = word[index]
+        if char in node:
+            self._search(node[char], word, index + 1, prefix + char, edits, found)
+        accented = DIACRITICS.get(char)
+        if accented and accented in node:
+            self._search(node[accented], word, index + 1, prefix + accented, edits + 1, found)
+        if index and word[index - 1] == char:
+            # A doubled letter: drop the second one
+            self._search(node, word, index + 1, prefix, edits + 1, found)
+
+
+@lru_cache(maxsize=4)
+def load_lexicon(path: str = LEXICON_PATH) -> Lexicon:
+    """The lexicon in `path` (one form per line, `#` comments), compiled once per process."""
+    with open(path, encoding="utf-8") as file:
+        words = [line.strip().lower() for line in file if line.strip() and not line.startswith("#")]
+    return Lexicon(words)
+
+
+@dataclass
+class PrecheckResult:
+    """Local findings for one text; offsets refer to the checked text."""
+
+    text: str
+    # Dicts with error_text, correction and explanation for display, and the [start, end) span
+    # that is replaced by `replacement` to correct the text
+    errors: list = field(default_factory=list)
+    # (start, end) of the sentences the pre-checker could not settle
+    residual: list = field(default_factory=list)
+
+    @property
+    def resolved(self) -> bool:
+        """True if the LLM is not needed at all."""
+        return not self.residual
+
+    @property
+    def corrected_text(self) -> str:
+        return apply_corrections(self.text, self.errors)
+
+    def chunks(self) -> list:
+        """
+        The text split into runs of sentences, each with whether it still needs the LLM.
+
+        Returns:
+            List of (Chunk, needs_llm) pairs covering every sentence in order; neighbouring
+            sentences with the same status share a chunk
+        """
+        residual = set(self.residual)
+        runs = []
+        for span in sentence_spans(self.text):
+            needs_llm = span in residual
+            if runs and runs[-1][1] == needs_llm:
+                runs[-1][0][1] = span[1]
+            else:
+                runs.append(([span[0], span[1]], needs_llm))
+        return [(Chunk(start, end, self.text[start:end]), needs_llm) for (start, end), needs_llm in runs]
+
+    def report(self, chunk: Chunk) -> str:
+        """A GrammarChecker-style completion for a chunk settled locally."""
+        errors = [error for error in self.errors if chunk.start <= error["start"] and error["end"] <= chunk.end]
+        shifted = [{**error, "start": error["start"] - chunk.start, "end": error["end"] - chunk.start}
+                   for error in errors]
+        lines = ["ORIGINAL TEXT:", chunk.text, "", "GRAMMATICAL ERRORS:"]
+        for number, error in enumerate(errors, start=1):
+            lines.append(f"{number}. Error: {error['error_text']}")
+            lines.append(f"   Correction: {error['correction']}")
+            lines.append(f"   Explanation: {error['explanation']}")
+        if not errors:
+            lines.append("No grammatical errors found")
+        lines.extend(["", "CORRECTED TEXT:", apply_corrections(chunk.text, shifted)])
+        return "\n".join(lines)
+
+
+def precheck(text: str, lexicon: Lexicon = None) -> PrecheckResult:
+    """
+    Fix what can be fixed locally in `text` and find the sentences that still need the LLM.
+
+    Args:
+        text: The text to check
+        lexicon: Known word forms (the bundled lexicon by default)
+
+    Returns:
+        PrecheckResult with the local corrections and the residual sentences
+    """
+    lexicon = lexicon or load_lexicon()
+    result = PrecheckResult(text)
+    for start, end in sentence_spans(text):
+        sentence_errors = []
+        settled = True
+        for match in WORD_PATTERN.finditer(text, start, end):
+            status, error = _check_word(lexicon, match, at_sentence_start=match.start() == start)
+            if status == "residual":
+                settled = False
+                break
+            if error:
+                sentence_errors.append(error)
+
+        if settled:
+            result.errors.extend(sentence_errors)
+        else:
+            result.residual.append((start, end))
+
+    # Spacing errors are only reported in sentences that are settled locally
+    residual = result.residual
+    result.errors.extend(error for error in _spacing_errors(text)
+                         if not any(start <= error["start"] < end for start, end in residual))
+    result.errors.sort(key=lambda error: error["start"])
+    return result
+
+
+def apply_corrections(text: str, errors: list) -> str:
+    """`text` with every error's [start, end) span replaced by its replacement."""
+    parts = []
+    position = 0
+    for error in sorted(errors, key=lambda error: error["start"]):
+        if error["start"] < position:
+            continue
+        parts.append(text[position:error["start"]])
+        parts.append(error["replacement"])
+        position = error["end"]
+    parts.append(text[position:])
+    return "".join(parts)
+
+
+def _check_word(lexicon: Lexicon, match, at_sentence_start: bool):
+    """Returns ("ok" | "fixed" | "residual", error or None) for one word."""
+    word = match.group()
+    lower = word.lower()
+    if lower in lexicon:
+        return ("residual", None) if lexicon.is_ambiguous(lower) else ("ok", None)
+
+    candidates = lexicon.corrections(lower)
+    if len(candidates) != 1:
+        # Not a word we know: a capitalized one inside a sentence is most likely a name
+        if not candidates and word[0].isupper() and not at_sentence_start:
+            return "ok", None
+        return "residual", None
+
+    correction = _match_case(word, candidates[0])
+    return "fixed", {
+        "error_text": word,
+        "correction": correction,
+        "explanation": _explain(lower, candidates[0]),
+        "start": match.start(),
+        "end": match.end(),
+        "replacement": correction,
+    }
+
+
+def _match_case(word: str, correction: str) -> str:
+    if word.isupper() and len(word) > 1:
+        return correction.upper()
+    if word[0].isupper():
+        return correction[0].upper() + correction[1:]
+    return correction
+
+
+def _explain(word: str, correction: str) -> str:
+    missing = [char for char in ("ë", "ç") if char in correction and correction.count(char) > word.count(char)]
+    reasons = []
+    if missing:
+        reasons.append(f"Mungon diakritiku {' dhe '.join(missing)}.")
+    if len(word) > len(correction):
+        reasons.append("Shkronjë e dyfishuar gabimisht.")
+    return " ".join(reasons)
+
+
+def _spacing_errors(text: str) -> list:
+    errors = []
+    for match in SPACE_BEFORE_PUNCTUATION.finditer(text):
+        errors.append(_spacing_error(text, match.start(), match.end(), "",
+                                     "Para shenjës së pikësimit nuk vendoset hapësirë."))
+    for match in MISSING_SPACE_AFTER_PUNCTUATION.finditer(text):
+        errors.append(_spacing_error(text, match.start(), match.end(), match.group() + " ",
+                                     "Pas shenjës së pikësimit vendoset një hapësirë."))
+    for match in REPEATED_SPACES.finditer(text):
+        errors.append(_spacing_error(text, match.start(), match.end(), " ", "Hapësira të tepërta."))
+    return errors
+
+
+def _spacing_error(text: str, start: int, end: int, replacement: str, explanation: str) -> dict:
+    # Only the spaces or the mark are replaced, but the neighbouring words are shown
+    context_start = max(text.rfind(" ", 0, start) + 1, text.rfind("\n", 0, start) + 1)
+    if context_start == start:
+        context_start = text.rfind(" ", 0, max(0, start - 1)) + 1
+    context_end = min(position for position in (text.find(" ", end + 1), text.find("\n", end + 1), len(text))
+                      if position != -1)
+    return {
+        "error_text": text[context_start:context_end],
+        "correction": text[context_start:start] + replacement + text[end:context_end],
+        "explanation": explanation,
+        "start": start,
+        "end": end,
+        "replacement": replacement,
+    }
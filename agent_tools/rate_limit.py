@@ -0,0 +1,400 @@
+"""
+Client-side rate limiting for the OpenAI calls of all tools.
+
+GrammarChecker, ToneAnalyzer and ToneRewriter share one API key, so they share one
+`RateLimiter`. Before a call it waits for
+  * a slot from an adaptive concurrency limit: additive increase while calls succeed,
+    multiplicative decrease when the provider answers 429 or calls get slower than a target
+    latency (AIMD, as in TCP congestion control), and
+  * room in the requests-per-minute and tokens-per-minute token buckets, when those limits are set.
+
+Rate-limited and transient failures (429, timeouts, connection errors, 5xx) are retried with
+exponentially growing, fully jittered delays, so a burst of 429s is smoothed out instead of
+coming back to the user as `{"error": ...}` results.
+
+Token counts are estimated before the call as prompt characters / 4 plus the completion budget
+(`max_tokens`), and corrected from the completion's length once it is known.
+"""
+import asyncio
+import threading
+import time
+
+import openai
+from langchain_core.runnables import Runnable
+
+from agent_tools.batching import backoff_delay, is_rate_limit_error
+from agent_tools.metrics import add_to_current_call
+
+# Used when the LLM has no completion budget (max_tokens=-1 means "as many as fit")
+DEFAULT_COMPLETION_TOKENS = 256
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """True for errors worth retrying after a pause: rate limits and transient provider failures."""
+    if is_rate_limit_error(error):
+        return True
+    if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError, openai.InternalServerError)):
+        return True
+    return (getattr(error, "status_code", None) or 0) >= 500
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for budgeting (about four characters per token)."""
+    return len(text) // 4 + 1
+
+
+class TokenBucket:
+    """Refills `rate_per_minute` units per minute, holding at most `capacity` (default: one minute's worth)."""
+
+    def __init__(self, rate_per_minute: float, capacity: float = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.available = self.capacity
+        self._updated = time.monotonic()
+
+    def reserve(self, amount: float) -> float:
+        """Take `amount` if it is available and return 0, else take nothing and return the seconds to wait."""
+        # A single request larger than the whole bucket would never fit
+        amount = min(amount, self.capacity)
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self._updated) * self.rate)
+        self._updated = now
+        if self.available >= amount:
+            self.available -= amount
+            return 0.0
+        return (amount - self.available) / self.rate
+
+    def refund(self, amount: float):
+        """Give back (or, if negative, additionally take) `amount` after a reservation turned out wrong."""
+        self.available = min(self.capacity, self.available + amount)
+
+
+class AdaptiveConcurrency:
+    """
+    Concurrency limit that adapts to the provider with additive increase / multiplicative decrease.
+
+    Every successful call raises the limit by 1/limit, i.e. by one per full window of successes;
+    a 429, or a call slower than `latency_target` seconds, multiplies it by `backoff_ratio`. A
+    burst of failures from one window only counts once, since the limit is lowered at most
+    once per `cooldown` seconds.
+    """
+
+    def __init__(self, initial: int = 8, min_limit: int = 1, max_limit: int = 64, backoff_ratio: float = 0.5,
+                 latency_target: float = None, cooldown: float = 1.0):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff_ratio = backoff_ratio
+        self.latency_target = latency_target
+        self.cooldown = cooldown
+
+        self.in_flight = 0
+        self.decreases = 0
+        self._last_decrease = float("-inf")
+        self._condition = threading.Condition()
+
+    def try_acquire(self) -> bool:
+        with self._condition:
+            if self.in_flight >= int(self.limit):
+                return False
+            self.in_flight += 1
+            return True
+
+    def acquire(self):
+        with self._condition:
+            self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self, latency: float):
+        with self._condition:
+            if self.latency_target is not None and latency > self.latency_target:
+                self._decrease()
+            else:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self._condition.notify_all()
+
+    def on_overload(self):
+        with self._condition:
+            self._decrease()
+
+    def _decrease(self):
+        now = time.monotonic()
+        if now - self._last_decrease >= self.cooldown:
+            self.limit = max(self.min_limit, self.limit * self.backoff_ratio)
+            self._last_decrease = now
+            self.decreases += 1
+
+
+class RateLimiter:
+    """
+    Shared gate for LLM calls: adaptive concurrency, RPM/TPM budgets and jittered retries.
+
+    Args:
+        requests_per_minute: Request budget, or None for no limit
+        tokens_per_minute: Prompt + completion token budget, or None for no limit
+        concurrency: The adaptive concurrency limit (a default AdaptiveConcurrency if omitted)
+        max_retries: How many times a rate-limited or transiently failing call is retried
+        base_delay: Initial backoff delay in seconds
+        max_delay: Upper bound of a single backoff delay in seconds
+    """
+
+    def __init__(self, requests_per_minute: float = None, tokens_per_minute: float = None,
+                 concurrency: AdaptiveConcurrency = None, max_retries: int = 4, base_delay: float = 1.0,
+                 max_delay: float = 30.0):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.concurrency = concurrency or AdaptiveConcurrency()
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.failures = 0
+        self.wait_seconds = 0.0
+
+    def call(self, fn, tokens: int = 0):
+        """
+        Run `fn()` within the limits, retrying rate-limited and transient failures.
+
+        Args:
+            fn: Function making one LLM call
+            tokens: Estimated tokens of the call, charged against the TPM budget
+
+        Returns:
+            The result of `fn()`
+
+        Raises:
+            The last error once it is not retryable or the retries are used up
+        """
+        for attempt in range(self.max_retries + 1):
+            self._acquire(tokens)
+            started = time.monotonic()
+            try:
+                result = fn()
+            except Exception as e:
+                self.concurrency.release()
+                if not self._should_retry(e, attempt):
+                    raise
+                time.sleep(backoff_delay(attempt, self.base_delay, self.max_delay))
+                continue
+            self.concurrency.release()
+            self._record_success(time.monotonic() - started)
+            return result
+
+    async def acall(self, coroutine_fn, tokens: int = 0):
+        """Async counterpart of `call`; `coroutine_fn()` returns the awaitable making the call."""
+        for attempt in range(self.max_retries + 1):
+            await self._aacquire(tokens)
+            started = time.monotonic()
+            try:
+                result = await coroutine_fn()
+            except Exception as e:
+                self.concurrency.release()
+                if not self._should_retry(e, attempt):
+                    raise
+                await asyncio.sleep(backoff_delay(attempt, self.base_delay, self.max_delay))
+                continue
+            self.concurrency.release()
+            self._record_success(time.monotonic() - started)
+            return result
+
+    def stream(self, fn, tokens: int = 0):
+        """
+        Yield from the iterator `fn()` within the limits, holding the slot until the stream ends.
+
+        Failures before the first chunk are retried like in `call`; once chunks have been yielded
+        the stream cannot be restarted, so later errors are raised as they are.
+        """
+        for attempt in range(self.max_retries + 1):
+            self._acquire(tokens)
+            started = time.monotonic()
+            yielded = False
+            try:
+                for chunk in fn():
+                    yielded = True
+                    yield chunk
+            except Exception as e:
+                if yielded or not self._should_retry(e, attempt):
+                    raise
+                retry_in = backoff_delay(attempt, self.base_delay, self.max_delay)
+            else:
+                self._record_success(time.monotonic() - started)
+                return
+            finally:
+                self.concurrency.release()
+            time.sleep(retry_in)
+
+    async def astream(self, iterator_fn, tokens: int = 0):
+        """Async counterpart of `stream`; `iterator_fn()` returns an async iterator of chunks."""
+        for attempt in range(self.max_retries + 1):
+            await self._aacquire(tokens)
+            started = time.monotonic()
+            yielded = False
+            try:
+                async for chunk in iterator_fn():
+                    yielded = True
+                    yield chunk
+            except Exception as e:
+                if yielded or not self._should_retry(e, attempt):
+                    raise
+                retry_in = backoff_delay(attempt, self.base_delay, self.max_delay)
+            else:
+                self._record_success(time.monotonic() - started)
+                return
+            finally:
+                self.concurrency.release()
+            await asyncio.sleep(retry_in)
+
+    def adjust_tokens(self, estimated: int, actual: int):
+        """Correct the TPM budget once the real size of a call is known."""
+        if self.tokens is not None:
+            with self._lock:
+                self.tokens.refund(estimated - actual)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "retries": self.retries,
+                "rate_limited": self.rate_limited,
+                "failures": self.failures,
+                "wait_seconds": round(self.wait_seconds, 3),
+                "concurrency_limit": round(self.concurrency.limit, 2),
+                "in_flight": self.concurrency.in_flight,
+            }
+
+    def _reserve(self, tokens: int) -> float:
+        """Reserve one request and `tokens` tokens; returns 0, or how long to wait before trying again."""
+        with self._lock:
+            wait = self.requests.reserve(1) if self.requests else 0.0
+            if wait:
+                return wait
+            if self.tokens:
+                wait = self.tokens.reserve(tokens)
+                if wait:
+                    # Both budgets are taken together or not at all
+                    if self.requests:
+                        self.requests.refund(1)
+                    return wait
+            self.calls += 1
+            return 0.0
+
+    def _acquire(self, tokens: int):
+        started = time.monotonic()
+        self.concurrency.acquire()
+        while True:
+            wait = self._reserve(tokens)
+            if not wait:
+                break
+            time.sleep(wait)
+        self._add_wait(time.monotonic() - started)
+
+    async def _aacquire(self, tokens: int):
+        # The limit is shared with threads, so the event loop polls for a slot instead of blocking on it
+        started = time.monotonic()
+        delay = 0.005
+        while not self.concurrency.try_acquire():
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.1)
+        while True:
+            wait = self._reserve(tokens)
+            if not wait:
+                break
+            await asyncio.sleep(wait)
+        self._add_wait(time.monotonic() - started)
+
+    def _should_retry(self, error: Exception, attempt: int) -> bool:
+        rate_limited = is_rate_limit_error(error)
+        if rate_limited:
+            self.concurrency.on_overload()
+        with self._lock:
+            self.rate_limited += rate_limited
+            retry = attempt < self.max_retries and is_retryable_error(error)
+            if retry:
+                self.retries += 1
+            else:
+                self.failures += 1
+        if retry:
+            add_to_current_call(retries=1)
+        return retry
+
+    def _record_success(self, latency: float):
+        self.concurrency.on_success(latency)
+
+    def _add_wait(self, seconds: float):
+        with self._lock:
+            self.wait_seconds += seconds
+        add_to_current_call(queue_wait=seconds)
+
+
+class RateLimitedLLM(Runnable):
+    """
+    Wraps an LLM so every call goes through a `RateLimiter`.
+
+    Drop-in for the wrapped LLM in `prompt | llm` chains; other attributes (model_name,
+    temperature, ...) are read from the wrapped LLM. `batch`/`abatch` come from `Runnable` and
+    call `invoke`/`ainvoke` per input, so each item is limited on its own.
+    """
+
+    # Tells batch_invoke not to add its own retries on top of the limiter's
+    retries_rate_limits = True
+
+    def __init__(self, llm, limiter: RateLimiter):
+        self.llm = llm
+        self.limiter = limiter
+
+    def __getattr__(self, name):
+        # Only called for attributes not found on the wrapper itself
+        if name in ("llm", "limiter"):
+            raise AttributeError(name)
+        return getattr(self.llm, name)
+
+    def invoke(self, input, config=None, **kwargs):
+        tokens = self._estimate(input)
+        result = self.limiter.call(lambda: self.llm.invoke(input, config, **kwargs), tokens)
+        self.limiter.adjust_tokens(tokens, self._actual(input, result))
+        return result
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        tokens = self._estimate(input)
+        result = await self.limiter.acall(lambda: self.llm.ainvoke(input, config, **kwargs), tokens)
+        self.limiter.adjust_tokens(tokens, self._actual(input, result))
+        return result
+
+    def stream(self, input, config=None, **kwargs):
+        tokens = self._estimate(input)
+        chunks = []
+        for chunk in self.limiter.stream(lambda: self.llm.stream(input, config, **kwargs), tokens):
+            chunks.append(chunk)
+            yield chunk
+        self.limiter.adjust_tokens(tokens, self._actual(input, "".join(map(str, chunks))))
+
+    async def astream(self, input, config=None, **kwargs):
+        tokens = self._estimate(input)
+        chunks = []
+        async for chunk in self.limiter.astream(lambda: self.llm.astream(input, config, **kwargs), tokens):
+            chunks.append(chunk)
+            yield chunk
+        self.limiter.adjust_tokens(tokens, self._actual(input, "".join(map(str, chunks))))
+
+    def _estimate(self, input) -> int:
+        max_tokens = getattr(self.llm, "max_tokens", None)
+        if not max_tokens or max_tokens < 0:
+            max_tokens = DEFAULT_COMPLETION_TOKENS
+        return estimate_tokens(prompt_text(input)) + max_tokens
+
+    def _actual(self, input, output) -> int:
+        return estimate_tokens(prompt_text(input)) + estimate_tokens(str(output))
+
+
+def prompt_text(input) -> str:
+    """The prompt an LLM input stands for, as one string."""
+    return input.to_string() if hasattr(input, "to_string") else str(input)
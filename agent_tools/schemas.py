@@ -0,0 +1,45 @@
+"""
+Schemas for structured (JSON) tool output.
+
+The models are validated with pydantic, which LangChain already depends on. Pydantic compiles
+each model's validator once, when the class is defined, so `model_validate_json` parses and
+validates a completion in a single pass without building intermediate dicts.
+"""
+from typing import Dict, List
+
+from pydantic import BaseModel, Field
+
+
+class GrammarError(BaseModel):
+    error: str
+    correction: str
+    explanation: str = ""
+
+
+class GrammarReport(BaseModel):
+    """The GrammarChecker section: the text, its errors and the corrected text."""
+
+    original_text: str
+    grammatical_errors: List[GrammarError]
+    corrected_text: str
+
+
+class ToneReport(BaseModel):
+    """The ToneAnalyzer section."""
+
+    tone: str
+    formality_level: int = Field(ge=1, le=5)
+    sentiment: str
+    tone_analysis: str
+
+
+class RewriteReport(BaseModel):
+    """The ToneRewriter section."""
+
+    original_tone: str
+    # Tone name -> text rewritten in that tone
+    rewrites: Dict[str, str]
+
+
+class FusedAnalysis(GrammarReport, ToneReport, RewriteReport):
+    """Grammar check, tone analysis and rewrite of one text, produced by a single completion."""
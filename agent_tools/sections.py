@@ -0,0 +1,77 @@
+"""
+Single-pass parsing of the section headers in the tools' text output.
+
+GrammarChecker, ToneAnalyzer and ToneRewriter answer in blocks introduced by fixed headers
+("ORIGINAL TEXT:", "TONE:", "REWRITTEN TEXT:", ...). Instead of searching the whole text once
+per header and once more per possible end marker, one compiled alternation finds every header
+in a single scan; each section runs from the end of its header to the start of the next one.
+
+Headers are only recognised at the start of a line (after optional indentation or markdown
+`#`/`*`), which is where every prompt puts them. Anchoring on the newline also gives the pattern
+a literal prefix, so the regex engine can skip ahead to candidate lines instead of trying the
+alternation at every character.
+"""
+import re
+from dataclasses import dataclass
+
+HEADERS = [
+    "ORIGINAL TEXT",
+    "GRAMMATICAL ERRORS",
+    "CORRECTED TEXT",
+    "TONE",
+    "FORMALITY LEVEL",
+    "SENTIMENT",
+    "TONE ANALYSIS",
+    "ORIGINAL TONE",
+    "TARGET TONE",
+    "REWRITTEN TEXT",
+    "FORMAL TONE VERSION",
+    "FRIENDLY TONE VERSION",
+    "PERSUASIVE TONE VERSION",
+]
+
+# Longest headers first, so "TONE ANALYSIS:" is not read as "TONE" followed by junk
+HEADER_PATTERN = re.compile(r"\n[ \t#*]*(" + "|".join(re.escape(header)
+                                                     for header in sorted(HEADERS, key=len, reverse=True)) + "):")
+
+
+@dataclass
+class Section:
+    """Body of one header; `start` and `end` are offsets of the body in the parsed text."""
+
+    start: int
+    end: int
+    text: str
+
+
+def parse_sections(text: str) -> dict:
+    """
+    Split tool output into its sections.
+
+    Args:
+        text: Output of one tool, or several tools' outputs joined together
+
+    Returns:
+        Dict mapping each header found (without the colon) to its Section, with the body
+        stripped of surrounding whitespace. If a header occurs twice the first one is kept.
+    """
+    sections = {}
+    if not text:
+        return sections
+
+    # The leading newline lets a header on the first line match too; offsets are shifted back by one
+    matches = list(HEADER_PATTERN.finditer("\n" + text))
+    for index, match in enumerate(matches):
+        header = match.group(1)
+        if header in sections:
+            continue
+        start = match.end() - 1
+        end = matches[index + 1].start() - 1 if index + 1 < len(matches) else len(text)
+        sections[header] = Section(start, end, text[start:end].strip())
+    return sections
+
+
+def section_text(sections: dict, header: str) -> str:
+    """Body of `header` in a map from `parse_sections`, or an empty string if it is missing."""
+    section = sections.get(header)
+    return section.text if section else ""
@@ -0,0 +1,88 @@
+"""
+Request coalescing ("single flight") for identical in-flight calls.
+
+While a call for a key is running, further calls with the same key wait for it and share its
+result (or exception) instead of starting their own. Once the call finishes the key is free
+again, so this only deduplicates concurrent work; repeated work over time is the response
+cache's job.
+"""
+import asyncio
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key across threads."""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        # Calls that ran, and calls that waited on one of those instead
+        self.executed = 0
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        """Return `fn()`, or the result of the identical call already in flight for `key`."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executed += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"executed": self.executed, "coalesced": self.coalesced, "in_flight": len(self._calls)}
+
+
+class AsyncSingleFlight:
+    """Coalesces concurrent coroutine calls with the same key on an event loop."""
+
+    def __init__(self):
+        self._tasks = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    async def do(self, key, coroutine_fn):
+        """Await `coroutine_fn()`, or the identical call already in flight for `key`."""
+        # Tasks belong to one loop, so calls on different loops are never coalesced
+        key = (id(asyncio.get_running_loop()), key)
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(coroutine_fn())
+            self._tasks[key] = task
+            task.add_done_callback(lambda done: self._tasks.pop(key) if self._tasks.get(key) is done else None)
+            self.executed += 1
+        else:
+            self.coalesced += 1
+
+        # A caller that is cancelled stops waiting without cancelling the shared call
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        return {"executed": self.executed, "coalesced": self.coalesced, "in_flight": len(self._tasks)}
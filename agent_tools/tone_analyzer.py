@@ -1,6 +1,14 @@
+import logging
+
 from smolagents import Tool
 from langchain.prompts import PromptTemplate
-from langchain_openai.llms import OpenAI
+
+from agent_tools.batching import batch_invoke, abatch_invoke
+from agent_tools.cache import tool_cache_key, cached_invoke, acached_invoke, cached_stream, acached_stream
+from agent_tools.llm import get_llm
+from agent_tools.near_duplicate import near_duplicate_chain
+
+logger = logging.getLogger(__name__)
 
 
 class ToneAnalyzer(Tool):
@@ -15,8 +23,18 @@ class ToneAnalyzer(Tool):
 
     output_type = "string"
 
-    def __init__(self):
-        self.llm = OpenAI(temperature=0)
+    prompt_version = "1"
+
+    def __init__(self, cache=None, llm=None, classifier=None, near_duplicate_cache=None, llm_timeout: float = None):
+        self.cache = cache
+        # Seconds one LLM request may take (None: the registry's OPENAI_TIMEOUT)
+        self.llm_timeout = llm_timeout
+        # Optional NearDuplicateCache: reuses the analysis of a text differing only in names, punctuation, ...
+        self.near_duplicate_cache = near_duplicate_cache
+        # Optional local first tier (see tone_classifier.py): texts it is confident about skip the LLM
+        self.classifier = classifier
+        self._llm = llm
+        self._tone_chain = None
 
         tone_template = """
         You are an expert in analyzing the tone and sentiment of Albanian language text.
@@ -39,16 +57,103 @@ class ToneAnalyzer(Tool):
         [Brief explanation of tone characteristics]
         """
 
-        tone_prompt = PromptTemplate(
+        self.tone_prompt = PromptTemplate(
             input_variables=["text"],
             template=tone_template
         )
 
-        self.tone_chain = tone_prompt | self.llm
+    @property
+    def llm(self):
+        if self._llm is None:
+            self._llm = get_llm(temperature=0, timeout=self.llm_timeout)
+        return self._llm
+
+    @llm.setter
+    def llm(self, llm):
+        self._llm = llm
+        self._tone_chain = None
+
+    @property
+    def tone_chain(self):
+        if self._tone_chain is None:
+            self._tone_chain = near_duplicate_chain(self.tone_prompt | self.llm, self.near_duplicate_cache, self)
+        return self._tone_chain
+
+    @tone_chain.setter
+    def tone_chain(self, chain):
+        self._tone_chain = chain
 
     def forward(self, text: str):
+        local = self._answer_locally([text])[0]
+        if local is not None:
+            return local
+        try:
+            result = cached_invoke(self.cache, tool_cache_key(self, text), self.tone_chain, {"text": text})
+            return result
+        except Exception as e:
+            return str({"error": str(e)})
+
+    async def aforward(self, text: str):
+        local = self._answer_locally([text])[0]
+        if local is not None:
+            return local
         try:
-            result = self.tone_chain.invoke({"text": text})
+            result = await acached_invoke(self.cache, tool_cache_key(self, text), self.tone_chain, {"text": text})
             return result
         except Exception as e:
-            return {"error": str(e)}
+            return str({"error": str(e)})
+
+    def forward_stream(self, text: str):
+        local = self._answer_locally([text])[0]
+        if local is not None:
+            yield local
+            return
+        try:
+            yield from cached_stream(self.cache, tool_cache_key(self, text), self.tone_chain, {"text": text})
+        except Exception as e:
+            yield str({"error": str(e)})
+
+    async def aforward_stream(self, text: str):
+        local = self._answer_locally([text])[0]
+        if local is not None:
+            yield local
+            return
+        try:
+            async for chunk in acached_stream(self.cache, tool_cache_key(self, text), self.tone_chain,
+                                              {"text": text}):
+                yield chunk
+        except Exception as e:
+            yield str({"error": str(e)})
+
+    def forward_batch(self, texts: list, max_concurrency: int = 4) -> list:
+        outputs = self._answer_locally(texts)
+        pending = [index for index, output in enumerate(outputs) if output is None]
+        pending_texts = [texts[index] for index in pending]
+        results = batch_invoke(self.tone_chain, [{"text": text} for text in pending_texts],
+                               max_concurrency=max_concurrency, cache=self.cache,
+                               keys=[tool_cache_key(self, text) for text in pending_texts])
+        for index, result in zip(pending, results):
+            outputs[index] = str({"error": str(result)}) if isinstance(result, Exception) else result
+        return outputs
+
+    async def aforward_batch(self, texts: list, max_concurrency: int = 4) -> list:
+        outputs = self._answer_locally(texts)
+        pending = [index for index, output in enumerate(outputs) if output is None]
+        pending_texts = [texts[index] for index in pending]
+        results = await abatch_invoke(self.tone_chain, [{"text": text} for text in pending_texts],
+                                      max_concurrency=max_concurrency, cache=self.cache,
+                                      keys=[tool_cache_key(self, text) for text in pending_texts])
+        for index, result in zip(pending, results):
+            outputs[index] = str({"error": str(result)}) if isinstance(result, Exception) else result
+        return outputs
+
+    def _answer_locally(self, texts: list) -> list:
+        """The classifier's answer per text, or None where the LLM is needed."""
+        if self.classifier is None:
+            return [None] * len(texts)
+        try:
+            return self.classifier.answer(texts)
+        except Exception:
+            # The classifier is only a shortcut; if it fails, the LLM answers instead
+            logger.warning("Tone classifier failed, escalating to the LLM", exc_info=True)
+            return [None] * len(texts)
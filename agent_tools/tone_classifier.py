@@ -0,0 +1,379 @@
+"""
+Local first tier for the ToneAnalyzer: linear classifiers over hashed character n-grams.
+
+Most texts sent to the ToneAnalyzer are ordinary emails and messages whose tone, formality and
+sentiment are easy to call. A small model trained on the LLM's own past answers gets those right
+without a completion. Only the texts it is unsure about still go to the LLM.
+
+Features are the character 2- to 5-grams of the normalized, lowercased text, hashed into a
+fixed number of buckets (no vocabulary to store) and weighted by 1 + log(count), with every row
+scaled to unit length. The vectorizer works on a whole batch at once. All texts are joined into
+one array of code points, the n-gram hashes of every position are computed with a few NumPy
+operations, and windows that cross from one text into the next are dropped.
+
+Each output (tone, formality level 1-5, sentiment) has its own multinomial logistic regression
+over those features. Raw softmax scores of a linear model are overconfident, so every head gets
+a temperature fitted on held-out examples (temperature scaling). A prediction is answered
+locally only if all three calibrated probabilities reach the classifier's threshold.
+
+Training data are logged ToneAnalyzer calls, e.g. a cassette recorded with
+LLM_CASSETTE_MODE=record:
+
+    python -m agent_tools.tone_classifier tone_calls.cassette --output tone_classifier.npz
+
+Set TONE_CLASSIFIER_PATH to the saved model to enable the first tier in the apps.
+"""
+import argparse
+import math
+import re
+from dataclasses import dataclass
+
+import numpy as np
+
+from agent_tools.cache import normalize_text
+from agent_tools.cassette import Cassette
+from agent_tools.sections import parse_sections, section_text
+
+HEADS = ("tone", "formality", "sentiment")
+
+# Multiplier of the rolling n-gram hash, and the odd constant used to spread it over the buckets
+HASH_PRIME = np.uint64(1000003)
+HASH_MIX = np.uint64(0x9E3779B97F4A7C15)
+
+# The text inside a logged ToneAnalyzer prompt
+PROMPT_TEXT_PATTERN = re.compile(r"Text to analyze: (.*?)\n\s*Provide your analysis", re.DOTALL)
+LABEL_PATTERN = re.compile(r"[^\W\d_]+")
+
+
+@dataclass
+class Features:
+    """Sparse feature matrix in coordinate form, sorted by row."""
+
+    rows: np.ndarray
+    cols: np.ndarray
+    values: np.ndarray
+    n_rows: int
+
+
+class HashingVectorizer:
+    """
+    Hashed character n-gram features for a batch of texts.
+
+    Args:
+        n_features: Number of hash buckets; a power of two
+        ngram_range: Smallest and largest n-gram length
+    """
+
+    def __init__(self, n_features: int = 2 ** 16, ngram_range: tuple = (2, 5)):
+        if n_features < 2 or n_features & (n_features - 1):
+            raise ValueError(f"n_features must be a power of two, not {n_features}")
+        self.n_features = n_features
+        self.ngram_range = tuple(ngram_range)
+        self._shift = np.uint64(64 - (n_features.bit_length() - 1))
+
+    def transform(self, texts: list) -> Features:
+        # Padding marks word boundaries at both ends; NUL separates the texts, so any NUL inside
+        # a text is turned into a space first
+        joined = "\0".join(" " + normalize_text(text).replace("\0", " ").lower() + " " for text in texts)
+        codes = np.frombuffer(joined.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+        # separators[i] is the number of separators before position i, i.e. the row of position i
+        separators = np.concatenate(([0], np.cumsum(codes == 0)))
+
+        rows, cols = [], []
+        low, high = self.ngram_range
+        for n in range(low, high + 1):
+            windows = len(codes) - n + 1
+            if windows <= 0:
+                continue
+            hashes = np.full(windows, n, dtype=np.uint64)
+            for offset in range(n):
+                hashes = hashes * HASH_PRIME + codes[offset:offset + windows]
+            inside = separators[n:n + windows] == separators[:windows]
+            rows.append(separators[:windows][inside])
+            cols.append(((hashes * HASH_MIX) >> self._shift)[inside].astype(np.int64))
+
+        if not rows:
+            empty = np.zeros(0, dtype=np.int64)
+            return Features(empty, empty, np.zeros(0), len(texts))
+
+        keys, counts = np.unique(np.concatenate(rows) * self.n_features + np.concatenate(cols), return_counts=True)
+        rows, cols = np.divmod(keys, self.n_features)
+        values = 1.0 + np.log(counts)
+        norms = np.sqrt(np.bincount(rows, weights=values ** 2, minlength=len(texts)))
+        return Features(rows, cols, values / norms[rows], len(texts))
+
+
+class LinearHead:
+    """Multinomial logistic regression for one output, with a calibration temperature."""
+
+    def __init__(self, labels: list, weights: np.ndarray, bias: np.ndarray, temperature: float = 1.0):
+        self.labels = list(labels)
+        self.weights = weights
+        self.bias = bias
+        self.temperature = temperature
+
+    def logits(self, features: Features) -> np.ndarray:
+        scores = np.empty((features.n_rows, len(self.labels)))
+        for column in range(len(self.labels)):
+            scores[:, column] = np.bincount(features.rows,
+                                            weights=features.values * self.weights[features.cols, column],
+                                            minlength=features.n_rows)
+        return scores + self.bias
+
+    def probabilities(self, features: Features) -> np.ndarray:
+        return _softmax(self.logits(features) / self.temperature)
+
+    @classmethod
+    def fit(cls, features: Features, labels: list, n_features: int, epochs: int = 200, learning_rate: float = 0.1,
+            l2: float = 1e-4) -> "LinearHead":
+        """Full-batch Adam on the cross-entropy of `labels`."""
+        classes = sorted(set(labels))
+        if len(classes) < 2:
+            raise ValueError(f"Need at least two different labels to train on, got {classes}")
+        targets = np.zeros((features.n_rows, len(classes)))
+        targets[np.arange(features.n_rows), [classes.index(label) for label in labels]] = 1.0
+
+        head = cls(classes, np.zeros((n_features, len(classes))), np.zeros(len(classes)))
+        moments = [np.zeros_like(head.weights), np.zeros_like(head.weights),
+                   np.zeros_like(head.bias), np.zeros_like(head.bias)]
+        for step in range(1, epochs + 1):
+            errors = (_softmax(head.logits(features)) - targets) / features.n_rows
+            weight_gradient = np.empty_like(head.weights)
+            for column in range(len(classes)):
+                weight_gradient[:, column] = np.bincount(features.cols,
+                                                         weights=features.values * errors[features.rows, column],
+                                                         minlength=n_features)
+            weight_gradient += l2 * head.weights
+            _adam_step(head.weights, weight_gradient, moments[0], moments[1], step, learning_rate)
+            _adam_step(head.bias, errors.sum(axis=0), moments[2], moments[3], step, learning_rate)
+
+        head.weights = head.weights.astype(np.float32)
+        return head
+
+    def calibrate(self, features: Features, labels: list):
+        """
+        Pick the temperature with the lowest negative log-likelihood on `labels`.
+
+        Only temperatures of at least 1 are tried: logged data are often easy enough to be
+        separated perfectly, and sharpening the scores to fit them would make the model
+        overconfident on anything unlike its training texts.
+        """
+        known = [index for index, label in enumerate(labels) if label in self.labels]
+        if not known:
+            return
+        logits = self.logits(features)[known]
+        targets = np.array([self.labels.index(labels[index]) for index in known])
+
+        def loss(temperature):
+            probabilities = _softmax(logits / temperature)
+            return -np.log(probabilities[np.arange(len(targets)), targets] + 1e-12).mean()
+
+        self.temperature = float(min(np.geomspace(1, 50, 200), key=loss))
+
+
+@dataclass
+class TonePrediction:
+    tone: str
+    formality: str
+    sentiment: str
+    # Lowest calibrated probability of the three outputs
+    confidence: float
+
+    def render(self) -> str:
+        """The prediction in the ToneAnalyzer's output format."""
+        return "\n".join([
+            "TONE:", self.tone.capitalize(), "",
+            "FORMALITY LEVEL:", self.formality, "",
+            "SENTIMENT:", self.sentiment.capitalize(), "",
+            "TONE ANALYSIS:",
+            f"Vlerësuar nga klasifikuesi lokal pa thirrje te modeli gjuhësor "
+            f"(besueshmëria {self.confidence:.0%}).",
+        ])
+
+
+class ToneClassifier:
+    """
+    Local tone, formality and sentiment classifier.
+
+    Args:
+        vectorizer: Feature extractor shared by the three heads
+        heads: LinearHead per output in HEADS
+        threshold: Lowest calibrated probability, on every output, for a prediction to be used
+    """
+
+    def __init__(self, vectorizer: HashingVectorizer, heads: dict, threshold: float = 0.9):
+        self.vectorizer = vectorizer
+        self.heads = heads
+        self.threshold = threshold
+
+    def predict(self, texts: list) -> list:
+        """A TonePrediction per text."""
+        if not texts:
+            return []
+        features = self.vectorizer.transform(texts)
+        labels, confidence = {}, np.ones(len(texts))
+        for name, head in self.heads.items():
+            probabilities = head.probabilities(features)
+            best = probabilities.argmax(axis=1)
+            labels[name] = [head.labels[index] for index in best]
+            confidence = np.minimum(confidence, probabilities[np.arange(len(texts)), best])
+        return [TonePrediction(labels["tone"][index], labels["formality"][index], labels["sentiment"][index],
+                               float(confidence[index])) for index in range(len(texts))]
+
+    def answer(self, texts: list) -> list:
+        """ToneAnalyzer output for every text predicted confidently, None for the ones to escalate."""
+        return [prediction.render() if prediction.confidence >= self.threshold else None
+                for prediction in self.predict(texts)]
+
+    def evaluate(self, texts: list, outputs: list) -> dict:
+        """
+        Compare predictions with logged LLM outputs.
+
+        Returns:
+            Dict with the share of texts answered locally (coverage), the accuracy on those,
+            and the accuracy on all texts. A prediction is accurate if all three outputs match.
+        """
+        examples = [(text, labels) for text, labels in zip(texts, map(parse_tone_output, outputs)) if labels]
+        predictions = self.predict([text for text, _ in examples])
+        correct = [all(getattr(prediction, name) == labels[name] for name in HEADS)
+                   for prediction, (_, labels) in zip(predictions, examples)]
+        confident = [ok for ok, prediction in zip(correct, predictions) if prediction.confidence >= self.threshold]
+        return {
+            "examples": len(examples),
+            "coverage": len(confident) / len(examples) if examples else 0.0,
+            "confident_accuracy": sum(confident) / len(confident) if confident else 0.0,
+            "accuracy": sum(correct) / len(correct) if correct else 0.0,
+        }
+
+    @classmethod
+    def train(cls, texts: list, outputs: list, n_features: int = 2 ** 16, threshold: float = 0.9,
+              validation_share: float = 0.2, epochs: int = 200, seed: int = 0) -> "ToneClassifier":
+        """
+        Train on logged ToneAnalyzer calls.
+
+        Args:
+            texts: The analyzed texts
+            outputs: The LLM's answer for each text; answers without all three sections are skipped
+            n_features: Hash buckets of the vectorizer
+            threshold: Confidence needed to answer locally
+            validation_share: Share of the examples held out to fit the calibration temperatures
+                (calibrated on the training examples if too few are left)
+            epochs: Gradient steps per head
+            seed: Seed of the train/validation split
+
+        Raises:
+            ValueError: If there are no usable examples or an output has only one label
+        """
+        examples = [(text, labels) for text, labels in zip(texts, map(parse_tone_output, outputs)) if labels]
+        if not examples:
+            raise ValueError("No logged outputs with TONE, FORMALITY LEVEL and SENTIMENT sections")
+
+        order = np.random.default_rng(seed).permutation(len(examples))
+        held_out = int(len(examples) * validation_share) if len(examples) * validation_share >= 10 else 0
+        train = [examples[index] for index in order[held_out:]]
+        validation = [examples[index] for index in order[:held_out]] or train
+
+        vectorizer = HashingVectorizer(n_features)
+        train_features = vectorizer.transform([text for text, _ in train])
+        validation_features = vectorizer.transform([text for text, _ in validation])
+        heads = {}
+        for name in HEADS:
+            head = LinearHead.fit(train_features, [labels[name] for _, labels in train], n_features, epochs=epochs)
+            head.calibrate(validation_features, [labels[name] for _, labels in validation])
+            heads[name] = head
+        return cls(vectorizer, heads, threshold)
+
+    def save(self, path: str):
+        arrays = {"n_features": self.vectorizer.n_features, "ngram_range": self.vectorizer.ngram_range,
+                  "threshold": self.threshold}
+        for name, head in self.heads.items():
+            arrays[f"{name}_labels"] = np.array(head.labels)
+            arrays[f"{name}_weights"] = head.weights
+            arrays[f"{name}_bias"] = head.bias
+            arrays[f"{name}_temperature"] = head.temperature
+        np.savez_compressed(path, **arrays)
+
+    @classmethod
+    def load(cls, path: str) -> "ToneClassifier":
+        with np.load(path, allow_pickle=False) as arrays:
+            vectorizer = HashingVectorizer(int(arrays["n_features"]), tuple(int(n) for n in arrays["ngram_range"]))
+            heads = {name: LinearHead([str(label) for label in arrays[f"{name}_labels"]], arrays[f"{name}_weights"],
+                                      arrays[f"{name}_bias"], float(arrays[f"{name}_temperature"]))
+                     for name in HEADS}
+            return cls(vectorizer, heads, float(arrays["threshold"]))
+
+
+def parse_tone_output(output: str):
+    """
+    Labels in a ToneAnalyzer answer.
+
+    Returns:
+        Dict with the tone and sentiment as lowercase words and the formality level as a digit,
+        or None if a section is missing
+    """
+    sections = parse_sections(output)
+    tone = LABEL_PATTERN.search(section_text(sections, "TONE"))
+    formality = re.search(r"[1-5]", section_text(sections, "FORMALITY LEVEL"))
+    sentiment = LABEL_PATTERN.search(section_text(sections, "SENTIMENT"))
+    if not (tone and formality and sentiment):
+        return None
+    return {"tone": tone.group().lower(), "formality": formality.group(), "sentiment": sentiment.group().lower()}
+
+
+def examples_from_cassette(path: str) -> tuple:
+    """Texts and outputs of the ToneAnalyzer calls recorded in a cassette."""
+    texts, outputs = [], []
+    cassette = Cassette(path)
+    try:
+        for prompt, response in cassette.records():
+            match = PROMPT_TEXT_PATTERN.search(prompt)
+            if match and "FORMALITY LEVEL" in prompt:
+                texts.append(match.group(1))
+                outputs.append(response)
+    finally:
+        cassette.close()
+    return texts, outputs
+
+
+def _softmax(logits: np.ndarray) -> np.ndarray:
+    exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+def _adam_step(parameter, gradient, first, second, step, learning_rate, beta1=0.9, beta2=0.999, epsilon=1e-8):
+    first *= beta1
+    first += (1 - beta1) * gradient
+    second *= beta2
+    second += (1 - beta2) * gradient ** 2
+    scale = learning_rate * math.sqrt(1 - beta2 ** step) / (1 - beta1 ** step)
+    parameter -= scale * first / (np.sqrt(second) + epsilon)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the local tone classifier on recorded ToneAnalyzer calls.")
+    parser.add_argument("cassettes", nargs="+", help="cassette files recorded with LLM_CASSETTE_MODE=record")
+    parser.add_argument("--output", default="tone_classifier.npz")
+    parser.add_argument("--threshold", type=float, default=0.9, help="confidence needed to skip the LLM")
+    parser.add_argument("--features", type=int, default=2 ** 16, help="hash buckets (a power of two)")
+    parser.add_argument("--epochs", type=int, default=200)
+    args = parser.parse_args()
+
+    texts, outputs = [], []
+    for path in args.cassettes:
+        cassette_texts, cassette_outputs = examples_from_cassette(path)
+        texts.extend(cassette_texts)
+        outputs.extend(cassette_outputs)
+
+    # Hold out a fifth for the report; the saved model is trained on everything
+    split = len(texts) - len(texts) // 5
+    report = ToneClassifier.train(texts[:split], outputs[:split], args.features, args.threshold,
+                                  epochs=args.epochs).evaluate(texts[split:], outputs[split:])
+    print(f"{len(texts)} logged calls; held out {report['examples']}: coverage {report['coverage']:.0%}, "
+          f"accuracy when confident {report['confident_accuracy']:.0%}, overall {report['accuracy']:.0%}")
+
+    ToneClassifier.train(texts, outputs, args.features, args.threshold, epochs=args.epochs).save(args.output)
+    print(f"Saved {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,14 @@
+import threading
+from collections import OrderedDict
+
 from smolagents import Tool
 from langchain.prompts import PromptTemplate
 from langchain.chains import LLMChain
-from langchain_openai.llms import OpenAI
+
+from agent_tools.batching import batch_invoke, abatch_invoke
+from agent_tools.cache import tool_cache_key, cached_invoke, acached_invoke, cached_stream, acached_stream
+from agent_tools.llm import get_llm
+from agent_tools.near_duplicate import REWRITE_THRESHOLD, near_duplicate_chain
 
 
 class ToneRewriter(Tool):
@@ -20,72 +27,172 @@ class ToneRewriter(Tool):
 
     output_type = "string"
 
-    def __init__(self):
-        self.llm = OpenAI(temperature=0.2)
+    prompt_version = "2"
 
-    def forward(self, text: str, target_tone: str):
-        if target_tone:
-            rewrite_template = """
-            You are an expert Albanian language writer. Rewrite the following text to have a {target_tone} tone.
-            Maintain the original meaning but change the style, word choice, and sentence structure to match the target tone.
+    # Upper bound on the per-tone chains kept around; callers may send arbitrary tones
+    max_cached_tones = 64
+
+    def __init__(self, cache=None, llm=None, near_duplicate_cache=None, llm_timeout: float = None):
+        self.cache = cache
+        # Seconds one LLM request may take (None: the registry's OPENAI_TIMEOUT)
+        self.llm_timeout = llm_timeout
+        # Optional NearDuplicateCache. A rewrite quotes its text, so only nearly identical texts
+        # (same names, at most punctuation and case changed) share one.
+        self.near_duplicate_cache = near_duplicate_cache
+        self._llm = llm
+        self._options_chain = None
+        self._tone_chains = OrderedDict()
+        self._tone_chains_lock = threading.Lock()
 
-            Original text: {text}
+        rewrite_template = """
+        You are an expert Albanian language writer. Rewrite the following text to have a {target_tone} tone.
+        Maintain the original meaning but change the style, word choice, and sentence structure to match the target tone.
 
-            Provide your rewrite as plain text with the following sections:
+        Original text: {text}
 
-            ORIGINAL TONE:
-            [Identification of the original tone]
+        Provide your rewrite as plain text with the following sections:
 
-            TARGET TONE:
-            {target_tone}
+        ORIGINAL TONE:
+        [Identification of the original tone]
 
-            REWRITTEN TEXT:
-            [The text rewritten in the target tone]
-            
-            The text should be in albanian.
-            """
+        TARGET TONE:
+        {target_tone}
 
-            prompt = PromptTemplate(
-                input_variables=["text", "target_tone"],
-                template=rewrite_template
-            )
-            self.tone_writer_chain = prompt | self.llm
+        REWRITTEN TEXT:
+        [The text rewritten in the target tone]
+        
+        The text should be in albanian.
+        """
 
-            try:
-                result = self.tone_writer_chain.invoke({"text": text, "target_tone": target_tone})
-                return result
-            except Exception as e:
-                return {"error": str(e)}
-        else:
+        self.rewrite_prompt = PromptTemplate(
+            input_variables=["text", "target_tone"],
+            template=rewrite_template
+        )
 
-            options_template = """
-            You are an expert Albanian language writer. Provide three different tone variations of the following text.
-            Each variation should have a distinct tone while maintaining the original meaning.
+        options_template = """
+        You are an expert Albanian language writer. Provide three different tone variations of the following text.
+        Each variation should have a distinct tone while maintaining the original meaning.
 
-            Original text: {text}
+        Original text: {text}
 
-            Provide your tone variations as plain text with the following sections:
+        Provide your tone variations as plain text with the following sections:
 
-            ORIGINAL TONE:
-            [Identification of the original tone]
+        ORIGINAL TONE:
+        [Identification of the original tone]
 
-            FORMAL TONE VERSION:
-            [Text rewritten in formal tone]
+        FORMAL TONE VERSION:
+        [Text rewritten in formal tone]
 
-            FRIENDLY TONE VERSION:
-            [Text rewritten in friendly tone]
+        FRIENDLY TONE VERSION:
+        [Text rewritten in friendly tone]
 
-            PERSUASIVE TONE VERSION:
-            [Text rewritten in persuasive tone]
-            
-            The text should be in albanian.
-            """
+        PERSUASIVE TONE VERSION:
+        [Text rewritten in persuasive tone]
+        
+        The text should be in albanian.
+        """
 
-            prompt = PromptTemplate(input_variables=["text"], template=options_template)
-            self.tone_writer_chain = prompt | self.llm
+        self.options_prompt = PromptTemplate(input_variables=["text"], template=options_template)
 
-            try:
-                result = self.tone_writer_chain.invoke({"text": text})
-                return result
-            except Exception as e:
-                return {"error": str(e)}
+    @property
+    def llm(self):
+        if self._llm is None:
+            self._llm = get_llm(temperature=0.2, timeout=self.llm_timeout)
+        return self._llm
+
+    @llm.setter
+    def llm(self, llm):
+        self._llm = llm
+        self._options_chain = None
+        self._tone_chains.clear()
+
+    @property
+    def options_chain(self):
+        if self._options_chain is None:
+            self._options_chain = self._near_duplicate_chain(self.options_prompt | self.llm)
+        return self._options_chain
+
+    def forward(self, text: str, target_tone: str):
+        chain, inputs = self._build_chain(text, target_tone)
+        try:
+            result = cached_invoke(self.cache, tool_cache_key(self, text, target_tone), chain, inputs)
+            return result
+        except Exception as e:
+            return str({"error": str(e)})
+
+    async def aforward(self, text: str, target_tone: str):
+        chain, inputs = self._build_chain(text, target_tone)
+        try:
+            result = await acached_invoke(self.cache, tool_cache_key(self, text, target_tone), chain, inputs)
+            return result
+        except Exception as e:
+            return str({"error": str(e)})
+
+    def forward_stream(self, text: str, target_tone: str):
+        chain, inputs = self._build_chain(text, target_tone)
+        try:
+            yield from cached_stream(self.cache, tool_cache_key(self, text, target_tone), chain, inputs)
+        except Exception as e:
+            yield str({"error": str(e)})
+
+    async def aforward_stream(self, text: str, target_tone: str):
+        chain, inputs = self._build_chain(text, target_tone)
+        try:
+            async for chunk in acached_stream(self.cache, tool_cache_key(self, text, target_tone), chain, inputs):
+                yield chunk
+        except Exception as e:
+            yield str({"error": str(e)})
+
+    def forward_batch(self, texts: list, target_tones: list, max_concurrency: int = 4) -> list:
+        results = [None] * len(texts)
+        # Items sharing a target tone share a prompt, so each tone group is one batch
+        for target_tone, indices in self._group_by_tone(target_tones).items():
+            chain, _ = self._build_chain("", target_tone)
+            outputs = batch_invoke(chain, [{"text": texts[i]} for i in indices],
+                                   max_concurrency=max_concurrency, cache=self.cache,
+                                   keys=[tool_cache_key(self, texts[i], target_tone) for i in indices])
+            for i, output in zip(indices, outputs):
+                results[i] = str({"error": str(output)}) if isinstance(output, Exception) else output
+        return results
+
+    async def aforward_batch(self, texts: list, target_tones: list, max_concurrency: int = 4) -> list:
+        results = [None] * len(texts)
+        for target_tone, indices in self._group_by_tone(target_tones).items():
+            chain, _ = self._build_chain("", target_tone)
+            outputs = await abatch_invoke(chain, [{"text": texts[i]} for i in indices],
+                                          max_concurrency=max_concurrency, cache=self.cache,
+                                          keys=[tool_cache_key(self, texts[i], target_tone) for i in indices])
+            for i, output in zip(indices, outputs):
+                results[i] = str({"error": str(output)}) if isinstance(output, Exception) else output
+        return results
+
+    @staticmethod
+    def _group_by_tone(target_tones: list) -> dict:
+        groups = {}
+        for i, target_tone in enumerate(target_tones):
+            groups.setdefault(target_tone or "", []).append(i)
+        return groups
+
+    def _build_chain(self, text: str, target_tone: str):
+        """Return the rewrite chain for the requested mode together with its inputs."""
+        if target_tone:
+            return self._tone_chain(target_tone), {"text": text}
+        return self.options_chain, {"text": text}
+
+    def _tone_chain(self, target_tone: str):
+        """Chain with `target_tone` already filled into the rewrite prompt, built once per tone."""
+        with self._tone_chains_lock:
+            chain = self._tone_chains.get(target_tone)
+            if chain is None:
+                chain = self._near_duplicate_chain(self.rewrite_prompt.partial(target_tone=target_tone) | self.llm,
+                                                   target_tone)
+                self._tone_chains[target_tone] = chain
+                while len(self._tone_chains) > self.max_cached_tones:
+                    self._tone_chains.popitem(last=False)
+            else:
+                self._tone_chains.move_to_end(target_tone)
+        return chain
+
+    def _near_duplicate_chain(self, chain, target_tone: str = ""):
+        return near_duplicate_chain(chain, self.near_duplicate_cache, self, target_tone, mask_names=False,
+                                    threshold=REWRITE_THRESHOLD)
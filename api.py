@@ -0,0 +1,170 @@
+"""
+Headless HTTP API for the Albanian text analyzer.
+
+Runs separately from the Dash UI, under any ASGI server, e.g.
+
+    uvicorn api:app --workers 4
+
+Every worker process builds its own agent. Analyses run on the worker's event loop through the
+agent's async methods, so one worker serves many analyses while they wait on OpenAI. Each
+worker admits at most API_MAX_CONCURRENCY analyses at once and answers 429 (with Retry-After)
+beyond that, instead of queueing requests until they time out.
+
+Endpoints:
+    POST /analyze          {"text": ..., "target_tone": ..., "json_mode": false}
+    POST /analyze/batch    {"items": [{"text": ..., "target_tone": ...}, ...]}
+    POST /analyze/stream   {"text": ..., "target_tone": ...}; newline-delimited JSON {"section", "chunk"} events
+                           (JSON mode has no streamed form, so a "json_mode" field is rejected with 422)
+    GET  /health
+    GET  /metrics          per-tool latency, token, cache and retry metrics in the Prometheus text format
+"""
+import json
+import os
+from typing import List
+
+from dotenv import load_dotenv
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from pydantic import BaseModel, ConfigDict, Field
+
+from agent import AlbanianTextAgent
+from agent_tools.cache import InMemoryCache, SQLiteCache
+from agent_tools.metrics import get_metrics
+from agent_tools.near_duplicate import NearDuplicateCache
+from agent_tools.tone_classifier import ToneClassifier
+
+load_dotenv()
+
+MAX_TEXT_CHARS = int(os.getenv("API_MAX_TEXT_CHARS", 20000))
+MAX_BATCH_SIZE = int(os.getenv("API_MAX_BATCH_SIZE", 32))
+MAX_CONCURRENCY = int(os.getenv("API_MAX_CONCURRENCY", 16))
+BATCH_CONCURRENCY = int(os.getenv("API_BATCH_CONCURRENCY", 4))
+
+# Same cache configuration as the Dash app, so both can share an ANALYSIS_CACHE_PATH
+cache_path = os.getenv("ANALYSIS_CACHE_PATH")
+cache = SQLiteCache(cache_path) if cache_path else InMemoryCache()
+# TONE_CLASSIFIER_PATH points to a model from `python -m agent_tools.tone_classifier` that answers
+# confident tone analyses locally
+tone_classifier_path = os.getenv("TONE_CLASSIFIER_PATH")
+# NEAR_DUPLICATE_THRESHOLD (e.g. 0.9) lets the tone tools reuse results of near-identical texts
+near_duplicate_threshold = os.getenv("NEAR_DUPLICATE_THRESHOLD")
+near_duplicate_cache = NearDuplicateCache(float(near_duplicate_threshold)) if near_duplicate_threshold else None
+agent = AlbanianTextAgent(cache=cache, precheck=os.getenv("GRAMMAR_PRECHECK", "").lower() in ("1", "true", "yes"),
+                          tone_classifier=ToneClassifier.load(tone_classifier_path) if tone_classifier_path else None,
+                          near_duplicate_cache=near_duplicate_cache)
+
+app = FastAPI(title="Albanian Text Analyzer API")
+
+
+class AnalyzeRequest(BaseModel):
+    text: str = Field(min_length=1, max_length=MAX_TEXT_CHARS)
+    target_tone: str = Field(default="", max_length=50)
+    # Return the validated JSON-mode fields instead of the three text sections
+    json_mode: bool = False
+
+
+class StreamRequest(BaseModel):
+    # Unknown fields, in particular json_mode, are rejected rather than silently ignored
+    model_config = ConfigDict(extra="forbid")
+
+    text: str = Field(min_length=1, max_length=MAX_TEXT_CHARS)
+    target_tone: str = Field(default="", max_length=50)
+
+
+class BatchItem(BaseModel):
+    text: str = Field(min_length=1, max_length=MAX_TEXT_CHARS)
+    target_tone: str = Field(default="", max_length=50)
+
+
+class BatchRequest(BaseModel):
+    items: List[BatchItem] = Field(min_length=1, max_length=MAX_BATCH_SIZE)
+
+
+class ConcurrencyLimiter:
+    """Non-blocking admission control: a request either gets a slot right away or is rejected."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+        self.rejected = 0
+
+    def try_acquire(self) -> bool:
+        # Only touched from the event loop thread, so no lock is needed
+        if self.in_flight >= self.limit:
+            self.rejected += 1
+            return False
+        self.in_flight += 1
+        return True
+
+    def release(self):
+        self.in_flight -= 1
+
+
+limiter = ConcurrencyLimiter(MAX_CONCURRENCY)
+
+
+def too_many_requests() -> JSONResponse:
+    return JSONResponse(status_code=429, headers={"Retry-After": "1"},
+                        content={"error": f"{limiter.limit} analyses already in progress, retry shortly"})
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok", "in_flight": limiter.in_flight, "limit": limiter.limit, "rejected": limiter.rejected,
+            "coalescing": agent.coalescing_stats()}
+
+
+@app.get("/metrics")
+async def metrics():
+    gauges = {
+        "api_analyses_in_flight": ("Analyses being served.", limiter.in_flight),
+        "api_analyses_rejected": ("Analyses rejected because the worker was at its limit.", limiter.rejected),
+    }
+    return PlainTextResponse(get_metrics().render_prometheus(gauges), media_type="text/plain; version=0.0.4")
+
+
+@app.post("/analyze")
+async def analyze(request: AnalyzeRequest):
+    if not limiter.try_acquire():
+        return too_many_requests()
+    try:
+        if request.json_mode:
+            report = await agent.aforward_json(request.text, request.target_tone)
+            return report.model_dump()
+        result = await agent.aforward(request.text, request.target_tone, structured=True)
+        return result.to_dict()
+    except Exception as e:
+        return JSONResponse(status_code=502, content={"error": str(e)})
+    finally:
+        limiter.release()
+
+
+@app.post("/analyze/batch")
+async def analyze_batch(request: BatchRequest):
+    # A batch takes one slot; its texts share BATCH_CONCURRENCY calls per tool
+    if not limiter.try_acquire():
+        return too_many_requests()
+    try:
+        results = await agent.aforward_batch([item.text for item in request.items],
+                                             [item.target_tone for item in request.items],
+                                             max_concurrency=BATCH_CONCURRENCY, structured=True)
+        return {"results": [result.to_dict() for result in results]}
+    except Exception as e:
+        return JSONResponse(status_code=502, content={"error": str(e)})
+    finally:
+        limiter.release()
+
+
+@app.post("/analyze/stream")
+async def analyze_stream(request: StreamRequest):
+    if not limiter.try_acquire():
+        return too_many_requests()
+
+    async def events():
+        async for section, chunk in agent.aforward_stream(request.text, request.target_tone):
+            yield json.dumps({"section": section, "chunk": chunk}, ensure_ascii=False) + "\n"
+
+    # The slot is held until the stream ends or the client disconnects; the background task runs
+    # in both cases, even if the client goes away before the first event
+    return StreamingResponse(events(), media_type="application/x-ndjson", background=BackgroundTask(limiter.release))
@@ -0,0 +1,209 @@
+"""
+Deterministic stand-in for the OpenAI completions model, for offline benchmarks and tests.
+
+`FakeLLM` answers every tool prompt with a canned completion in that tool's output format
+(grammar, tone, rewrite or fused JSON). It waits for a latency drawn from a configurable
+distribution, plus an optional generation time per completion token, and fails a configurable
+share of calls with a 429 `openai.RateLimitError`.
+
+Latency and failures are drawn from a random generator seeded with the prompt and how often
+that prompt was sent before. A run therefore behaves the same way every time, whatever order
+the threads or tasks happen to make their calls in.
+
+Latency specs:
+    fixed:SECONDS
+    uniform:LOW,HIGH
+    normal:MEAN,STD            (negative draws are clipped to 0)
+    lognormal:MEDIAN,SIGMA
+    exponential:MEAN
+"""
+import asyncio
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from collections import Counter
+
+import httpx
+import openai
+from langchain_core.runnables import RunnableLambda
+
+from agent_tools.rate_limit import estimate_tokens, prompt_text
+
+TEXT = ("Pershendetje koleg! Desha të të informoj për vendimin e mbledhjes se sotme. "
+        "Kemi vendosur të vazhdojme me projektin e ri, por na duhen më shumë burime.")
+
+GRAMMAR_COMPLETION = """ORIGINAL TEXT:
+Pershendetje koleg! Desha të të informoj për vendimin e mbledhjes se sotme. Kemi vendosur të vazhdojme me projektin e ri, por na duhen më shumë burime.
+
+GRAMMATICAL ERRORS:
+1. Error: Pershendetje
+   Correction: Përshëndetje
+   Explanation: Mungojnë diakritikat ë.
+2. Error: se sotme
+   Correction: së sotme
+   Explanation: Nyja duhet të jetë "së".
+3. Error: vazhdojme
+   Correction: vazhdojmë
+   Explanation: Mungon diakritiku ë.
+
+CORRECTED TEXT:
+Përshëndetje koleg! Desha të të informoj për vendimin e mbledhjes së sotme. Kemi vendosur të vazhdojmë me projektin e ri, por na duhen më shumë burime."""
+
+TONE_COMPLETION = """TONE:
+Friendly
+
+FORMALITY LEVEL:
+3
+
+SENTIMENT:
+Neutral
+
+TONE ANALYSIS:
+Teksti është miqësor por profesional, me një përshëndetje të ngrohtë dhe informacion të qartë."""
+
+REWRITE_COMPLETION = """ORIGINAL TONE:
+Friendly
+
+FORMAL TONE VERSION:
+I nderuar koleg, dëshiroj t'ju informoj për vendimin e mbledhjes së sotme. Kemi vendosur të vazhdojmë me projektin e ri, por nevojiten më shumë burime.
+
+FRIENDLY TONE VERSION:
+Përshëndetje shok! Të tregoj shpejt çfarë vendosëm sot: vazhdojmë me projektin e ri, por na duhen pak më shumë burime.
+
+PERSUASIVE TONE VERSION:
+Koleg, vendimi i sotëm është i qartë: projekti i ri vazhdon! Për ta çuar në sukses, na duhen më shumë burime dhe mbështetja jote."""
+
+FUSED_COMPLETION = json.dumps({
+    "original_text": TEXT,
+    "grammatical_errors": [
+        {"error": "Pershendetje", "correction": "Përshëndetje", "explanation": "Mungojnë diakritikat ë."},
+        {"error": "se sotme", "correction": "së sotme", "explanation": "Nyja duhet të jetë \"së\"."},
+        {"error": "vazhdojme", "correction": "vazhdojmë", "explanation": "Mungon diakritiku ë."},
+    ],
+    "corrected_text": "Përshëndetje koleg! Desha të të informoj për vendimin e mbledhjes së sotme. "
+                      "Kemi vendosur të vazhdojmë me projektin e ri, por na duhen më shumë burime.",
+    "tone": "Friendly",
+    "formality_level": 3,
+    "sentiment": "Neutral",
+    "tone_analysis": "Teksti është miqësor por profesional, me një përshëndetje të ngrohtë dhe informacion të qartë.",
+    "original_tone": "Friendly",
+    "rewrites": {
+        "formal": "I nderuar koleg, dëshiroj t'ju informoj për vendimin e mbledhjes së sotme. "
+                  "Kemi vendosur të vazhdojmë me projektin e ri, por nevojiten më shumë burime.",
+        "friendly": "Përshëndetje shok! Të tregoj shpejt çfarë vendosëm sot: vazhdojmë me projektin e ri, "
+                    "por na duhen pak më shumë burime.",
+        "persuasive": "Koleg, vendimi i sotëm është i qartë: projekti i ri vazhdon! Për ta çuar në sukses, "
+                      "na duhen më shumë burime dhe mbështetja jote.",
+    },
+}, ensure_ascii=False)
+
+LATENCY_DISTRIBUTIONS = {
+    "fixed": lambda rng, seconds: seconds,
+    "uniform": lambda rng, low, high: rng.uniform(low, high),
+    "normal": lambda rng, mean, std: max(0.0, rng.gauss(mean, std)),
+    "lognormal": lambda rng, median, sigma: rng.lognormvariate(math.log(median), sigma),
+    "exponential": lambda rng, mean: rng.expovariate(1 / mean),
+}
+
+
+def parse_latency(spec: str):
+    """
+    Turn a latency spec such as "lognormal:0.4,0.5" into a function drawing from that distribution.
+
+    Raises:
+        ValueError: If the distribution is unknown or its parameters are not numbers
+    """
+    kind, _, params = spec.partition(":")
+    if kind not in LATENCY_DISTRIBUTIONS:
+        raise ValueError(f"Unknown latency distribution {kind!r}, expected one of {', '.join(LATENCY_DISTRIBUTIONS)}")
+    values = [float(value) for value in params.split(",")] if params else []
+    draw = LATENCY_DISTRIBUTIONS[kind]
+    draw(random.Random(0), *values)  # fail now on a wrong number of parameters
+    return lambda rng: draw(rng, *values)
+
+
+def canned_completion(prompt: str) -> str:
+    """The canned completion in the output format the prompt asks for."""
+    if "single JSON object" in prompt:
+        return FUSED_COMPLETION
+    if "GRAMMATICAL ERRORS" in prompt:
+        return GRAMMAR_COMPLETION
+    if "FORMALITY LEVEL" in prompt:
+        return TONE_COMPLETION
+    return REWRITE_COMPLETION
+
+
+def rate_limit_error() -> openai.RateLimitError:
+    response = httpx.Response(429, request=httpx.Request("POST", "https://api.openai.com/v1/completions"))
+    return openai.RateLimitError("Rate limit reached (simulated)", response=response, body=None)
+
+
+class FakeLLM:
+    """
+    Fake completions model with canned answers, simulated latency and simulated 429s.
+
+    Args:
+        latency: Latency spec (see the module docstring)
+        error_rate: Share of calls, from 0 to 1, that fail with a 429
+        seed: Seed mixed into every draw; runs with the same seed behave the same
+        per_token_ms: Generation time added per (estimated) completion token, so longer
+            completions take longer
+    """
+
+    def __init__(self, latency: str = "fixed:0.3", error_rate: float = 0.0, seed: int = 0,
+                 per_token_ms: float = 0.0):
+        self.latency_spec = latency
+        self._draw_latency = parse_latency(latency)
+        self.per_token_ms = per_token_ms
+        self.error_rate = error_rate
+        self.seed = seed
+
+        self.calls = 0
+        self.errors = 0
+        self.simulated_seconds = 0.0
+        self._sent = Counter()
+        self._lock = threading.Lock()
+
+    def plan(self, prompt: str):
+        """Completion, latency and whether to fail for the next call with this prompt."""
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        with self._lock:
+            attempt = self._sent[digest]
+            self._sent[digest] += 1
+        rng = random.Random(f"{self.seed}:{digest}:{attempt}")
+        completion = canned_completion(prompt)
+        latency = self._draw_latency(rng) + estimate_tokens(completion) * self.per_token_ms / 1000
+        fail = rng.random() < self.error_rate
+
+        with self._lock:
+            self.calls += 1
+            self.errors += fail
+            self.simulated_seconds += latency
+        return completion, latency, fail
+
+    def invoke(self, prompt_value) -> str:
+        completion, latency, fail = self.plan(prompt_text(prompt_value))
+        time.sleep(latency)
+        if fail:
+            raise rate_limit_error()
+        return completion
+
+    async def ainvoke(self, prompt_value) -> str:
+        completion, latency, fail = self.plan(prompt_text(prompt_value))
+        await asyncio.sleep(latency)
+        if fail:
+            raise rate_limit_error()
+        return completion
+
+    def as_runnable(self) -> RunnableLambda:
+        """The fake as a runnable that can replace a tool's `llm`."""
+        return RunnableLambda(self.invoke, afunc=self.ainvoke, name="FakeLLM")
+
+    def reset(self):
+        with self._lock:
+            self.calls = self.errors = 0
+            self.simulated_seconds = 0.0
+            self._sent.clear()
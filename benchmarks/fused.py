@@ -0,0 +1,99 @@
+"""
+Benchmark of the fused single-completion mode against the separate tool calls.
+
+Every LLM is replaced by the deterministic `FakeLLM` from `benchmarks.fake_llm`, which answers
+each prompt with a canned completion in the right format after a drawn latency plus a
+per-token generation time for the completion. Prompt and completion tokens are counted with
+tiktoken when its encoding is available locally, otherwise estimated at four characters per token.
+
+Usage:
+    python -m benchmarks.fused [--runs N] [--latency SPEC] [--per-token-ms MS]
+"""
+import argparse
+import threading
+import time
+
+from langchain_core.runnables import RunnableLambda
+
+from agent import AlbanianTextAgent
+from agent_tools.rate_limit import prompt_text
+from benchmarks.fake_llm import TEXT, FakeLLM
+
+
+def token_counter():
+    try:
+        import tiktoken
+
+        encoding = tiktoken.get_encoding("cl100k_base")
+        return lambda text: len(encoding.encode(text)), "tiktoken cl100k_base"
+    except Exception:
+        return lambda text: max(1, len(text) // 4), "estimated, 4 characters per token"
+
+
+class TokenTally:
+    """Counts the prompt and completion tokens of the calls made through `wrap`."""
+
+    def __init__(self, count_tokens):
+        self.count_tokens = count_tokens
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self._lock = threading.Lock()
+
+    def wrap(self, fake_llm: FakeLLM) -> RunnableLambda:
+        """`fake_llm` as a runnable whose calls are counted here."""
+        def invoke(prompt_value):
+            completion = fake_llm.invoke(prompt_value)
+            prompt_tokens = self.count_tokens(prompt_text(prompt_value))
+            completion_tokens = self.count_tokens(completion)
+            with self._lock:
+                self.prompt_tokens += prompt_tokens
+                self.completion_tokens += completion_tokens
+            return completion
+
+        return RunnableLambda(invoke, name="FakeLLM")
+
+    def reset(self):
+        self.prompt_tokens = self.completion_tokens = 0
+
+
+def run(agent, fake_llm, tally, runs):
+    fake_llm.reset()
+    tally.reset()
+    start = time.perf_counter()
+    for _ in range(runs):
+        agent.forward(TEXT)
+    elapsed = (time.perf_counter() - start) / runs
+    return fake_llm.calls / runs, tally.prompt_tokens / runs, tally.completion_tokens / runs, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--latency", default="fixed:0.3", help="latency spec of one fake LLM call")
+    parser.add_argument("--per-token-ms", type=float, default=10.0, help="generation time per completion token")
+    args = parser.parse_args()
+
+    count_tokens, counter_name = token_counter()
+    fake_llm = FakeLLM(latency=args.latency, per_token_ms=args.per_token_ms)
+    tally = TokenTally(count_tokens)
+    llm = tally.wrap(fake_llm)
+
+    modes = [
+        ("separate, sequential", AlbanianTextAgent(concurrent=False)),
+        ("separate, concurrent", AlbanianTextAgent(concurrent=True)),
+        ("fused", AlbanianTextAgent(fused=True)),
+    ]
+
+    print(f"Token counts: {counter_name}")
+    print(f"{'mode':<24}{'calls':>7}{'prompt tok':>12}{'completion tok':>16}{'latency s':>11}")
+    for name, agent in modes:
+        # Whole texts, so each separate tool makes exactly one call
+        agent.grammar_checker.max_chunk_tokens = 0
+        for tool in [agent.grammar_checker, agent.tone_analyzer, agent.tone_rewriter, agent.fused_analyzer]:
+            tool.llm = llm
+        calls, prompt_tokens, completion_tokens, latency = run(agent, fake_llm, tally, args.runs)
+        print(f"{name:<24}{calls:>7.0f}{prompt_tokens:>12.0f}{completion_tokens:>16.0f}{latency:>11.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""
+Offline benchmark of the agent pipeline in its sequential, concurrent, batch and cached modes.
+
+Every tool's LLM is replaced by the deterministic `FakeLLM` from `benchmarks.fake_llm`, behind
+the same client-side rate limiter production calls go through. Nothing touches the network, and
+the numbers measure our own overhead on top of the simulated model: thread fan-out, caching,
+retries and parsing.
+
+Modes:
+    sequential  one client, the three tools one after another (AlbanianTextAgent(concurrent=False))
+    concurrent  --clients threads sending requests, the three tools side by side
+    batch       --batch-size texts per forward_batch call; an item's latency is its batch's latency
+    cached      the concurrent workload again, after a first pass has filled the response cache;
+                only the second pass is measured
+
+For each mode the report shows throughput, p50/p95/p99 latency per analysis, analyses with an
+error section, LLM calls retried by the rate limiter, peak traced memory (tracemalloc, which
+slows everything down a little; pass --no-memory for cleaner timings) and the time needed to
+parse the three sections of one result.
+
+Usage:
+    python -m benchmarks.pipeline [--requests N] [--latency SPEC] [--error-rate P] [--clients N]
+                                  [--batch-size N] [--seed N] [--modes sequential,concurrent,...]
+"""
+import argparse
+import time
+import timeit
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from agent import AlbanianTextAgent, is_error_result
+from agent_tools.cache import InMemoryCache
+from agent_tools.grammar_checker import parse_grammar_output
+from agent_tools.rate_limit import AdaptiveConcurrency, RateLimiter, RateLimitedLLM
+from agent_tools.sections import parse_sections
+from benchmarks.fake_llm import TEXT, FakeLLM
+
+MODES = ["sequential", "concurrent", "batch", "cached"]
+
+
+def make_texts(count: int) -> list:
+    """Distinct inputs, so only the cached mode gets cache hits."""
+    return [f"{TEXT} ({number})" for number in range(count)]
+
+
+def make_agent(fake_llm: FakeLLM, limiter: RateLimiter, concurrent: bool = True, cache=None) -> AlbanianTextAgent:
+    agent = AlbanianTextAgent(concurrent=concurrent, cache=cache)
+    # Whole texts, so every mode makes exactly one call per tool and text
+    agent.grammar_checker.max_chunk_tokens = 0
+    llm = RateLimitedLLM(fake_llm.as_runnable(), limiter)
+    for tool in [agent.grammar_checker, agent.tone_analyzer, agent.tone_rewriter]:
+        tool.llm = llm
+    return agent
+
+
+def timed_forward(agent, text):
+    start = time.perf_counter()
+    result = agent.forward(text, structured=True)
+    return result, time.perf_counter() - start
+
+
+def run_sequential(agent, texts, args):
+    return [timed_forward(agent, text) for text in texts]
+
+
+def run_concurrent(agent, texts, args):
+    with ThreadPoolExecutor(max_workers=args.clients) as clients:
+        return list(clients.map(lambda text: timed_forward(agent, text), texts))
+
+
+def run_batch(agent, texts, args):
+    timed = []
+    for offset in range(0, len(texts), args.batch_size):
+        batch = texts[offset:offset + args.batch_size]
+        start = time.perf_counter()
+        results = agent.forward_batch(batch, max_concurrency=args.batch_size, structured=True)
+        elapsed = time.perf_counter() - start
+        timed.extend((result, elapsed) for result in results)
+    return timed
+
+
+def parse_result(result):
+    return (parse_grammar_output(result.grammar_analysis), parse_sections(result.tone_analysis),
+            parse_sections(result.tone_alternatives))
+
+
+def parse_cost_us(results: list, repeat: int = 20) -> float:
+    """Mean microseconds to parse the three sections of one result."""
+    if not results:
+        return 0.0
+    seconds = timeit.timeit(lambda: [parse_result(result) for result in results], number=repeat)
+    return seconds / (repeat * len(results)) * 1e6
+
+
+def percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def run_mode(mode: str, args) -> dict:
+    fake_llm = FakeLLM(latency=args.latency, error_rate=args.error_rate, seed=args.seed)
+    limiter = RateLimiter(concurrency=AdaptiveConcurrency(initial=args.max_llm_concurrency,
+                                                          max_limit=args.max_llm_concurrency),
+                          max_retries=args.max_retries, base_delay=args.retry_delay)
+    texts = make_texts(args.requests)
+
+    if mode == "cached":
+        agent = make_agent(fake_llm, limiter, cache=InMemoryCache(max_size=args.requests * 3))
+        run_concurrent(agent, texts, args)
+    else:
+        agent = make_agent(fake_llm, limiter, concurrent=(mode != "sequential"))
+    run = {"sequential": run_sequential, "concurrent": run_concurrent, "batch": run_batch,
+           "cached": run_concurrent}[mode]
+
+    retries_before = limiter.stats()["retries"]
+    if args.memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    timed = run(agent, texts, args)
+    elapsed = time.perf_counter() - start
+    peak_memory = tracemalloc.get_traced_memory()[1] if args.memory else None
+    if args.memory:
+        tracemalloc.stop()
+    agent._executor.shutdown(wait=False)
+
+    results = [result for result, _ in timed]
+    latencies = [latency for _, latency in timed]
+    return {
+        "mode": mode,
+        "requests": len(results),
+        "errors": sum(any(is_error_result(section) for section in (result.grammar_analysis, result.tone_analysis,
+                                                                   result.tone_alternatives))
+                      for result in results),
+        "retries": limiter.stats()["retries"] - retries_before,
+        "throughput": len(results) / elapsed,
+        "p50": percentile(latencies, 0.50),
+        "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99),
+        "peak_mib": peak_memory / 2 ** 20 if peak_memory is not None else None,
+        "parse_us": parse_cost_us(results),
+    }
+
+
+def format_row(row: dict) -> str:
+    memory = f"{row['peak_mib']:>10.2f}" if row["peak_mib"] is not None else f"{'-':>10}"
+    return (f"{row['mode']:<12}{row['requests']:>6}{row['errors']:>8}{row['retries']:>9}"
+            f"{row['throughput']:>10.1f}{row['p50'] * 1000:>10.1f}{row['p95'] * 1000:>10.1f}"
+            f"{row['p99'] * 1000:>10.1f}{memory}{row['parse_us']:>11.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=40, help="analyses per mode")
+    parser.add_argument("--latency", default="lognormal:0.3,0.4", help="latency spec of one fake LLM call")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of fake LLM calls answering 429")
+    parser.add_argument("--clients", type=int, default=8, help="client threads in the concurrent and cached modes")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--max-llm-concurrency", type=int, default=20, help="adaptive concurrency ceiling")
+    parser.add_argument("--max-retries", type=int, default=4)
+    parser.add_argument("--retry-delay", type=float, default=0.05, help="base backoff delay in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--modes", default=",".join(MODES), help="comma-separated subset of " + ", ".join(MODES))
+    parser.add_argument("--no-memory", dest="memory", action="store_false", help="skip tracemalloc")
+    args = parser.parse_args()
+
+    modes = [mode.strip() for mode in args.modes.split(",") if mode.strip()]
+    unknown = set(modes) - set(MODES)
+    if unknown:
+        parser.error(f"unknown modes: {', '.join(sorted(unknown))}")
+
+    print(f"Fake LLM latency {args.latency}, error rate {args.error_rate:.0%}, seed {args.seed}")
+    print(f"{'mode':<12}{'req':>6}{'errors':>8}{'retries':>9}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}"
+          f"{'p99 ms':>10}{'peak MiB':>10}{'parse us':>11}")
+    for mode in modes:
+        print(format_row(run_mode(mode, args)), flush=True)
+
+
+if __name__ == "__main__":
+    main()
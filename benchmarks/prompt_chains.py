@@ -0,0 +1,60 @@
+"""
+Micro-benchmark for ToneRewriter's prompt chains.
+
+Compares the old hot path, which built a new PromptTemplate and `prompt | llm` runnable on
+every call, with the chains ToneRewriter now builds once and reuses. A fake LLM is used so
+only the per-call overhead is measured.
+
+Usage:
+    python -m benchmarks.prompt_chains [--calls N]
+"""
+import argparse
+import timeit
+
+from langchain.prompts import PromptTemplate
+from langchain_core.language_models import FakeListLLM
+
+from agent_tools.tone_writer import ToneRewriter
+
+
+def rebuild_per_call(rewriter, text, target_tone):
+    """What ToneRewriter.forward used to do before the chains were precompiled."""
+    if target_tone:
+        prompt = PromptTemplate(input_variables=["text", "target_tone"],
+                                template=rewriter.rewrite_prompt.template)
+        return prompt | rewriter.llm, {"text": text, "target_tone": target_tone}
+
+    prompt = PromptTemplate(input_variables=["text"], template=rewriter.options_prompt.template)
+    return prompt | rewriter.llm, {"text": text}
+
+
+def precompiled(rewriter, text, target_tone):
+    return rewriter._build_chain(text, target_tone)
+
+
+def _invoke(chain, inputs):
+    return chain.invoke(inputs)
+
+
+def time_per_call(func, calls):
+    return timeit.timeit(func, number=calls) / calls * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=2000)
+    args = parser.parse_args()
+
+    rewriter = ToneRewriter(llm=FakeListLLM(responses=["REWRITTEN TEXT:\nTekst i rishkruar."]))
+    text = "Projekti do të fillojë më datë 10 Maj."
+
+    print(f"{'mode':<14}{'path':<20}{'build us/call':>15}{'build+invoke us/call':>22}")
+    for mode, target_tone in [("options", ""), ("target tone", "formal")]:
+        for name, path in [("rebuild per call", rebuild_per_call), ("precompiled", precompiled)]:
+            build = time_per_call(lambda: path(rewriter, text, target_tone), args.calls)
+            total = time_per_call(lambda: _invoke(*path(rewriter, text, target_tone)), args.calls)
+            print(f"{mode:<14}{name:<20}{build:>15.1f}{total:>22.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Small in-process job queue for analyses that outlive a web request.
+
+A request submits a job and gets its id back immediately; a fixed pool of worker threads
+runs the jobs in submission order, so slow LLM calls tie up these workers instead of the
+web server's. The job function receives its `Job` and publishes partial results and
+progress on it; pollers read them with `JobQueue.get`. Cancelling a queued job removes it
+from the queue; cancelling a running job sets `job.cancelled`, which the job function checks
+between steps.
+"""
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class QueueFull(Exception):
+    """Raised by `JobQueue.submit` when every worker is busy and `max_pending` jobs are waiting."""
+
+
+@dataclass
+class Job:
+    """State of one submitted job. Hold `lock` while reading or writing `data`."""
+
+    id: str
+    status: str = QUEUED
+    # Fraction of the work done, from 0 to 1, set by the job function
+    progress: float = 0.0
+    # Partial and final results, written by the job function
+    data: dict = field(default_factory=dict)
+    error: str = None
+    submitted_at: float = field(default_factory=time.monotonic)
+    finished_at: float = None
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+    _cancel: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED
+
+
+class JobQueue:
+    """Runs submitted jobs on `max_workers` threads, with at most `max_pending` jobs waiting."""
+
+    def __init__(self, max_workers: int = 4, max_pending: int = 100, retention: float = 600):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        # Finished jobs are kept this many seconds for late polls, then dropped
+        self.retention = retention
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="analysis-job")
+        self._jobs = {}
+        self._futures = {}
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, data: dict = None, **kwargs) -> Job:
+        """
+        Queue `fn(job, *args, **kwargs)`.
+
+        Args:
+            fn: The job function; its return value is ignored and an exception marks the job failed
+            data: Initial `job.data`, so pollers see a complete structure before the job starts
+
+        Returns:
+            The queued Job
+
+        Raises:
+            QueueFull: If every worker is busy and `max_pending` jobs are already waiting
+        """
+        with self._lock:
+            self._prune()
+            # Jobs handed to an idle worker count as pending until its thread picks them up, so
+            # bound everything unfinished rather than the pending list alone
+            if len(self._futures) >= self.max_workers + self.max_pending:
+                raise QueueFull(f"{len(self._futures)} analyses are already queued or running")
+
+            job = Job(id=uuid.uuid4().hex, data=data or {})
+            self._jobs[job.id] = job
+            self._pending.append(job.id)
+            self._futures[job.id] = self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def get(self, job_id: str) -> Job:
+        """The job with this id, or None if it is unknown or was dropped after `retention`."""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def position(self, job_id: str) -> int:
+        """Number of jobs ahead of this one in the queue (0 once it has started)."""
+        with self._lock:
+            return self._pending.index(job_id) if job_id in self._pending else 0
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a job; returns False if it is unknown or already finished."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.finished:
+                return False
+            job._cancel.set()
+
+            # A job that has not started yet never will
+            if self._futures[job_id].cancel():
+                self._pending.remove(job_id)
+                self._finish(job, CANCELLED)
+        return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = {status: 0 for status in (QUEUED, RUNNING) + FINISHED}
+            for job in self._jobs.values():
+                counts[job.status] += 1
+            return counts
+
+    def shutdown(self, wait: bool = True):
+        """Stop the workers; with `wait`, queued jobs still run first, otherwise they are cancelled."""
+        if not wait:
+            with self._lock:
+                for job_id in list(self._pending):
+                    job = self._jobs[job_id]
+                    job._cancel.set()
+                    if self._futures[job_id].cancel():
+                        self._pending.remove(job_id)
+                        self._finish(job, CANCELLED)
+        self._executor.shutdown(wait=wait)
+
+    def _run(self, job: Job, fn, args: tuple, kwargs: dict):
+        with self._lock:
+            self._pending.remove(job.id)
+            if job.cancelled:
+                self._finish(job, CANCELLED)
+                return
+            job.status = RUNNING
+
+        try:
+            fn(job, *args, **kwargs)
+            status, error = (CANCELLED if job.cancelled else DONE), None
+        except Exception as e:
+            status, error = FAILED, str(e)
+
+        with self._lock:
+            job.error = error
+            self._finish(job, status)
+
+    def _finish(self, job: Job, status: str):
+        job.status = status
+        job.finished_at = time.monotonic()
+        self._futures.pop(job.id, None)
+
+    def _prune(self):
+        now = time.monotonic()
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished and now - job.finished_at > self.retention]
+        for job_id in expired:
+            del self._jobs[job_id]
@@ -1,21 +1,65 @@
 from dotenv import load_dotenv
-import json
+import logging
+import os
+import uuid
 import dash
 from dash import dcc, html, callback, Input, Output, State
 import plotly.graph_objs as go
 from dash.exceptions import PreventUpdate
+from flask import Response
 import re
 
 from agent import AlbanianTextAgent
+from agent_tools.cache import InMemoryCache, SQLiteCache
+from agent_tools.grammar_checker import parse_grammar_errors
+from agent_tools.llm import get_registry
+from agent_tools.metrics import get_metrics
+from agent_tools.near_duplicate import NearDuplicateCache
+from agent_tools.sections import parse_sections, section_text
+from agent_tools.tone_classifier import ToneClassifier
+from job_queue import JobQueue, QueueFull, QUEUED, RUNNING, CANCELLED, FAILED
 
 load_dotenv()
-# Initialize the agent
-agent = AlbanianTextAgent()
+# Every tool call is logged as one JSON line on the agent_tools.metrics logger
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), format="%(asctime)s %(name)s %(levelname)s %(message)s")
+logger = logging.getLogger(__name__)
+
+# Initialize the agent. Set ANALYSIS_CACHE_PATH to keep cached completions across restarts.
+cache_path = os.getenv("ANALYSIS_CACHE_PATH")
+cache = SQLiteCache(cache_path) if cache_path else InMemoryCache()
+# GRAMMAR_PRECHECK=1 fixes missing diacritics and spacing locally before calling the LLM
+# TONE_CLASSIFIER_PATH points to a model from `python -m agent_tools.tone_classifier` that answers
+# confident tone analyses locally
+tone_classifier_path = os.getenv("TONE_CLASSIFIER_PATH")
+# NEAR_DUPLICATE_THRESHOLD (e.g. 0.9) lets the tone tools reuse results of near-identical texts
+near_duplicate_threshold = os.getenv("NEAR_DUPLICATE_THRESHOLD")
+near_duplicate_cache = NearDuplicateCache(float(near_duplicate_threshold)) if near_duplicate_threshold else None
+agent = AlbanianTextAgent(cache=cache, precheck=os.getenv("GRAMMAR_PRECHECK", "").lower() in ("1", "true", "yes"),
+                          tone_classifier=ToneClassifier.load(tone_classifier_path) if tone_classifier_path else None,
+                          near_duplicate_cache=near_duplicate_cache)
+
+# Analyses run as background jobs so Dash requests return immediately. ANALYSIS_WORKERS bounds the
+# analyses running at once and ANALYSIS_MAX_PENDING the ones waiting for a worker.
+jobs = JobQueue(max_workers=int(os.getenv("ANALYSIS_WORKERS", 4)),
+                max_pending=int(os.getenv("ANALYSIS_MAX_PENDING", 100)))
 
 # Initialize the Dash app
 app = dash.Dash(__name__, title="Albanian Text Analyzer")
 server = app.server
 
+
+@server.route("/metrics")
+def metrics():
+    """Per-tool latency, token, cache and retry metrics in the Prometheus text format."""
+    gauges = {f"analysis_jobs_{status}": (f"Analysis jobs that are {status}.", count)
+              for status, count in jobs.stats().items()}
+    rate_limiter = get_registry().rate_limiter.stats()
+    gauges["openai_concurrency_limit"] = ("Current adaptive limit on concurrent OpenAI calls.",
+                                          rate_limiter["concurrency_limit"])
+    gauges["openai_in_flight"] = ("OpenAI calls in flight.", rate_limiter["in_flight"])
+    return Response(get_metrics().render_prometheus(gauges), mimetype="text/plain; version=0.0.4")
+
+
 # Define color scheme
 colors = {
     'background': '#F9F9F9',
@@ -29,6 +73,9 @@ colors = {
     'neutral': '#9E9E9E'
 }
 
+# Raw text shown in each tab while a tool is still streaming
+stream_preview_style = {'whiteSpace': 'pre-wrap', 'color': colors['neutral'], 'fontFamily': 'Arial', 'margin': '0'}
+
 # Define the app layout
 app.layout = html.Div(style={'backgroundColor': colors['background'], 'padding': '20px', 'fontFamily': 'Arial'},
                       children=[
@@ -77,6 +124,22 @@ app.layout = html.Div(style={'backgroundColor': colors['background'], 'padding':
                                   )
                               ], style={'width': '50%'}),
 
+                              dcc.Checklist(
+                                  id='incremental-toggle',
+                                  options=[{'label': ' Only re-check sentences edited since the last analysis',
+                                            'value': 'incremental'}],
+                                  value=[],
+                                  style={'fontSize': '14px', 'color': colors['text'], 'marginBottom': '5px'}
+                              ),
+
+                              dcc.Checklist(
+                                  id='json-mode-toggle',
+                                  options=[{'label': ' JSON mode: one structured completion for all three tabs',
+                                            'value': 'json'}],
+                                  value=[],
+                                  style={'fontSize': '14px', 'color': colors['text'], 'marginBottom': '20px'}
+                              ),
+
                               html.Button(
                                   'Analyze Text',
                                   id='analyze-button',
@@ -93,6 +156,26 @@ app.layout = html.Div(style={'backgroundColor': colors['background'], 'padding':
                                   }
                               ),
 
+                              html.Button(
+                                  'Cancel',
+                                  id='cancel-button',
+                                  n_clicks=0,
+                                  style={
+                                      'backgroundColor': 'white',
+                                      'color': colors['primary'],
+                                      'border': f"1px solid {colors['primary']}",
+                                      'padding': '10px 20px',
+                                      'fontSize': '16px',
+                                      'borderRadius': '5px',
+                                      'cursor': 'pointer',
+                                      'marginBottom': '30px',
+                                      'marginLeft': '10px'
+                                  }
+                              ),
+
+                              # Queue position, progress or cancellation of the current analysis
+                              html.Div(id='job-status', style={'color': colors['neutral'], 'marginBottom': '20px'}),
+
                               # Loading spinner
                               dcc.Loading(
                                   id="loading",
@@ -111,39 +194,51 @@ app.layout = html.Div(style={'backgroundColor': colors['background'], 'padding':
                                        # Tab layout for different analysis results
                                        dcc.Tabs(id='analysis-tabs', value='grammar-tab', children=[
                                            dcc.Tab(label='Grammar Analysis', value='grammar-tab', children=[
+                                               html.Pre(id='grammar-stream', style=stream_preview_style),
                                                html.Div(id='grammar-results', className='tab-content')
                                            ], style={'padding': '20px'}),
 
                                            dcc.Tab(label='Tone Analysis', value='tone-tab', children=[
+                                               html.Pre(id='tone-stream', style=stream_preview_style),
                                                html.Div(id='tone-results', className='tab-content'),
                                                html.Div(id='tone-chart-container',
                                                         style={'height': '400px', 'marginTop': '20px'})
                                            ], style={'padding': '20px'}),
 
                                            dcc.Tab(label='Tone Alternatives', value='alternatives-tab', children=[
+                                               html.Pre(id='alternatives-stream', style=stream_preview_style),
                                                html.Div(id='alternatives-results', className='tab-content')
                                            ], style={'padding': '20px'})
                                        ], style={'marginTop': '20px'})
                                    ]),
 
-                          # Store the analysis results in a hidden div
-                          html.Div(id='analysis-results-store', style={'display': 'none'})
+                          # Id of the streaming run and the timer that polls its progress
+                          dcc.Store(id='stream-run-id'),
+                          # Identifies this browser tab's previous submission for incremental re-analysis
+                          dcc.Store(id='session-id', storage_type='session'),
+                          dcc.Interval(id='stream-interval', interval=500, disabled=True)
                       ])
 
 
-# Callback to process the text and update results
+# Callback to start the analysis; the tools stream into the tabs while it runs
 @app.callback(
     [
-        Output('analysis-results-store', 'children'),
-        Output('results-container', 'style')
+        Output('stream-run-id', 'data'),
+        Output('stream-interval', 'disabled'),
+        Output('results-container', 'style'),
+        Output('session-id', 'data'),
+        Output('job-status', 'children')
     ],
     [Input('analyze-button', 'n_clicks')],
     [
         State('text-input', 'value'),
-        State('tone-dropdown', 'value')
+        State('tone-dropdown', 'value'),
+        State('incremental-toggle', 'value'),
+        State('json-mode-toggle', 'value'),
+        State('session-id', 'data')
     ]
 )
-def analyze_text(n_clicks, input_text, target_tone):
+def analyze_text(n_clicks, input_text, target_tone, incremental, json_mode, session_id):
     if n_clicks == 0 or not input_text:
         raise PreventUpdate
 
@@ -151,112 +246,144 @@ def analyze_text(n_clicks, input_text, target_tone):
     if target_tone == 'none':
         target_tone = None
 
-    try:
-        # Run the analysis
-        result = agent.forward(input_text, target_tone)
-
-        # Store the results for each analysis type
-        # Since we're getting plain text from each tool, we need to separate them
-        results_dict = {}
+    session_id = session_id or uuid.uuid4().hex
+    incremental_session = session_id if incremental else None
 
-        if isinstance(result, dict):
-            # If result is already a dictionary, use it directly
-            results_dict = result
-        else:
-            # Try to parse the complete output to separate the different analyses
-            # First, try to split by double newlines or section headers
-            grammar_analysis = ""
-            tone_analysis = ""
-            tone_alternatives = ""
-
-            # Check for grammar text section
-            if "ORIGINAL TEXT:" in result or "GRAMMATICAL ERRORS:" in result or "CORRECTED TEXT:" in result:
-                # Extract everything from the beginning until we find tone indicators
-                end_markers = ["TONE:", "FORMALITY LEVEL:", "SENTIMENT:", "ORIGINAL TONE:"]
-                end_pos = float('inf')
-                for marker in end_markers:
-                    pos = result.find(marker)
-                    if pos != -1 and pos < end_pos:
-                        end_pos = pos
-
-                if end_pos < float('inf'):
-                    grammar_analysis = result[:end_pos].strip()
+    try:
+        job = jobs.submit(run_streaming_analysis, input_text, target_tone, incremental_session, bool(json_mode),
+                          data={
+                              'sections': {'grammar_analysis': '', 'tone_analysis': '', 'tone_alternatives': ''},
+                              'report': None,
+                              'target_tone': target_tone,
+                              'shown': {}
+                          })
+    except QueueFull:
+        return (dash.no_update, True, dash.no_update, session_id,
+                "The analyzer is busy right now, please try again in a moment.")
+
+    # Show the results container
+    return job.id, False, {'width': '80%', 'margin': 'auto', 'marginTop': '20px', 'display': 'block',
+                           'backgroundColor': 'white', 'padding': '20px', 'borderRadius': '10px',
+                           'boxShadow': '0px 2px 5px rgba(0,0,0,0.1)'}, session_id, "Waiting for a free worker..."
+
+
+def run_streaming_analysis(job, input_text, target_tone, incremental_session=None, json_mode=False):
+    """Job function: publish the streamed tool output on `job` so the polling callback can display it."""
+    if json_mode:
+        # The tabs read the validated fields directly; stream the tools instead if that fails
+        try:
+            report = agent.forward_json(input_text, target_tone)
+            with job.lock:
+                job.data['report'] = report.model_dump()
+                job.progress = 1.0
+            return
+        except Exception:
+            logger.warning("JSON mode failed, falling back to the separate tools", exc_info=True)
+
+    if incremental_session:
+        # Incremental runs mostly reuse earlier results, so they are not streamed
+        result = agent.forward_incremental(input_text, target_tone, session_id=incremental_session,
+                                           structured=True)
+        with job.lock:
+            job.data['sections'].update(result.to_dict())
+            job.progress = 1.0
+        return
+
+    stream = agent.forward_stream(input_text, target_tone)
+    try:
+        for section, chunk in stream:
+            if job.cancelled:
+                # Calls already sent finish in the background and still fill the response cache
+                return
+            with job.lock:
+                if chunk:
+                    job.data['sections'][section] += chunk
                 else:
-                    # If no tone sections found, take everything
-                    grammar_analysis = result.strip()
-
-            # Check for tone analysis section
-            tone_indicators = ["TONE:", "FORMALITY LEVEL:", "SENTIMENT:", "TONE ANALYSIS:"]
-            has_tone_indicators = any(indicator in result for indicator in tone_indicators)
-
-            if has_tone_indicators:
-                # Find the first tone indicator
-                start_pos = float('inf')
-                for indicator in tone_indicators:
-                    pos = result.find(indicator)
-                    if pos != -1 and pos < start_pos:
-                        start_pos = pos
-
-                # Find the end of tone section
-                end_markers = ["ORIGINAL TONE:", "FORMAL TONE VERSION:", "FRIENDLY TONE VERSION:", "TARGET TONE:"]
-                end_pos = float('inf')
-                for marker in end_markers:
-                    pos = result.find(marker)
-                    if pos != -1 and pos < end_pos:
-                        end_pos = pos
-
-                if start_pos < float('inf') and end_pos < float('inf'):
-                    tone_analysis = result[start_pos:end_pos].strip()
-                elif start_pos < float('inf'):
-                    # If no alternative indicators, take everything after tone start
-                    tone_analysis = result[start_pos:].strip()
-
-            # Check for tone alternatives section
-            alt_indicators = ["ORIGINAL TONE:", "FORMAL TONE VERSION:", "FRIENDLY TONE VERSION:", "TARGET TONE:",
-                              "REWRITTEN TEXT:"]
-            has_alt_indicators = any(indicator in result for indicator in alt_indicators)
-
-            if has_alt_indicators:
-                # Find the first alternative indicator
-                start_pos = float('inf')
-                for indicator in alt_indicators:
-                    pos = result.find(indicator)
-                    if pos != -1 and pos < start_pos:
-                        start_pos = pos
-
-                if start_pos < float('inf'):
-                    tone_alternatives = result[start_pos:].strip()
-
-            results_dict = {
-                "grammar_analysis": grammar_analysis if grammar_analysis else result,
-                "tone_analysis": tone_analysis if tone_analysis else result,
-                "tone_alternatives": tone_alternatives if tone_alternatives else result
-            }
-
-        # Show the results container
-        return json.dumps(results_dict), {'width': '80%', 'margin': 'auto', 'marginTop': '20px', 'display': 'block',
-                                          'backgroundColor': 'white', 'padding': '20px', 'borderRadius': '10px',
-                                          'boxShadow': '0px 2px 5px rgba(0,0,0,0.1)'}
+                    # A None chunk marks the end of one of the three sections
+                    job.progress += 1 / 3
+    finally:
+        stream.close()
 
-    except Exception as e:
-        return json.dumps({"error": str(e)}), {'display': 'none'}
+
+# Callback to cancel the current analysis
+@app.callback(
+    Output('job-status', 'children', allow_duplicate=True),
+    [Input('cancel-button', 'n_clicks')],
+    [State('stream-run-id', 'data')],
+    prevent_initial_call=True
+)
+def cancel_analysis(n_clicks, run_id):
+    if not run_id or not jobs.cancel(run_id):
+        raise PreventUpdate
+    return "Cancelling..."
 
 
-# Callback to format and display grammar results
+# Callback to show streamed output while it arrives and render the final results. The results are
+# parsed once here, on the server, and only the rendered tabs are sent to the browser.
 @app.callback(
-    Output('grammar-results', 'children'),
-    [Input('analysis-results-store', 'children')]
+    [
+        Output('grammar-stream', 'children'),
+        Output('tone-stream', 'children'),
+        Output('alternatives-stream', 'children'),
+        Output('grammar-results', 'children'),
+        Output('tone-chart-container', 'children'),
+        Output('alternatives-results', 'children'),
+        Output('stream-interval', 'disabled', allow_duplicate=True),
+        Output('job-status', 'children', allow_duplicate=True)
+    ],
+    [Input('stream-interval', 'n_intervals')],
+    [State('stream-run-id', 'data')],
+    prevent_initial_call=True
 )
-def update_grammar_results(results_json):
-    if not results_json:
+def update_streaming_results(n_intervals, run_id):
+    job = jobs.get(run_id) if run_id else None
+    if job is None:
         raise PreventUpdate
 
-    try:
-        results = json.loads(results_json)
+    with job.lock:
+        status = job.status
+        sections = dict(job.data['sections'])
+        report = job.data['report']
+        progress = job.progress
+
+        # Previews that did not grow since the last poll are not sent again
+        shown = job.data['shown']
+        previews = []
+        for section in ['grammar_analysis', 'tone_analysis', 'tone_alternatives']:
+            changed = shown.get(section) != len(sections[section])
+            shown[section] = len(sections[section])
+            previews.append(sections[section] if changed else dash.no_update)
+
+    if status == QUEUED:
+        position = jobs.position(run_id)
+        return (*previews, dash.no_update, dash.no_update, dash.no_update, False,
+                f"Waiting for a free worker ({position} analyses ahead)..." if position else
+                "Waiting for a free worker...")
+    if status == RUNNING:
+        return (*previews, dash.no_update, dash.no_update, dash.no_update, False,
+                f"Analyzing... {round(progress * 3)} of 3 sections done")
+    if status == CANCELLED:
+        return '', '', '', dash.no_update, dash.no_update, dash.no_update, True, "Analysis cancelled."
+
+    if status == FAILED:
+        # The tabs have nothing to show, so the reason goes in the status line
+        return ('', '', '', render_grammar_results(None), render_tone_results(None),
+                render_alternatives_results(None), True, f"Analysis failed: {job.error}")
+    if report:
+        results_dict = {"report": report, "target_tone": job.data['target_tone']}
+    else:
+        results_dict = sections
+    return ('', '', '',
+            render_grammar_results(grammar_fields(results_dict)),
+            render_tone_results(tone_fields(results_dict)),
+            render_alternatives_results(alternatives_fields(results_dict)),
+            True, "")
+
 
-        # Get grammar analysis text
-        grammar_text = results.get('grammar_analysis', '')
-        if not grammar_text:
+# Format the grammar results
+def render_grammar_results(grammar):
+    try:
+        if not grammar:
             return html.Div([
                 html.H3('Grammar Analysis', style={'color': colors['primary']}),
                 html.P("No grammar analysis available", style={'color': colors['neutral']})
@@ -267,15 +394,10 @@ def update_grammar_results(results_json):
             html.H3('Grammar Analysis Results', style={'color': colors['primary'], 'marginBottom': '20px'}),
         ]
 
-        # Extract sections with improved parsing
-        original_text = extract_text_between(grammar_text, "ORIGINAL TEXT:",
-                                             ["GRAMMATICAL ERRORS:", "CORRECTED TEXT:"])
-
-        errors_text = extract_text_between(grammar_text, "GRAMMATICAL ERRORS:",
-                                           ["CORRECTED TEXT:", "TONE:", "ORIGINAL TONE:"])
-
-        corrected_text = extract_text_between(grammar_text, "CORRECTED TEXT:",
-                                              ["TONE:", "FORMALITY LEVEL:", "SENTIMENT:", "ORIGINAL TONE:"])
+        original_text = grammar['original_text']
+        errors_text = grammar['errors_text']
+        errors = grammar['errors']
+        corrected_text = grammar['corrected_text']
 
         # Display original text
         if original_text:
@@ -287,7 +409,7 @@ def update_grammar_results(results_json):
             ]))
 
         # Handle grammatical errors
-        if errors_text:
+        if errors_text or errors:
             if "No grammatical errors found" in errors_text:
                 grammar_elements.append(html.Div([
                     html.Div([
@@ -301,51 +423,6 @@ def update_grammar_results(results_json):
                               'margin': '0 0 20px 0', 'boxShadow': '0 1px 3px rgba(0,0,0,0.1)'})
                 ]))
             else:
-                # Parse the errors
-                errors = []
-                current_error = {}
-                number_pattern = re.compile(r'^\d+\.\s')
-
-                # Try to parse numbered list format
-                if re.search(number_pattern, errors_text):
-                    error_items = re.split(number_pattern, errors_text)
-                    # First item may be empty or header text
-                    error_items = [item for item in error_items if item.strip()]
-
-                    for item in error_items:
-                        lines = item.split('\n')
-                        error_detail = {}
-
-                        for line in lines:
-                            line = line.strip()
-                            if "Error:" in line:
-                                error_detail["error_text"] = line.split("Error:")[1].strip()
-                            elif "Correction:" in line:
-                                error_detail["correction"] = line.split("Correction:")[1].strip()
-                            elif "Explanation:" in line:
-                                error_detail["explanation"] = line.split("Explanation:")[1].strip()
-
-                        if "error_text" in error_detail:
-                            errors.append(error_detail)
-
-                # If we couldn't parse numbered list, try line-by-line
-                if not errors:
-                    lines = errors_text.split('\n')
-                    for line in lines:
-                        line = line.strip()
-                        if "Error:" in line:
-                            if current_error and "error_text" in current_error:
-                                errors.append(current_error)
-                                current_error = {}
-                            current_error["error_text"] = line.split("Error:")[1].strip()
-                        elif "Correction:" in line and current_error:
-                            current_error["correction"] = line.split("Correction:")[1].strip()
-                        elif "Explanation:" in line and current_error:
-                            current_error["explanation"] = line.split("Explanation:")[1].strip()
-
-                    if current_error and "error_text" in current_error:
-                        errors.append(current_error)
-
                 # Display the errors
                 if errors:
                     grammar_elements.append(html.H4(f'Found {len(errors)} grammar issues:',
@@ -398,37 +475,19 @@ def update_grammar_results(results_json):
         ])
 
 
-# Callback to format and display tone analysis results
-@app.callback(
-
-    Output('tone-chart-container', 'children'),
-
-    [Input('analysis-results-store', 'children')]
-)
-def update_tone_results(results_json):
-    if not results_json:
-        raise PreventUpdate
-
+# Format the tone analysis results
+def render_tone_results(tone_info):
     try:
-        results = json.loads(results_json)
-
-        # Get tone analysis text
-        tone_text = results.get('tone_analysis', '')
-        if not tone_text:
+        if not tone_info:
             return html.Div([
                 html.H3('Tone Analysis', style={'color': colors['primary']}),
                 html.P("No tone analysis available", style={'color': colors['neutral']})
-            ]), None
-
-        # Extract tone information with improved parsing
-        tone = extract_text_between(tone_text, "TONE:", ["FORMALITY LEVEL:", "SENTIMENT:", "TONE ANALYSIS:"])
-
-        formality_level = extract_text_between(tone_text, "FORMALITY LEVEL:",
-                                               ["SENTIMENT:", "TONE ANALYSIS:", "ORIGINAL TONE:"])
-
-        sentiment = extract_text_between(tone_text, "SENTIMENT:", ["TONE ANALYSIS:", "ORIGINAL TONE:"])
+            ])
 
-        tone_analysis = extract_text_between(tone_text, "TONE ANALYSIS:", ["ORIGINAL TONE:"])
+        tone = tone_info['tone']
+        formality_level = tone_info['formality_level']
+        sentiment = tone_info['sentiment']
+        tone_analysis = tone_info['tone_analysis']
 
         # Create a beautiful tone card
         tone_elements = [
@@ -520,32 +579,19 @@ def update_tone_results(results_json):
         return html.Div([
             html.H3('Error Processing Tone Results', style={'color': colors['error']}),
             html.P(str(e))
-        ]), None
-
+        ])
 
-# Callback to format and display tone alternatives
-@app.callback(
-    Output('alternatives-results', 'children'),
-    [Input('analysis-results-store', 'children')]
-)
-def update_alternatives_results(results_json):
-    if not results_json:
-        raise PreventUpdate
 
+# Format the tone alternatives
+def render_alternatives_results(alternatives):
     try:
-        results = json.loads(results_json)
-
-        # Get tone alternatives text
-        alternatives_text = results.get('tone_alternatives', '')
-        if not alternatives_text:
+        if not alternatives:
             return html.Div([
                 html.H3('Tone Alternatives', style={'color': colors['primary']}),
                 html.P("No tone alternatives available", style={'color': colors['neutral']})
             ])
 
-        # Extract tone alternatives with improved parsing
-        original_tone = extract_text_between(alternatives_text, "ORIGINAL TONE:",
-                                             ["TARGET TONE:", "FORMAL TONE VERSION:", "FRIENDLY TONE VERSION:"])
+        original_tone = alternatives['original_tone']
 
         # Create the alternatives elements
         alternatives_elements = [
@@ -561,16 +607,11 @@ def update_alternatives_results(results_json):
             ], style={'marginBottom': '20px', 'padding': '10px 0'}))
 
         # Check if it's a specific target tone rewrite or multiple options
-        target_tone = extract_text_between(alternatives_text, "TARGET TONE:", ["REWRITTEN TEXT:"])
-        rewritten_text = extract_text_between(alternatives_text, "REWRITTEN TEXT:", [])
-
-        formal_tone = extract_text_between(alternatives_text, "FORMAL TONE VERSION:",
-                                           ["FRIENDLY TONE VERSION:", "PERSUASIVE TONE VERSION:"])
-
-        friendly_tone = extract_text_between(alternatives_text, "FRIENDLY TONE VERSION:",
-                                             ["PERSUASIVE TONE VERSION:"])
-
-        persuasive_tone = extract_text_between(alternatives_text, "PERSUASIVE TONE VERSION:", [])
+        target_tone = alternatives['target_tone']
+        rewritten_text = alternatives['rewritten_text']
+        formal_tone = alternatives['formal']
+        friendly_tone = alternatives['friendly']
+        persuasive_tone = alternatives['persuasive']
 
         # Display either single target tone or multiple options
         if target_tone and rewritten_text:
@@ -628,7 +669,7 @@ def update_alternatives_results(results_json):
             # Fallback display if we couldn't parse properly
             alternatives_elements.append(html.Div([
                 html.H4('Tone Alternatives:', style={'color': colors['primary'], 'marginBottom': '10px'}),
-                html.Div(alternatives_text,
+                html.Div(alternatives['raw_text'],
                          style={'padding': '15px', 'backgroundColor': '#f8f8f8', 'borderRadius': '5px',
                                 'whiteSpace': 'pre-wrap', 'lineHeight': '1.5',
                                 'boxShadow': '0 1px 3px rgba(0,0,0,0.1)'})
@@ -643,44 +684,110 @@ def update_alternatives_results(results_json):
         ])
 
 
-# Helper functions to parse text output
+# Helper functions to read the fields shown in each tab
 
-def extract_text_between(text, start_marker, end_markers):
+def grammar_fields(results):
     """
-    Extract text between a start marker and the first occurrence of any end marker.
+    Fields of the grammar tab, read from a JSON-mode report or parsed from the GrammarChecker text.
 
     Args:
-        text: The text to search in
-        start_marker: The starting marker
-        end_markers: List of possible end markers
+        results: The stored analysis results
 
     Returns:
-        Extracted text or empty string if not found
+        Dict with original_text, errors_text, errors and corrected_text, or None if there is no analysis
+    """
+    report = results.get('report')
+    if report:
+        errors = []
+        for error in report['grammatical_errors']:
+            error_detail = {"error_text": error['error'], "correction": error['correction']}
+            if error['explanation']:
+                error_detail["explanation"] = error['explanation']
+            errors.append(error_detail)
+
+        return {
+            'original_text': report['original_text'],
+            'errors_text': "" if errors else "No grammatical errors found",
+            'errors': errors,
+            'corrected_text': report['corrected_text'],
+        }
+
+    grammar_text = results.get('grammar_analysis', '')
+    if not grammar_text:
+        return None
+
+    sections = parse_sections(grammar_text)
+    errors_text = section_text(sections, "GRAMMATICAL ERRORS")
+    return {
+        'original_text': section_text(sections, "ORIGINAL TEXT"),
+        'errors_text': errors_text,
+        'errors': parse_grammar_errors(errors_text),
+        'corrected_text': section_text(sections, "CORRECTED TEXT"),
+    }
+
+
+def tone_fields(results):
+    """Fields of the tone tab (tone, formality_level, sentiment, tone_analysis), or None if there is no analysis."""
+    report = results.get('report')
+    if report:
+        return {
+            'tone': report['tone'],
+            'formality_level': str(report['formality_level']),
+            'sentiment': report['sentiment'],
+            'tone_analysis': report['tone_analysis'],
+        }
+
+    tone_text = results.get('tone_analysis', '')
+    if not tone_text:
+        return None
+
+    sections = parse_sections(tone_text)
+    return {
+        'tone': section_text(sections, "TONE"),
+        'formality_level': section_text(sections, "FORMALITY LEVEL"),
+        'sentiment': section_text(sections, "SENTIMENT"),
+        'tone_analysis': section_text(sections, "TONE ANALYSIS"),
+    }
+
+
+def alternatives_fields(results):
     """
-    if not text or not start_marker:
-        return ""
-
-    # Find the start position
-    start_pos = text.find(start_marker)
-    if start_pos == -1:
-        return ""
-
-    # Move past the start marker
-    start_pos += len(start_marker)
-
-    # Find the earliest end marker
-    end_pos = len(text)
-    for marker in end_markers:
-        if not marker:
-            continue
-        pos = text.find(marker, start_pos)
-        if pos != -1 and pos < end_pos:
-            end_pos = pos
-
-    # Extract the text
-    extracted = text[start_pos:end_pos].strip()
-    return extracted
+    Fields of the tone alternatives tab, or None if there are no alternatives.
 
+    Either `target_tone` and `rewritten_text` are set, or the formal, friendly and persuasive versions.
+    `raw_text` is shown as is when neither could be read.
+    """
+    report = results.get('report')
+    if report:
+        rewrites = {tone.lower(): text for tone, text in report['rewrites'].items()}
+        target_tone = results.get('target_tone') or ""
+        return {
+            'original_tone': report['original_tone'],
+            'target_tone': target_tone,
+            'rewritten_text': rewrites.get(target_tone.lower(), "") if target_tone else "",
+            'formal': "" if target_tone else rewrites.get('formal', ""),
+            'friendly': "" if target_tone else rewrites.get('friendly', ""),
+            'persuasive': "" if target_tone else rewrites.get('persuasive', ""),
+            'raw_text': "\n\n".join(f"{tone}: {text}" for tone, text in report['rewrites'].items()),
+        }
+
+    alternatives_text = results.get('tone_alternatives', '')
+    if not alternatives_text:
+        return None
+
+    sections = parse_sections(alternatives_text)
+    return {
+        'original_tone': section_text(sections, "ORIGINAL TONE"),
+        'target_tone': section_text(sections, "TARGET TONE"),
+        'rewritten_text': section_text(sections, "REWRITTEN TEXT"),
+        'formal': section_text(sections, "FORMAL TONE VERSION"),
+        'friendly': section_text(sections, "FRIENDLY TONE VERSION"),
+        'persuasive': section_text(sections, "PERSUASIVE TONE VERSION"),
+        'raw_text': alternatives_text,
+    }
+
+
+# Helper functions to parse text output
 
 def extract_number(text):
     """Extract the first number found in text."""
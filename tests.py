@@ -6,14 +6,68 @@ by running it on various sample texts and verifying its outputs with string form
 """
 from dotenv import load_dotenv
 
-import unittest
+import asyncio
+import json
+import os
 import re
-
-from agent import AlbanianTextAgent
+import tempfile
+import threading
+import unittest
+import time
+
+import httpx
+import openai
+from dash.development.base_component import Component
+from fastapi.testclient import TestClient
+from langchain_core.runnables import RunnableGenerator, RunnableLambda
+
+import api
+import main as dash_app
+from agent import AlbanianTextAgent, changed_fraction, is_error_result
+from agent_tools.cache import InMemoryCache, SQLiteCache, make_cache_key
+from agent_tools.cassette import Cassette, CassetteLLM, CassetteMiss, RECORD, REPLAY
+from agent_tools.chunking import chunk_text, sentence_spans
+from agent_tools.fused_analyzer import parse_fused_output
+from agent_tools.grammar_checker import GrammarChecker, load_word_tokenizer, parse_grammar_errors, regex_word_tokenize
+from agent_tools import llm as llm_module
+from agent_tools.llm import LLMRegistry, configure_llm_clients, get_registry
+from agent_tools.precheck import precheck
+from agent_tools.metrics import ToolMetrics, add_to_current_call, get_metrics, tool_call
+from agent_tools.near_duplicate import NearDuplicateCache
+from agent_tools.batching import batch_invoke
+from agent_tools.rate_limit import AdaptiveConcurrency, RateLimiter, RateLimitedLLM, TokenBucket
+from agent_tools.sections import parse_sections, section_text
+from agent_tools.singleflight import SingleFlight, AsyncSingleFlight
+from agent_tools.tone_analyzer import ToneAnalyzer
+from agent_tools.tone_classifier import ToneClassifier
+from agent_tools.tone_writer import ToneRewriter
+from benchmarks.fake_llm import FUSED_COMPLETION, TEXT, FakeLLM, canned_completion
+from job_queue import Job, JobQueue, QueueFull, DONE, FAILED, CANCELLED
 
 load_dotenv()
 
 
+class OfflineAgentTestCase(unittest.TestCase):
+    """Base class for tests of an agent whose tools answer from a fake LLM (no network needed)."""
+
+    def setUp(self):
+        # What the tools of offline_agent() answer from unless given another LLM
+        self.fake_llm = FakeLLM(latency="fixed:0")
+
+    def offline_agent(self, llm=None, **kwargs) -> AlbanianTextAgent:
+        """
+        An agent whose three tools all answer from `llm` (by default `self.fake_llm`), checking
+        texts in one piece. Its tool pool is shut down after the test.
+        """
+        agent = AlbanianTextAgent(**kwargs)
+        agent.grammar_checker.max_chunk_tokens = 0
+        llm = llm or self.fake_llm.as_runnable()
+        for tool in [agent.grammar_checker, agent.tone_analyzer, agent.tone_rewriter]:
+            tool.llm = llm
+        self.addCleanup(agent._executor.shutdown, wait=False)
+        return agent
+
+
 class TestAlbanianTextAgent(unittest.TestCase):
     """Test cases for the Albanian Text Analysis Agent."""
 
@@ -151,128 +205,1064 @@ class TestAlbanianTextAgent(unittest.TestCase):
         print("All analysis components successfully returned results.")
 
 
+class TestResponseCache(unittest.TestCase):
+    """Test cases for the tool response cache (no network needed)."""
+
+    def test_key_ignores_whitespace_differences(self):
+        """Texts differing only in whitespace share a key, other parameters do not."""
+        params = {"model_name": "gpt-3.5-turbo-instruct", "temperature": 0}
+        key = make_cache_key("GrammarChecker", "1", params, "Une jam  shume")
+        self.assertEqual(key, make_cache_key("GrammarChecker", "1", params, " Une jam shume\n"))
+        self.assertNotEqual(key, make_cache_key("GrammarChecker", "2", params, "Une jam shume"))
+        self.assertNotEqual(key, make_cache_key("ToneRewriter", "1", params, "Une jam shume", "formal"))
+
+    def test_lru_eviction_and_ttl(self):
+        """The in-memory cache evicts the least recently used entry and expires old ones."""
+        cache = InMemoryCache(max_size=2, ttl=0.05)
+        cache.set("a", "1")
+        cache.set("b", "2")
+        cache.get("a")
+        cache.set("c", "3")
+
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), "1")
+        time.sleep(0.1)
+        self.assertIsNone(cache.get("c"))
+        self.assertEqual(cache.stats()["hits"], 2)
+        self.assertEqual(cache.stats()["misses"], 2)
+
+    def test_sqlite_cache_round_trip(self):
+        """The SQLite cache stores and returns completions."""
+        cache = SQLiteCache(":memory:")
+        self.assertIsNone(cache.get("key"))
+        cache.set("key", "GRAMMATICAL ERRORS: No grammatical errors found")
+        self.assertEqual(cache.get("key"), "GRAMMATICAL ERRORS: No grammatical errors found")
+        self.assertEqual(len(cache), 1)
+
+
+class TestChunking(unittest.TestCase):
+    """Test cases for splitting long texts into sentence windows (no network needed)."""
+
+    def test_sentence_offsets_map_back_to_text(self):
+        """Sentence spans point at the sentences in the original text."""
+        text = "Përshëndetje koleg! Desha të të informoj.\n\nKemi vendosur të vazhdojmë"
+        sentences = [text[start:end] for start, end in sentence_spans(text)]
+        self.assertEqual(sentences, ["Përshëndetje koleg!", "Desha të të informoj.", "Kemi vendosur të vazhdojmë"])
+
+    def test_chunks_respect_token_budget(self):
+        """Sentences are packed into chunks under the budget without being cut."""
+        text = "Një dy tre. Katër pesë. Gjashtë shtatë tetë nëntë dhjetë njëmbëdhjetë."
+        chunks = chunk_text(text, max_tokens=5)
+
+        self.assertEqual([chunk.text for chunk in chunks],
+                         ["Një dy tre. Katër pesë.", "Gjashtë shtatë tetë nëntë dhjetë njëmbëdhjetë."])
+        for chunk in chunks:
+            self.assertEqual(text[chunk.start:chunk.end], chunk.text)
+
+    def test_tokenizer_falls_back_without_punkt_tab(self):
+        """When NLTK's word_tokenize cannot find its data, the regex tokenizer is used instead."""
+        import nltk
+
+        def missing_punkt_tab(text, *args, **kwargs):
+            raise LookupError("Resource 'punkt_tab' not found")
+
+        self.addCleanup(setattr, nltk.tokenize, "word_tokenize", nltk.tokenize.word_tokenize)
+        self.addCleanup(setattr, nltk.data, "path", list(nltk.data.path))
+        nltk.tokenize.word_tokenize = missing_punkt_tab
+
+        with tempfile.TemporaryDirectory() as directory:
+            self.assertIs(load_word_tokenizer(directory), regex_word_tokenize)
+            self.assertIn(directory, nltk.data.path)
+            self.assertEqual(regex_word_tokenize("Një dy."), ["Një", "dy", "."])
+
+            checker = GrammarChecker(llm=FakeLLM(latency="fixed:0").as_runnable(), nltk_data_path=directory,
+                                     max_chunk_tokens=5)
+            self.assertIn("CORRECTED TEXT", checker.forward("Përshëndetje koleg, si je sot?"))
+            self.assertIs(checker._tokenizer, regex_word_tokenize)
+
+    def test_short_texts_are_not_tokenized(self):
+        """Texts with fewer characters than the token budget never load the tokenizer."""
+        checker = GrammarChecker(llm=FakeLLM(latency="fixed:0").as_runnable(), max_chunk_tokens=300)
+        checker.forward("Përshëndetje koleg!")
+        self.assertIsNone(checker._tokenizer)
+
+    def test_tokenizer_errors_become_error_results(self):
+        """A failure while deciding whether to chunk is returned as the tool's error, not raised."""
+        def broken_tokenizer(text):
+            raise LookupError("Resource 'punkt_tab' not found")
+
+        checker = GrammarChecker(llm=FakeLLM(latency="fixed:0").as_runnable(), max_chunk_tokens=5)
+        checker._tokenizer = broken_tokenizer
+        self.assertIn("punkt_tab", checker.forward("Përshëndetje koleg, si je sot?"))
+        self.assertIn("punkt_tab", "".join(checker.forward_stream("Përshëndetje koleg, si je sot?")))
+        self.assertIn("punkt_tab", asyncio.run(checker.aforward("Përshëndetje koleg, si je sot?")))
+
+
+class TestStructuredOutput(OfflineAgentTestCase):
+    """Test cases for validating JSON-mode completions (no network needed)."""
+
+    completion = """```json
+    {"original_text": "Une jam mire.", "grammatical_errors": [{"error": "Une", "correction": "Unë",
+     "explanation": "Mungon ë."}], "corrected_text": "Unë jam mirë.", "tone": "Neutral",
+     "formality_level": 3, "sentiment": "Neutral", "tone_analysis": "Teksti është neutral.",
+     "original_tone": "Neutral", "rewrites": {"Formal": "Unë jam mirë, faleminderit."}}
+    ```"""
+
+    def test_fenced_completion_validates(self):
+        """A completion wrapped in a code fence is read into typed fields."""
+        analysis = parse_fused_output(self.completion, target_tone="formal")
+
+        self.assertEqual(analysis.formality_level, 3)
+        self.assertEqual(analysis.grammatical_errors[0].correction, "Unë")
+        self.assertEqual(analysis.rewrites["Formal"], "Unë jam mirë, faleminderit.")
+
+    def test_invalid_completion_is_rejected(self):
+        """Out-of-range fields and missing rewrites fail validation."""
+        with self.assertRaises(ValueError):
+            parse_fused_output(self.completion.replace('"formality_level": 3', '"formality_level": 9'), "formal")
+        with self.assertRaises(ValueError):
+            parse_fused_output(self.completion)
+
+    def test_bad_fused_completion_falls_back_to_the_tools(self):
+        """Malformed or schema-invalid fused JSON is replaced by the three separate tool calls."""
+        for bad_completion in ["Sorry, I cannot answer in JSON.",
+                               FUSED_COMPLETION.replace('"formality_level": 3', '"formality_level": 9')]:
+            self.fake_llm.reset()
+            agent = self.offline_agent(fused=True)
+            agent.fused_analyzer.llm = RunnableLambda(lambda prompt_value: bad_completion)
+
+            for result in [agent.forward("Pershendetje koleg!", structured=True),
+                           asyncio.run(agent.aforward("Mirëdita koleg!", structured=True))]:
+                self.assertIn("GRAMMATICAL ERRORS:", result.grammar_analysis)
+                self.assertEqual(section_text(parse_sections(result.tone_analysis), "TONE"), "Friendly")
+                self.assertIn("FORMAL TONE VERSION:", result.tone_alternatives)
+            self.assertEqual(self.fake_llm.calls, 6)
+
+        # A valid fused completion needs no separate calls
+        self.fake_llm.reset()
+        agent = self.offline_agent(fused=True)
+        agent.fused_analyzer.llm = self.fake_llm.as_runnable()
+        agent.forward("Pershendetje koleg!")
+        self.assertEqual(self.fake_llm.calls, 1)
+
+    def test_fused_tool_never_caches_unvalidated_output(self):
+        """A malformed completion seen through the tool's forward is not served to analyze later."""
+        cache = InMemoryCache()
+        agent = self.offline_agent(fused=True, cache=cache)
+        agent.fused_analyzer.llm = RunnableLambda(lambda prompt_value: "Sorry, I cannot answer in JSON.")
+        self.assertIn("error", agent.fused_analyzer.forward(TEXT, "formal"))
+        self.assertEqual(len(cache), 0)
+
+        agent.fused_analyzer.llm = self.fake_llm.as_runnable()
+        self.assertEqual(json.loads(agent.fused_analyzer.forward(TEXT, "formal"))["tone"], "Friendly")
+        self.assertEqual(agent.fused_analyzer.analyze(TEXT, "formal").tone, "Friendly")
+
+
+class TestSectionParser(unittest.TestCase):
+    """Test cases for the single-pass section parser (no network needed)."""
+
+    def test_sections_of_combined_output(self):
+        """Every header of the joined tool outputs is found, and ORIGINAL TONE is not read as TONE."""
+        text = ("ORIGINAL TEXT:\nUne jam mire.\n\nGRAMMATICAL ERRORS:\n1. Error: Une\n   Correction: Unë\n"
+                "2. Error: mire\n   Correction: mirë\n\nCORRECTED TEXT:\nUnë jam mirë.\n"
+                "TONE:\nNeutral\n\nFORMALITY LEVEL:\n3\n\nSENTIMENT:\nPositive\n\n"
+                "TONE ANALYSIS:\nTeksti është neutral.\n"
+                "ORIGINAL TONE:\nNeutral\n\nTARGET TONE:\nformal\n\nREWRITTEN TEXT:\nUnë jam mirë, faleminderit.")
+        sections = parse_sections(text)
+
+        self.assertEqual(section_text(sections, "CORRECTED TEXT"), "Unë jam mirë.")
+        self.assertEqual(section_text(sections, "TONE"), "Neutral")
+        self.assertEqual(section_text(sections, "FORMALITY LEVEL"), "3")
+        self.assertEqual(section_text(sections, "REWRITTEN TEXT"), "Unë jam mirë, faleminderit.")
+        self.assertEqual(len(extract_grammar_info(text)["errors"]), 2)
+
+        tone = sections["TONE ANALYSIS"]
+        self.assertEqual(text[tone.start:tone.end].strip(), "Teksti është neutral.")
+
+    def test_missing_headers(self):
+        """Text without headers has no sections."""
+        self.assertEqual(parse_sections("Teksti nuk ka seksione."), {})
+        self.assertEqual(section_text(parse_sections(""), "TONE"), "")
+
+
+class TestJobQueue(unittest.TestCase):
+    """Test cases for the background job queue (no network needed)."""
+
+    def test_jobs_run_and_report_status(self):
+        """Jobs publish results on their Job; failures are recorded instead of raised."""
+        jobs = JobQueue(max_workers=2)
+
+        def job_function(job, value):
+            if value is None:
+                raise ValueError("no value")
+            job.data["value"] = value
+
+        succeeded = jobs.submit(job_function, 42)
+        failed = jobs.submit(job_function, None)
+        jobs.shutdown()
+
+        self.assertEqual(succeeded.status, DONE)
+        self.assertEqual(succeeded.data["value"], 42)
+        self.assertEqual(failed.status, FAILED)
+        self.assertEqual(failed.error, "no value")
+
+    def test_cancel_and_backpressure(self):
+        """Queued and running jobs can be cancelled, and a full queue rejects new jobs."""
+        jobs = JobQueue(max_workers=1, max_pending=1)
+
+        def wait_for_cancel(job):
+            while not job.cancelled:
+                time.sleep(0.01)
+
+        running = jobs.submit(wait_for_cancel)
+        queued = jobs.submit(wait_for_cancel)
+        with self.assertRaises(QueueFull):
+            jobs.submit(wait_for_cancel)
+
+        self.assertTrue(jobs.cancel(queued.id))
+        self.assertTrue(jobs.cancel(running.id))
+        jobs.shutdown()
+
+        self.assertEqual(queued.status, CANCELLED)
+        self.assertEqual(running.status, CANCELLED)
+        self.assertFalse(jobs.cancel(running.id))
+
+    def test_failed_job_renders_one_component_per_tab(self):
+        """A failed analysis fills every tab with a component and puts the reason in the status line."""
+        def fail(job):
+            raise ValueError("no API key")
+
+        job = dash_app.jobs.submit(fail, data={
+            'sections': {'grammar_analysis': '', 'tone_analysis': '', 'tone_alternatives': ''},
+            'report': None, 'target_tone': None, 'shown': {}})
+        while not job.finished:
+            time.sleep(0.01)
+
+        outputs = dash_app.update_streaming_results(1, job.id)
+        for tab in outputs[3:6]:
+            self.assertIsInstance(tab, Component)
+        self.assertEqual(outputs[7], "Analysis failed: no API key")
+
+    def test_incremental_and_json_mode_are_separate_settings(self):
+        """The incremental and JSON-mode checklists reach the analysis job independently."""
+        submitted = []
+
+        class RecordingJobs:
+            def submit(self, fn, *args, data=None):
+                submitted.append(args)
+                return Job(id="job", data=data)
+
+        jobs = dash_app.jobs
+        dash_app.jobs = RecordingJobs()
+        self.addCleanup(setattr, dash_app, "jobs", jobs)
+
+        dash_app.analyze_text(1, "Mirëdita!", "none", ["incremental"], [], "session")
+        dash_app.analyze_text(1, "Mirëdita!", "formal", [], ["json"], "session")
+        self.assertEqual(submitted, [("Mirëdita!", None, "session", False), ("Mirëdita!", "formal", None, True)])
+
+
+class TestSingleFlight(unittest.TestCase):
+    """Test cases for coalescing identical in-flight calls (no network needed)."""
+
+    def test_concurrent_threads_share_one_call(self):
+        """Threads asking for the same key while it runs get the same result from one call."""
+        in_flight = SingleFlight()
+        calls = []
+
+        def analyze():
+            calls.append(1)
+            time.sleep(0.2)
+            return "result"
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(in_flight.do("key", analyze))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, ["result"] * 5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(in_flight.stats(), {"executed": 1, "coalesced": 4, "in_flight": 0})
+
+    def test_async_callers_share_result_and_errors(self):
+        """Coroutines with the same key share one call, including its exception."""
+        in_flight = AsyncSingleFlight()
+        calls = []
+
+        async def analyze(fail):
+            calls.append(fail)
+            await asyncio.sleep(0.05)
+            if fail:
+                raise ValueError("failed")
+            return "result"
+
+        async def run():
+            results = await asyncio.gather(*[in_flight.do("ok", lambda: analyze(False)) for _ in range(3)])
+            errors = await asyncio.gather(*[in_flight.do("bad", lambda: analyze(True)) for _ in range(2)],
+                                          return_exceptions=True)
+            return results, errors
+
+        results, errors = asyncio.run(run())
+        self.assertEqual(results, ["result"] * 3)
+        self.assertTrue(all(isinstance(error, ValueError) for error in errors))
+        self.assertEqual(calls, [False, True])
+        self.assertEqual(in_flight.stats()["coalesced"], 3)
+
+
+class TestRateLimiter(unittest.TestCase):
+    """Test cases for the client-side rate limiter (no network needed)."""
+
+    def test_rate_limited_calls_are_retried_and_lower_concurrency(self):
+        """A 429 is retried after a backoff instead of failing, and halves the concurrency limit."""
+        limiter = RateLimiter(concurrency=AdaptiveConcurrency(initial=8), base_delay=0.01)
+        response = httpx.Response(429, request=httpx.Request("POST", "https://api.openai.com/v1/completions"))
+        outcomes = [openai.RateLimitError("Rate limit reached", response=response, body=None), "completion"]
+
+        def call():
+            outcome = outcomes.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        self.assertEqual(limiter.call(call), "completion")
+        stats = limiter.stats()
+        self.assertEqual((stats["retries"], stats["rate_limited"], stats["in_flight"]), (1, 1, 0))
+        self.assertLess(stats["concurrency_limit"], 8)
+
+        # Errors that are not worth retrying fail right away
+        def bad_request():
+            raise ValueError("bad prompt")
+
+        with self.assertRaises(ValueError):
+            limiter.call(bad_request)
+        self.assertEqual(limiter.stats()["retries"], 1)
+
+    def test_batches_leave_retries_to_the_limiter(self):
+        """Batches through a RateLimitedLLM are retried only by the limiter, not again per batch."""
+        tone_prompt = ToneAnalyzer().tone_prompt
+        fake_llm = FakeLLM(latency="fixed:0", error_rate=1.0)
+        limiter = RateLimiter(max_retries=1, base_delay=0)
+        chain = tone_prompt | RateLimitedLLM(fake_llm.as_runnable(), limiter)
+
+        results = batch_invoke(chain, [{"text": "Një"}, {"text": "Dy"}], base_delay=0)
+        self.assertTrue(all(isinstance(result, openai.RateLimitError) for result in results))
+        self.assertEqual(fake_llm.calls, 4)  # one limiter retry per item, no batch-level rounds
+
+        fake_llm.reset()
+        batch_invoke(tone_prompt | fake_llm.as_runnable(), [{"text": "Një"}], base_delay=0)
+        self.assertEqual(fake_llm.calls, 4)  # without a limiter the batch retries (3 times) itself
+
+    def test_token_bucket(self):
+        """Reservations beyond the budget report how long to wait until enough has refilled."""
+        bucket = TokenBucket(rate_per_minute=600)
+        self.assertEqual(bucket.reserve(600), 0)
+        self.assertAlmostEqual(bucket.reserve(60), 6.0, places=1)
+        bucket.refund(100)
+        self.assertEqual(bucket.reserve(60), 0)
+
+
+class TestToolMetrics(unittest.TestCase):
+    """Test cases for per-tool-call instrumentation (no network needed)."""
+
+    def test_tool_calls_are_recorded_and_exported(self):
+        """Counters added inside a tool call land on its record and in the Prometheus output."""
+        with tool_call("MetricsTestTool", queue_wait=0.5) as call:
+            cache = InMemoryCache()
+            cache.set("key", "completion")
+            cache.get("key")
+            add_to_current_call(retries=2)
+        self.assertEqual((call.cache_hits, call.retries, call.queue_wait), (1, 2, 0.5))
+
+        with self.assertRaises(ValueError):
+            with tool_call("MetricsTestTool"):
+                raise ValueError("failed")
+
+        # Outside of a tool call there is nothing to add to
+        add_to_current_call(retries=1)
+
+        stats = get_metrics().snapshot()["MetricsTestTool"]
+        self.assertEqual((stats["calls"], stats["errors"], stats["cache_hits"], stats["retries"]), (2, 1, 1, 2))
+        text = get_metrics().render_prometheus({"test_gauge": ("A gauge.", 3)})
+        self.assertIn('agent_tool_calls_total{tool="MetricsTestTool"} 2', text)
+        self.assertIn('agent_tool_queue_wait_seconds_bucket{tool="MetricsTestTool",le="0.5"} 2', text)
+        self.assertIn("test_gauge 3", text)
+        self.assertEqual(ToolMetrics().render_prometheus().count("# TYPE"), 9)
+
+
+class TestFakeLLM(unittest.TestCase):
+    """Test cases for the offline benchmark's fake LLM (no network needed)."""
+
+    def test_agent_runs_offline_and_deterministically(self):
+        """The fake answers each tool in its format, with the same latencies and failures on every run."""
+        fake_llm = FakeLLM(latency="uniform:0,0.01", error_rate=0.5, seed=7)
+        agent = AlbanianTextAgent(concurrent=True)
+        agent.grammar_checker.max_chunk_tokens = 0
+        for tool in [agent.grammar_checker, agent.tone_analyzer, agent.tone_rewriter]:
+            tool.llm = fake_llm.as_runnable()
+
+        plans = [fake_llm.plan("same prompt") for _ in range(4)]
+        fake_llm.reset()
+        self.assertEqual([fake_llm.plan("same prompt") for _ in range(4)], plans)
+        self.assertTrue(any(fail for _, _, fail in plans) and not all(fail for _, _, fail in plans))
+
+        fake_llm.error_rate = 0.0
+        fake_llm.reset()
+        result = agent.forward("Pershendetje koleg!", structured=True)
+        self.assertIn("CORRECTED TEXT:", result.grammar_analysis)
+        self.assertEqual(section_text(parse_sections(result.tone_analysis), "FORMALITY LEVEL"), "3")
+        self.assertIn("FORMAL TONE VERSION:", result.tone_alternatives)
+        self.assertEqual(fake_llm.calls, 3)
+
+    def test_longer_completions_take_longer(self):
+        """With per_token_ms, each completion token adds generation time to the drawn latency."""
+        fake_llm = FakeLLM(latency="fixed:0.1", per_token_ms=2)
+        _, fused_latency, _ = fake_llm.plan("Answer with a single JSON object")
+        _, tone_latency, _ = fake_llm.plan("TONE: ... FORMALITY LEVEL: ...")
+        self.assertAlmostEqual(fused_latency, 0.1 + (len(FUSED_COMPLETION) // 4 + 1) * 0.002)
+        self.assertGreater(fused_latency, tone_latency)
+        self.assertGreater(tone_latency, 0.1)
+
+
+class TestCassette(unittest.TestCase):
+    """Test cases for recording and replaying LLM traffic (no network needed)."""
+
+    def test_record_then_replay(self):
+        """Recorded completions replay without the LLM; unknown prompts are misses."""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "traffic.cassette")
+            fake_llm = FakeLLM(latency="fixed:0")
+            recorder = Cassette(path, mode=RECORD)
+            checker = GrammarChecker(llm=CassetteLLM(fake_llm.as_runnable(), recorder), max_chunk_tokens=0)
+            recorded = checker.forward("Pershendetje koleg!")
+            recorder.close()
+
+            player = Cassette(path, mode=REPLAY)
+            checker = GrammarChecker(llm=CassetteLLM(fake_llm.as_runnable(), player), max_chunk_tokens=0)
+            fake_llm.reset()
+            self.assertEqual(checker.forward("Pershendetje koleg!"), recorded)
+            self.assertEqual(fake_llm.calls, 0)
+            with self.assertRaises(CassetteMiss):
+                player.play("a prompt that was never recorded")
+            self.assertEqual((player.stats()["replayed"], player.stats()["misses"]), (1, 1))
+            player.close()
+
+    def test_records_while_recording(self):
+        """records() reads what a recording cassette has written so far."""
+        with tempfile.TemporaryDirectory() as directory:
+            recorder = Cassette(os.path.join(directory, "traffic.cassette"), mode=RECORD)
+            self.assertEqual(list(recorder.records()), [])
+            recorder.record("prompt one", "response one", 0.1)
+            recorder.record("prompt two", "response two", 0.2)
+            self.assertEqual(list(recorder.records()), [("prompt one", "response one"),
+                                                        ("prompt two", "response two")])
+            recorder.close()
+
+    def test_replaying_a_missing_cassette(self):
+        """Replaying a file that does not exist says so and how to create it."""
+        with tempfile.TemporaryDirectory() as directory:
+            with self.assertRaisesRegex(FileNotFoundError, "record one first"):
+                Cassette(os.path.join(directory, "missing.cassette"), mode=REPLAY)
+
+
+class TestPrecheck(unittest.TestCase):
+    """Test cases for the local grammar pre-checker (no network needed)."""
+
+    def test_mechanical_errors_are_fixed_locally(self):
+        """Missing diacritics, doubled letters and punctuation spacing are corrected without the LLM."""
+        result = precheck("Une jam shume i geezuar. Ky tekst ka disa gabime gramatikore .")
+        self.assertTrue(result.resolved)
+        self.assertEqual(result.corrected_text, "Unë jam shumë i gëzuar. Ky tekst ka disa gabime gramatikore.")
+        self.assertEqual([error["correction"] for error in result.errors][:3], ["Unë", "shumë", "gëzuar"])
+
+        fake_llm = FakeLLM(latency="fixed:0")
+        checker = GrammarChecker(llm=fake_llm.as_runnable(), max_chunk_tokens=0, precheck=True)
+        report = checker.forward("Une jam shume i geezuar.")
+        self.assertEqual(fake_llm.calls, 0)
+        self.assertIn("Correction: gëzuar", report)
+
+    def test_only_residual_sentences_reach_the_llm(self):
+        """Sentences with ambiguous or unknown words go to the LLM, the others stay local."""
+        # "qe" is a word ("was") but usually a typo for "që", so only the LLM can decide
+        result = precheck("Une jam shume i geezuar qe po ju shkruaj. Ky tekst ka disa gabime gramatikore.")
+        self.assertEqual([result.text[start:end] for start, end in result.residual],
+                         ["Une jam shume i geezuar qe po ju shkruaj."])
+        self.assertEqual(result.errors, [])
+
+        prompts = []
+        fake_llm = FakeLLM(latency="fixed:0")
+
+        def llm(prompt_value):
+            prompts.append(prompt_value.to_string())
+            return fake_llm.invoke(prompt_value)
+
+        checker = GrammarChecker(llm=RunnableLambda(llm), max_chunk_tokens=0, precheck=True)
+        checker.forward(result.text)
+        self.assertEqual(len(prompts), 1)
+        self.assertIn("shkruaj.", prompts[0])
+        self.assertNotIn("gramatikore", prompts[0])
+
+
+class TestToneClassifier(unittest.TestCase):
+    """Test cases for the local tone classifier in front of the ToneAnalyzer (no network needed)."""
+
+    STYLES = [
+        (["I nderuar zotëri, ju lutem të më dërgoni dokumentet e kërkuara.",
+          "Me respekt, ju njoftojmë se mbledhja shtyhet për javën e ardhshme.",
+          "Ju lutemi të konfirmoni pjesëmarrjen tuaj në takim."],
+         "TONE:\nFormal\n\nFORMALITY LEVEL:\n5\n\nSENTIMENT:\nNeutral\n\nTONE ANALYSIS:\nZyrtar."),
+        (["Hej shok, si je? Dalim sonte për kafe?",
+          "Faleminderit shumë për ndihmën, je i mrekullueshëm!",
+          "Haha, sa qejf që u pamë dje!"],
+         "TONE:\nFriendly\n\nFORMALITY LEVEL:\n2\n\nSENTIMENT:\nPositive\n\nTONE ANALYSIS:\nMiqësor."),
+        (["Jam shumë i zemëruar me shërbimin tuaj të tmerrshëm!",
+          "Kjo është e papranueshme, askush nuk përgjigjet!",
+          "Çfarë turpi, produkti erdhi i thyer!"],
+         "TONE:\nAggressive\n\nFORMALITY LEVEL:\n2\n\nSENTIMENT:\nNegative\n\nTONE ANALYSIS:\nI ashpër."),
+    ]
+
+    @classmethod
+    def setUpClass(cls):
+        texts, outputs = [], []
+        for sentences, output in cls.STYLES:
+            for first in sentences:
+                for second in sentences:
+                    texts.append(f"{first} {second}")
+                    outputs.append(output)
+        cls.classifier = ToneClassifier.train(texts, outputs, n_features=2 ** 12)
+
+    def test_confident_texts_skip_the_llm(self):
+        """Texts like the logged ones are answered locally, unfamiliar ones go to the LLM."""
+        fake_llm = FakeLLM(latency="fixed:0")
+        analyzer = ToneAnalyzer(llm=fake_llm.as_runnable(), classifier=self.classifier)
+
+        local = extract_tone_info(analyzer.forward("Hej shok, dalim sonte për kafe?"))
+        self.assertEqual((local["tone"], local["formality_level"], local["sentiment"]), ("Friendly", "2", "Positive"))
+        self.assertEqual(fake_llm.calls, 0)
+
+        results = analyzer.forward_batch(["Ju lutem të konfirmoni takimin.", "Sot bie shi në Tiranë."])
+        self.assertEqual(fake_llm.calls, 1)
+        self.assertEqual(extract_tone_info(results[0])["tone"], "Formal")
+        self.assertEqual(extract_tone_info(results[1])["tone"], "Friendly")  # the fake LLM's canned answer
+
+    def test_nul_characters_do_not_shift_rows(self):
+        """A NUL inside one text neither breaks scoring nor changes the other texts' predictions."""
+        alone = self.classifier.predict(["Me respekt, ju njoftojmë."])[0]
+        predictions = self.classifier.predict(["Hej\x00shok, si je?", "Me respekt, ju njoftojmë."])
+        self.assertEqual(len(predictions), 2)
+        self.assertEqual(predictions[1].tone, alone.tone)
+        self.assertAlmostEqual(predictions[1].confidence, alone.confidence, places=5)
+
+        fake_llm = FakeLLM(latency="fixed:0")
+        analyzer = ToneAnalyzer(llm=fake_llm.as_runnable(), classifier=self.classifier)
+        self.assertEqual(len(analyzer.forward_batch(["a\x00b", "c"])), 2)
+
+    def test_save_and_load(self):
+        """A saved model predicts the same labels and confidences after loading."""
+        texts = ["Hej shok, si je?", "Me respekt, ju njoftojmë.", "Sot bie shi në Tiranë."]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "tone_classifier.npz")
+            self.classifier.save(path)
+            loaded = ToneClassifier.load(path)
+        for before, after in zip(self.classifier.predict(texts), loaded.predict(texts)):
+            self.assertEqual((before.tone, before.formality, before.sentiment),
+                             (after.tone, after.formality, after.sentiment))
+            self.assertAlmostEqual(before.confidence, after.confidence, places=5)
+
+
+class TestNearDuplicateCache(unittest.TestCase):
+    """Test cases for reusing tone results of near-identical texts (no network needed)."""
+
+    TEXT = ("Përshëndetje Arben! Desha të të informoj për vendimin e mbledhjes së sotme. "
+            "Kemi vendosur të vazhdojmë me projektin e ri.")
+
+    def test_tone_analysis_ignores_names_and_punctuation(self):
+        """A text differing in a name, punctuation and spacing reuses the analysis; other texts do not."""
+        fake_llm = FakeLLM(latency="fixed:0")
+        cache = NearDuplicateCache(threshold=0.85)
+        analyzer = ToneAnalyzer(llm=fake_llm.as_runnable(), near_duplicate_cache=cache)
+
+        first = analyzer.forward(self.TEXT)
+        variant = self.TEXT.replace("Arben!", "Maria,").replace(". Kemi", "; kemi  ")
+        self.assertEqual(analyzer.forward(variant), first)
+        self.assertEqual(fake_llm.calls, 1)
+
+        analyzer.forward_batch([variant, "Sot bie shi në Tiranë dhe nuk kam dëshirë të dal nga shtëpia."])
+        self.assertEqual(fake_llm.calls, 2)
+        self.assertEqual(cache.stats()["hits"], 2)
+
+    def test_rewrites_keep_names_apart(self):
+        """A rewrite quotes its text, so a different name is a miss while punctuation is not."""
+        fake_llm = FakeLLM(latency="fixed:0")
+        rewriter = ToneRewriter(llm=fake_llm.as_runnable(), near_duplicate_cache=NearDuplicateCache(threshold=0.85))
+
+        rewriter.forward(self.TEXT, "formal")
+        rewriter.forward(self.TEXT.replace("!", "."), "formal")
+        self.assertEqual(fake_llm.calls, 1)
+        rewriter.forward(self.TEXT.replace("Arben", "Maria"), "formal")
+        rewriter.forward(self.TEXT, "friendly")
+        self.assertEqual(fake_llm.calls, 3)
+
+    def test_eviction_bounds_memory(self):
+        """Least recently used entries are evicted together with their index buckets."""
+        cache = NearDuplicateCache(max_entries=3)
+        texts = [f"Teksti numër {number} për provë" for number in ["një", "dy", "tre", "katër", "pesë"]]
+        for text in texts:
+            cache.set("tone", cache.signature(text), text)
+        self.assertEqual(len(cache), 3)
+        self.assertIsNone(cache.get("tone", cache.signature(texts[0]), threshold=1.0))
+        self.assertEqual(cache.get("tone", cache.signature(texts[-1]), threshold=1.0), texts[-1])
+
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache._buckets, {})
+
+
+class TestIncrementalAnalysis(OfflineAgentTestCase):
+    """Test cases for re-analyzing edited submissions of a session (no network needed)."""
+
+    SENTENCES = ["Pershendetje koleg!", "Desha të të informoj për vendimin e mbledhjes se sotme.",
+                 "Kemi vendosur të vazhdojme me projektin e ri.", "Por na duhen më shumë burime dhe kohë.",
+                 "Ju lutem më kthe përgjigje deri nesër në mëngjes."]
+
+    def setUp(self):
+        super().setUp()
+        self.grammar_llm, self.tone_llm, self.rewrite_llm = self.fake_llm, FakeLLM(latency="fixed:0"), FakeLLM(
+            latency="fixed:0")
+        self.agent = self.offline_agent()
+        self.agent.tone_analyzer.llm = self.tone_llm.as_runnable()
+        self.agent.tone_rewriter.llm = self.rewrite_llm.as_runnable()
+
+    def calls(self):
+        return self.grammar_llm.calls, self.tone_llm.calls, self.rewrite_llm.calls
+
+    def test_only_edited_sentences_are_rechecked(self):
+        """A first submission is one grammar call; resubmitting costs nothing and a small edit one call."""
+        text = " ".join(self.SENTENCES)
+        first = self.agent.forward_incremental(text, session_id="edit", structured=True)
+        self.assertEqual(self.calls(), (1, 1, 1))
+        self.assertIn("CORRECTED TEXT:", first.grammar_analysis)
+
+        again = self.agent.forward_incremental(text, session_id="edit", structured=True)
+        self.assertEqual(self.calls(), (1, 1, 1))
+        self.assertEqual(again, first)
+
+        edited = text.replace("kohë.", "para.")
+        self.assertLess(changed_fraction(text, edited), self.agent.tone_change_threshold)
+        self.agent.forward_incremental(edited, session_id="edit")
+        # The tone is kept, the rewrite covers the whole text and is redone
+        self.assertEqual(self.calls(), (2, 1, 2))
+
+    def test_large_changes_rerun_tone(self):
+        """Tone is recomputed once more than tone_change_threshold of the text changed."""
+        text = " ".join(self.SENTENCES)
+        rewritten = " ".join(self.SENTENCES[:2] + ["Sot bie shi.", "Nesër do të dal.", "Shihemi së shpejti."])
+        self.assertEqual(changed_fraction(text, text), 0.0)
+        self.assertGreater(changed_fraction(text, rewritten), self.agent.tone_change_threshold)
+
+        self.agent.forward_incremental(text, session_id="rewrite")
+        self.agent.forward_incremental(rewritten, session_id="rewrite")
+        self.assertEqual(self.calls(), (2, 2, 2))
+
+        # Sessions do not share results
+        self.agent.forward_incremental(text, session_id="other")
+        self.assertEqual(self.calls(), (3, 3, 3))
+
+
+class TestAPI(OfflineAgentTestCase):
+    """Test cases for the HTTP API, with the agent answering from a fake LLM (no network needed)."""
+
+    def setUp(self):
+        super().setUp()
+        agent, limiter = api.agent, api.limiter
+        api.agent = self.offline_agent()
+        api.limiter = api.ConcurrencyLimiter(2)
+        self.addCleanup(setattr, api, "agent", agent)
+        self.addCleanup(setattr, api, "limiter", limiter)
+        self.client = TestClient(api.app)
+
+    def test_analyze_validates_input(self):
+        """Empty and oversized texts are rejected with 422 before any LLM call."""
+        self.assertEqual(self.client.post("/analyze", json={"text": ""}).status_code, 422)
+        oversized = {"text": "a" * (api.MAX_TEXT_CHARS + 1)}
+        self.assertEqual(self.client.post("/analyze", json=oversized).status_code, 422)
+        self.assertEqual(self.fake_llm.calls, 0)
+
+        response = self.client.post("/analyze", json={"text": "Pershendetje koleg!"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.json()), {"grammar_analysis", "tone_analysis", "tone_alternatives"})
+
+    def test_full_worker_answers_429(self):
+        """Requests beyond the concurrency limit get 429 with Retry-After instead of waiting."""
+        while api.limiter.try_acquire():
+            pass
+        response = self.client.post("/analyze", json={"text": "Pershendetje koleg!"})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers["Retry-After"], "1")
+        self.assertEqual(self.client.post("/analyze/stream", json={"text": "Pershendetje koleg!"}).status_code, 429)
+        self.assertEqual(self.fake_llm.calls, 0)
+
+    def test_stream_rejects_json_mode(self):
+        """JSON mode has no streamed form, so asking for it is a validation error, not ignored."""
+        response = self.client.post("/analyze/stream", json={"text": "Pershendetje koleg!", "json_mode": True})
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(self.fake_llm.calls, 0)
+        self.assertEqual(api.limiter.in_flight, 0)
+
+    def test_stream_releases_its_slot(self):
+        """The stream slot is released when the stream ends and when the client disconnects early."""
+        response = self.client.post("/analyze/stream", json={"text": "Pershendetje koleg!"})
+        events = [json.loads(line) for line in response.text.splitlines()]
+        self.assertEqual({event["section"] for event in events},
+                         {"grammar_analysis", "tone_analysis", "tone_alternatives"})
+        self.assertEqual(api.limiter.in_flight, 0)
+
+        # TestClient reads whole responses, so disconnect at the ASGI level after the first event
+        api.agent.tone_rewriter.llm = FakeLLM(latency="fixed:5").as_runnable()
+        slots_while_streaming = asyncio.run(self.stream_then_disconnect())
+        self.assertEqual(slots_while_streaming[0], 1)
+        self.assertEqual(api.limiter.in_flight, 0)
+
+    @staticmethod
+    async def stream_then_disconnect() -> list:
+        body = json.dumps({"text": "Pershendetje koleg!"}).encode()
+        scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+                 "scheme": "http", "path": "/analyze/stream", "raw_path": b"/analyze/stream", "query_string": b"",
+                 "root_path": "", "headers": [(b"content-type", b"application/json")],
+                 "client": ("test", 1), "server": ("test", 80)}
+        first_event = asyncio.Event()
+        requested = False
+        slots = []
+
+        async def receive():
+            nonlocal requested
+            if not requested:
+                requested = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await first_event.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.body" and message.get("body"):
+                slots.append(api.limiter.in_flight)
+                first_event.set()
+
+        await asyncio.wait_for(api.app(scope, receive, send), timeout=3)
+        return slots
+
+
+class TestBatchAnalysis(OfflineAgentTestCase):
+    """Test cases for analyzing many texts in one call (no network needed)."""
+
+    TEXTS = [f"Teksti numër {number}." for number in range(5)]
+
+    def setUp(self):
+        super().setUp()
+
+        def llm(prompt_value):
+            prompt = prompt_value.to_string()
+            number = int(re.search(r"Teksti numër (\d)", prompt).group(1))
+            # Later texts answer first, so completion order differs from input order
+            time.sleep(0.01 * (len(self.TEXTS) - number))
+            if number == 2:
+                raise ValueError("bad input")
+            return f"{canned_completion(prompt)}\n[Teksti numër {number}]"
+
+        self.agent = self.offline_agent(RunnableLambda(llm))
+
+    def check_results(self, results):
+        self.assertEqual(len(results), len(self.TEXTS))
+        for number, result in enumerate(results):
+            sections = (result.grammar_analysis, result.tone_analysis, result.tone_alternatives)
+            if number == 2:
+                self.assertTrue(all(is_error_result(section) for section in sections))
+                self.assertIn("bad input", result.grammar_analysis)
+            else:
+                for section in sections:
+                    self.assertTrue(section.endswith(f"[Teksti numër {number}]"))
+
+    def test_forward_batch_keeps_order_and_isolates_failures(self):
+        """Results come back in input order and a failing text only affects its own result."""
+        self.check_results(self.agent.forward_batch(self.TEXTS, structured=True))
+
+    def test_aforward_batch_keeps_order_and_isolates_failures(self):
+        """Same for the async batch."""
+        self.check_results(asyncio.run(self.agent.aforward_batch(self.TEXTS, structured=True)))
+
+    def test_target_tones_must_match_texts(self):
+        """A target tone list of the wrong length is rejected before anything is sent."""
+        for target_tones in [["formal"] * 4, ["formal"] * 6]:
+            with self.assertRaises(ValueError):
+                self.agent.forward_batch(self.TEXTS, target_tones)
+            with self.assertRaises(ValueError):
+                asyncio.run(self.agent.aforward_batch(self.TEXTS, target_tones))
+
+    def test_batch_grammar_matches_single_texts(self):
+        """Pre-checked and chunked texts get the same report in a batch as on their own."""
+        checker = GrammarChecker(llm=self.fake_llm.as_runnable(), max_chunk_tokens=12, precheck=True)
+        texts = ["Une jam shume i geezuar.", "Ju faleminderit qe na shkruat.",
+                 "Ju faleminderit qe na shkruat dhe qe na dërguat dokumentet. "
+                 "Ne qe jemi këtu presim qe të vini nesër në zyrën tonë qendrore."]
+        expected = [checker.forward(text) for text in texts]
+        self.assertEqual(checker.forward_batch(texts), expected)
+        self.assertEqual(asyncio.run(checker.aforward_batch(texts)), expected)
+
+
+class TestLLMRegistry(unittest.TestCase):
+    """Test cases for the shared LLM clients (no network needed)."""
+
+    def test_close_closes_both_pools(self):
+        """close and aclose release the sync and the async connection pool."""
+        registry = LLMRegistry()
+        registry.close()
+        self.assertTrue(registry.http_client.is_closed)
+        self.assertTrue(registry.http_async_client.is_closed)
+
+        registry = LLMRegistry()
+        asyncio.run(registry.aclose())
+        self.assertTrue(registry.http_client.is_closed)
+        self.assertTrue(registry.http_async_client.is_closed)
+
+    def test_reconfiguring_closes_the_old_registry(self):
+        """configure_llm_clients closes the registry it replaces."""
+        # Hand the next test a fresh registry from the environment again
+        self.addCleanup(setattr, llm_module, "_default_registry", None)
+        first = configure_llm_clients(max_connections=2)
+        second = configure_llm_clients(max_connections=3)
+        self.addCleanup(second.close)
+        self.assertIs(get_registry(), second)
+        self.assertTrue(first.http_client.is_closed)
+        self.assertTrue(first.http_async_client.is_closed)
+        self.assertFalse(second.http_async_client.is_closed)
+
+
+class TestToolTimeout(OfflineAgentTestCase):
+    """Test cases for tools that do not answer within tool_timeout (no network needed)."""
+
+    def test_sequential_tools_time_out(self):
+        """tool_timeout also bounds each tool when the tools run one after another."""
+        agent = self.offline_agent(tool_timeout=0.3, concurrent=False)
+        agent.grammar_checker.llm = FakeLLM(latency="fixed:1").as_runnable()
+
+        start = time.perf_counter()
+        result = agent.forward("Pershendetje koleg!", structured=True)
+        self.assertLess(time.perf_counter() - start, 0.9)
+        self.assertEqual(result.grammar_analysis, str({"error": "GrammarChecker timed out after 0.3 seconds"}))
+        self.assertIn("TONE ANALYSIS:", result.tone_analysis)
+        self.assertIn("FORMAL TONE VERSION:", result.tone_alternatives)
+
+    def test_timeout_reaches_the_llm_requests(self):
+        """The tools' LLM requests are bounded by tool_timeout, so abandoned calls free their workers."""
+        agent = AlbanianTextAgent(tool_timeout=7)
+        for tool in [agent.grammar_checker, agent.tone_analyzer, agent.tone_rewriter, agent.fused_analyzer]:
+            self.assertEqual(tool.llm_timeout, 7)
+
+        registry = LLMRegistry(timeout=60)
+        self.addCleanup(registry.close)
+        self.assertEqual(registry.get_llm(timeout=7).llm.request_timeout, 7)
+        self.assertEqual(registry.get_llm().llm.request_timeout, 60)
+
+    def test_only_the_slow_tool_times_out(self):
+        """A slow tool becomes an error section without holding back the other two."""
+        agent = self.offline_agent(tool_timeout=0.3)
+        agent.tone_analyzer.llm = FakeLLM(latency="fixed:1").as_runnable()
+
+        start = time.perf_counter()
+        result = agent.forward("Pershendetje koleg!", structured=True)
+        self.assertLess(time.perf_counter() - start, 0.9)
+        self.assertEqual(result.tone_analysis, str({"error": "ToneAnalyzer timed out after 0.3 seconds"}))
+        self.assertIn("CORRECTED TEXT:", result.grammar_analysis)
+        self.assertIn("FORMAL TONE VERSION:", result.tone_alternatives)
+
+    def test_queued_calls_are_cancelled(self):
+        """Calls still waiting for a worker when time runs out are cancelled rather than sent later."""
+        agent = self.offline_agent(tool_timeout=0.3, max_workers=1)
+        agent.grammar_checker.llm = FakeLLM(latency="fixed:0.6").as_runnable()
+
+        result = agent.forward("Pershendetje koleg!", structured=True)
+        self.assertTrue(all(is_error_result(section) for section in
+                            (result.grammar_analysis, result.tone_analysis, result.tone_alternatives)))
+        agent._executor.shutdown(wait=True)
+        self.assertEqual(self.fake_llm.calls, 0)
+
+
+class TestAsyncAnalysis(OfflineAgentTestCase):
+    """Test cases for the agent's async analysis (no network needed)."""
+
+    def test_aforward_matches_forward(self):
+        """The async analysis has the same three sections as the sync one."""
+        agent = self.offline_agent()
+        text = "Pershendetje koleg, si je?"
+        result = asyncio.run(agent.aforward(text, "formal", structured=True))
+        self.assertEqual(result, agent.forward(text, "formal", structured=True))
+        self.assertIn("CORRECTED TEXT:", result.grammar_analysis)
+        self.assertIn("TONE ANALYSIS:", result.tone_analysis)
+        self.assertIn("FORMAL TONE VERSION:", result.tone_alternatives)
+
+    def test_aforward_runs_the_tools_concurrently(self):
+        """The three tool calls overlap on the event loop instead of running one after another."""
+        fake_llm = FakeLLM(latency="fixed:0.2")
+        agent = self.offline_agent(fake_llm.as_runnable())
+
+        start = time.perf_counter()
+        asyncio.run(agent.aforward("Pershendetje koleg!"))
+        elapsed = time.perf_counter() - start
+        self.assertEqual(fake_llm.calls, 3)
+        self.assertLess(elapsed, 2 * 0.2)
+
+    def test_aforward_times_out_the_slow_tool(self):
+        """A slow tool becomes an error section while the others finish."""
+        agent = self.offline_agent(tool_timeout=0.3)
+        agent.tone_rewriter.llm = FakeLLM(latency="fixed:1").as_runnable()
+
+        result = asyncio.run(agent.aforward("Pershendetje koleg!", structured=True))
+        self.assertEqual(result.tone_alternatives, str({"error": "ToneRewriter timed out after 0.3 seconds"}))
+        self.assertIn("CORRECTED TEXT:", result.grammar_analysis)
+        self.assertIn("TONE ANALYSIS:", result.tone_analysis)
+
+
+def streaming_llm(fake_llm: FakeLLM, chunk_size: int = 8, fail_after: int = None) -> RunnableGenerator:
+    """`fake_llm` as a runnable streaming its completions `chunk_size` characters at a time.
+
+    With `fail_after`, the stream raises after that many chunks.
+    """
+    def chunks(completion):
+        for number, start in enumerate(range(0, len(completion), chunk_size)):
+            if number == fail_after:
+                raise RuntimeError("connection reset mid-stream")
+            yield completion[start:start + chunk_size]
+
+    def transform(prompts):
+        for prompt in prompts:
+            yield from chunks(fake_llm.invoke(prompt))
+
+    async def atransform(prompts):
+        async for prompt in prompts:
+            for chunk in chunks(await fake_llm.ainvoke(prompt)):
+                yield chunk
+
+    return RunnableGenerator(transform, atransform, name="StreamingFakeLLM")
+
+
+class TestStreaming(OfflineAgentTestCase):
+    """Test cases for the tools' and the agent's streamed output (no network needed)."""
+
+    text = "Pershendetje koleg, si je?"
+
+    def streaming_agent(self, **kwargs) -> AlbanianTextAgent:
+        return self.offline_agent(streaming_llm(self.fake_llm, **kwargs))
+
+    @staticmethod
+    def collect(pairs) -> dict:
+        sections = {}
+        for section, chunk in pairs:
+            sections.setdefault(section, []).append(chunk)
+        return sections
+
+    @staticmethod
+    async def acollect(pairs) -> list:
+        return [pair async for pair in pairs]
+
+    def assert_sections_match(self, sections: dict, expected):
+        self.assertEqual(set(sections), {"grammar_analysis", "tone_analysis", "tone_alternatives"})
+        for section, chunks in sections.items():
+            self.assertIsNone(chunks[-1])
+            self.assertNotIn(None, chunks[:-1])
+            self.assertGreater(len(chunks), 2)
+            self.assertEqual("".join(chunks[:-1]), getattr(expected, section))
+
+    def test_tool_stream_joins_to_forward(self):
+        """A tool streams several chunks, in order, that join to its non-streamed answer."""
+        grammar_checker = self.streaming_agent().grammar_checker
+        chunks = list(grammar_checker.forward_stream(self.text))
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual("".join(chunks), grammar_checker.forward(self.text))
+
+        tone_analyzer = self.streaming_agent().tone_analyzer
+        chunks = asyncio.run(self.acollect(tone_analyzer.aforward_stream(self.text)))
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual("".join(chunks), tone_analyzer.forward(self.text))
+
+    def test_forward_stream_joins_to_forward(self):
+        """Every section streams in order, ends with None and joins to the non-streamed section."""
+        expected = self.streaming_agent().forward(self.text, "formal", structured=True)
+        sections = self.collect(self.streaming_agent().forward_stream(self.text, "formal"))
+        self.assert_sections_match(sections, expected)
+
+    def test_aforward_stream_joins_to_forward(self):
+        """The async stream has the same sections and chunks as the sync one."""
+        expected = self.streaming_agent().forward(self.text, "formal", structured=True)
+        pairs = asyncio.run(self.acollect(self.streaming_agent().aforward_stream(self.text, "formal")))
+        self.assert_sections_match(self.collect(pairs), expected)
+
+    def test_tool_failures_have_one_shape(self):
+        """A tool fails with the same string result whether it is called, awaited or streamed."""
+        def broken_llm(prompt_value):
+            raise RuntimeError("connection reset")
+
+        expected = str({"error": "connection reset"})
+        self.assertTrue(is_error_result(expected))
+        for tool, inputs in [(GrammarChecker(max_chunk_tokens=0), {"text": self.text}),
+                             (ToneAnalyzer(), {"text": self.text}),
+                             (ToneRewriter(), {"text": self.text, "target_tone": "formal"})]:
+            tool.llm = RunnableLambda(broken_llm)
+            self.assertEqual(tool.forward(**inputs), expected)
+            self.assertEqual(asyncio.run(tool.aforward(**inputs)), expected)
+            self.assertEqual(list(tool.forward_stream(**inputs)), [expected])
+            self.assertEqual(asyncio.run(self.acollect(tool.aforward_stream(**inputs))), [expected])
+
+    def test_mid_stream_error_ends_the_section(self):
+        """A stream failing partway ends its section with an error and leaves the others complete."""
+        expected = self.streaming_agent().forward(self.text, "formal", structured=True)
+        agent = self.streaming_agent()
+        agent.tone_analyzer.llm = streaming_llm(self.fake_llm, fail_after=2)
+
+        for pairs in (list(agent.forward_stream(self.text, "formal")),
+                      asyncio.run(self.acollect(agent.aforward_stream(self.text, "formal")))):
+            sections = self.collect(pairs)
+            tone_chunks = sections.pop("tone_analysis")
+            self.assertEqual(len(tone_chunks), 4)
+            self.assertIsNone(tone_chunks[-1])
+            self.assertEqual(tone_chunks[-2], str({"error": "connection reset mid-stream"}))
+            for section, chunks in sections.items():
+                self.assertIsNone(chunks[-1])
+                self.assertEqual("".join(chunks[:-1]), getattr(expected, section))
+
+
 # Helper functions to parse the string output into structured data
 
 def extract_grammar_info(text):
     """Extract grammar information from the text output."""
-    result = {
-        "original_text": "",
-        "errors": [],
-        "corrected_text": ""
+    sections = parse_sections(text)
+    return {
+        "original_text": section_text(sections, "ORIGINAL TEXT"),
+        "errors": parse_grammar_errors(section_text(sections, "GRAMMATICAL ERRORS")),
+        "corrected_text": section_text(sections, "CORRECTED TEXT")
     }
 
-    # Extract original text
-    original_text = extract_text_between(text, "ORIGINAL TEXT:",
-                                     ["GRAMMATICAL ERRORS:", "CORRECTED TEXT:"])
-    if original_text:
-        result["original_text"] = original_text
-
-    # Extract errors
-    errors_text = extract_text_between(text, "GRAMMATICAL ERRORS:",
-                                    ["CORRECTED TEXT:", "TONE:"])
-
-    if errors_text and "No grammatical errors found" not in errors_text:
-        # Try to parse numbered list format
-        error_items = []
-        number_pattern = re.compile(r'^\d+\.\s')
-
-        if re.search(number_pattern, errors_text):
-            error_items = re.split(number_pattern, errors_text)
-            # First item may be empty or header text
-            error_items = [item for item in error_items if item.strip()]
-
-            for item in error_items:
-                lines = item.split('\n')
-                error_detail = {}
-
-                for line in lines:
-                    line = line.strip()
-                    if "Error:" in line:
-                        error_detail["error_text"] = line.split("Error:")[1].strip()
-                    elif "Correction:" in line:
-                        error_detail["correction"] = line.split("Correction:")[1].strip()
-                    elif "Explanation:" in line:
-                        error_detail["explanation"] = line.split("Explanation:")[1].strip()
-
-                if "error_text" in error_detail:
-                    result["errors"].append(error_detail)
-
-        # If we couldn't parse numbered list, try line-by-line
-        if not result["errors"]:
-            current_error = {}
-            lines = errors_text.split('\n')
-            for line in lines:
-                line = line.strip()
-                if "Error:" in line:
-                    if current_error and "error_text" in current_error:
-                        result["errors"].append(current_error)
-                        current_error = {}
-                    current_error["error_text"] = line.split("Error:")[1].strip()
-                elif "Correction:" in line and current_error:
-                    current_error["correction"] = line.split("Correction:")[1].strip()
-                elif "Explanation:" in line and current_error:
-                    current_error["explanation"] = line.split("Explanation:")[1].strip()
-
-            if current_error and "error_text" in current_error:
-                result["errors"].append(current_error)
-
-    # Extract corrected text
-    corrected_text = extract_text_between(text, "CORRECTED TEXT:",
-                                      ["TONE:", "FORMALITY LEVEL:"])
-    if corrected_text:
-        result["corrected_text"] = corrected_text
-
-    return result
-
 
 def extract_tone_info(text):
     """Extract tone information from the text output."""
-    result = {
-        "tone": "",
-        "formality_level": "",
-        "sentiment": "",
-        "tone_analysis": ""
+    sections = parse_sections(text)
+    return {
+        "tone": section_text(sections, "TONE"),
+        "formality_level": section_text(sections, "FORMALITY LEVEL"),
+        "sentiment": section_text(sections, "SENTIMENT"),
+        "tone_analysis": section_text(sections, "TONE ANALYSIS")
     }
 
-    # Extract tone
-    tone = extract_text_between(text, "TONE:", ["FORMALITY LEVEL:", "SENTIMENT:"])
-    if tone:
-        result["tone"] = tone
-
-    # Extract formality level
-    formality_level = extract_text_between(text, "FORMALITY LEVEL:", ["SENTIMENT:", "TONE ANALYSIS:"])
-    if formality_level:
-        result["formality_level"] = formality_level
-
-    # Extract sentiment
-    sentiment = extract_text_between(text, "SENTIMENT:", ["TONE ANALYSIS:", "ORIGINAL TONE:"])
-    if sentiment:
-        result["sentiment"] = sentiment
-
-    # Extract tone analysis
-    tone_analysis = extract_text_between(text, "TONE ANALYSIS:", ["ORIGINAL TONE:"])
-    if tone_analysis:
-        result["tone_analysis"] = tone_analysis
-
-    return result
-
 
 def extract_alternatives_info(text):
     """Extract tone alternatives information from the text output."""
+    sections = parse_sections(text)
     result = {
-        "original_tone": "",
+        "original_tone": section_text(sections, "ORIGINAL TONE"),
         "tone_options": []
     }
 
-    # Extract original tone
-    original_tone = extract_text_between(text, "ORIGINAL TONE:",
-                                      ["TARGET TONE:", "FORMAL TONE VERSION:"])
-    if original_tone:
-        result["original_tone"] = original_tone
-
     # Check if it's a specific target tone rewrite
-    target_tone = extract_text_between(text, "TARGET TONE:", ["REWRITTEN TEXT:"])
-    rewritten_text = extract_text_between(text, "REWRITTEN TEXT:", [])
+    target_tone = section_text(sections, "TARGET TONE")
+    rewritten_text = section_text(sections, "REWRITTEN TEXT")
 
     if target_tone and rewritten_text:
         result["target_tone"] = target_tone
@@ -280,63 +1270,14 @@ def extract_alternatives_info(text):
         return result
 
     # Check for multiple tone options
-    formal_tone = extract_text_between(text, "FORMAL TONE VERSION:",
-                                   ["FRIENDLY TONE VERSION:", "PERSUASIVE TONE VERSION:"])
-
-    friendly_tone = extract_text_between(text, "FRIENDLY TONE VERSION:",
-                                     ["PERSUASIVE TONE VERSION:"])
-
-    persuasive_tone = extract_text_between(text, "PERSUASIVE TONE VERSION:", [])
-
-    if formal_tone:
-        result["tone_options"].append({"tone": "Formal", "text": formal_tone})
-
-    if friendly_tone:
-        result["tone_options"].append({"tone": "Friendly", "text": friendly_tone})
-
-    if persuasive_tone:
-        result["tone_options"].append({"tone": "Persuasive", "text": persuasive_tone})
+    for tone in ["Formal", "Friendly", "Persuasive"]:
+        tone_text = section_text(sections, f"{tone.upper()} TONE VERSION")
+        if tone_text:
+            result["tone_options"].append({"tone": tone, "text": tone_text})
 
     return result
 
 
-def extract_text_between(text, start_marker, end_markers):
-    """
-    Extract text between a start marker and the first occurrence of any end marker.
-
-    Args:
-        text: The text to search in
-        start_marker: The starting marker
-        end_markers: List of possible end markers
-
-    Returns:
-        Extracted text or empty string if not found
-    """
-    if not text or not start_marker:
-        return ""
-
-    # Find the start position
-    start_pos = text.find(start_marker)
-    if start_pos == -1:
-        return ""
-
-    # Move past the start marker
-    start_pos += len(start_marker)
-
-    # Find the earliest end marker
-    end_pos = len(text)
-    for marker in end_markers:
-        if not marker:
-            continue
-        pos = text.find(marker, start_pos)
-        if pos != -1 and pos < end_pos:
-            end_pos = pos
-
-    # Extract the text
-    extracted = text[start_pos:end_pos].strip()
-    return extracted
-
-
 def main():
     """Run the tests with detailed output."""
     # Create a test suite
@@ -345,6 +1286,26 @@ def main():
     suite.addTest(TestAlbanianTextAgent('test_tone_analysis'))
     suite.addTest(TestAlbanianTextAgent('test_tone_rewriting'))
     suite.addTest(TestAlbanianTextAgent('test_comprehensive_analysis'))
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(TestResponseCache))
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(TestChunking))
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(TestStructuredOutput))
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(TestSectionParser))
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(TestJobQueue))
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(TestSingleFlight))
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(TestRateLimiter))
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(TestToolMetrics))
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(TestFakeLLM))
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(TestCassette))
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(TestPrecheck))
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(TestToneClassifier))
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(TestNearDuplicateCache))
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(TestIncrementalAnalysis))
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(TestAPI))
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(TestBatchAnalysis))
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(TestLLMRegistry))
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(TestToolTimeout))
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(TestAsyncAnalysis))
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(TestStreaming))
 
     # Run the tests
     runner = unittest.TextTestRunner(verbosity=2)